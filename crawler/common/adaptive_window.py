@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: Florian Maurer
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import logging
+import time
+
+from sqlalchemy import text
+
+log = logging.getLogger("adaptive_window")
+log.setLevel(logging.INFO)
+
+
+class AdaptiveWindow:
+    """
+    Splits a time range into request windows whose size adapts to the responses.
+    Windows grow while responses are small and fast and shrink on errors
+    or slow and large responses.
+    The learned size is stored per endpoint in the table window_sizes
+    of the crawler schema, so that the next run starts with it.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        engine of the crawler
+    endpoint : str
+        name under which the learned window size is stored
+    initial : timedelta
+        window size if nothing was learned yet
+    minimum : timedelta
+        smallest window size, the window size is always a multiple of it
+    maximum : timedelta
+        largest window size
+    target_seconds : float
+        responses slower than this shrink the window
+    max_rows : int
+        responses with more rows than this shrink the window
+    """
+
+    def __init__(
+        self,
+        engine,
+        endpoint: str,
+        initial,
+        minimum,
+        maximum,
+        target_seconds: float = 30,
+        max_rows: int = 100000,
+    ):
+        self.engine = engine
+        self.endpoint = endpoint
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.max_rows = max_rows
+        self.size = self.load_size() or self.clip(initial)
+
+    def clip(self, size):
+        steps = max(1, round(size / self.minimum))
+        return min(self.maximum, self.minimum * steps)
+
+    def load_size(self):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    text(
+                        "CREATE TABLE IF NOT EXISTS window_sizes (endpoint text PRIMARY KEY, seconds double precision)"
+                    )
+                )
+                row = conn.execute(
+                    text("SELECT seconds FROM window_sizes WHERE endpoint = :endpoint"),
+                    {"endpoint": self.endpoint},
+                ).fetchone()
+        except Exception as e:
+            log.error(f"could not load window size of {self.endpoint}: {e}")
+            return None
+        if row is None:
+            return None
+        return self.clip(self.minimum * (row[0] / self.minimum.total_seconds()))
+
+    def save_size(self):
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    text("""
+                    INSERT INTO window_sizes (endpoint, seconds)
+                    VALUES (:endpoint, :seconds)
+                    ON CONFLICT (endpoint) DO UPDATE SET seconds = EXCLUDED.seconds
+                    """),
+                    {"endpoint": self.endpoint, "seconds": self.size.total_seconds()},
+                )
+        except Exception as e:
+            log.error(f"could not save window size of {self.endpoint}: {e}")
+
+    def adapt(self, duration: float, rows: int):
+        if duration > self.target_seconds or rows > self.max_rows:
+            self.size = self.clip(self.size / 2)
+        elif duration < self.target_seconds / 2 and rows < self.max_rows / 2:
+            self.size = self.clip(self.size * 2)
+
+    def fetch_range(self, start, end, fetch):
+        """
+        Fetches the range from start to end in consecutive windows.
+        A failed window is retried with half the size.
+        If it fails with the minimum size, the error is logged and the range ends there,
+        as the callers resume from the latest stored timestamp and would not fetch
+        a skipped window again.
+
+        Parameters
+        ----------
+        start :
+            start of the range
+        end :
+            end of the range
+        fetch : Callable
+            fetch(start, end) returns a DataFrame or None and raises on errors
+
+        Yields
+        ------
+        tuple
+            start and end of the window and the result of fetch
+        """
+        current = start
+        while current < end:
+            window_end = min(current + self.size, end)
+            begin = time.monotonic()
+            try:
+                result = fetch(current, window_end)
+            except Exception as e:
+                if self.size <= self.minimum:
+                    log.error(
+                        f"{self.endpoint} failed for {current} - {window_end}, stopping: {e}"
+                    )
+                    break
+                self.size = self.clip(self.size / 2)
+                log.info(f"{self.endpoint} retrying with window {self.size}: {e}")
+                continue
+            rows = 0 if result is None else len(result)
+            # the last window of a range is usually shorter and says little about the size
+            if window_end - current >= self.size:
+                self.adapt(time.monotonic() - begin, rows)
+            yield current, window_end, result
+            current = window_end
+        self.save_size()
@@ -1,6 +1,9 @@
+import csv
 from datetime import date
+from io import StringIO
 
 from sqlalchemy import create_engine, text
+from sqlalchemy.dialects.postgresql import insert
 
 from .config import db_uri
 
@@ -22,6 +25,38 @@ def create_schema_only(engine, schema_name: str) -> None:
         conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema_name}"))
 
 
+def insert_on_conflict_nothing(table, conn, keys: list[str], data_iter):
+    """
+    insertion method for DataFrame.to_sql which skips rows
+    that already exist according to the primary key of the table
+    """
+    data = [dict(zip(keys, row)) for row in data_iter]
+    stmt = insert(table.table).values(data).on_conflict_do_nothing()
+    result = conn.execute(stmt)
+    return result.rowcount
+
+
+def psql_insert_copy(table, conn, keys: list[str], data_iter):
+    """
+    insertion method for DataFrame.to_sql which uses COPY for bulk loading
+    """
+    # gets a DBAPI connection that can provide a cursor
+    with conn.connection.cursor() as cur:
+        s_buf = StringIO()
+        writer = csv.writer(s_buf)
+        writer.writerows(data_iter)
+        s_buf.seek(0)
+
+        columns = ", ".join(f'"{k}"' for k in keys)
+        if table.schema:
+            table_name = f"{table.schema}.{table.name}"
+        else:
+            table_name = table.name
+
+        sql = f"COPY {table_name} ({columns}) FROM STDIN WITH CSV"
+        cur.copy_expert(sql=sql, file=s_buf)
+
+
 def set_metadata_only(engine, metadata_info: dict[str, str]):
     for key in ["concave_hull_geometry", "temporal_start", "temporal_end", "contact"]:
         if key not in metadata_info.keys():
@@ -0,0 +1,33 @@
+# SPDX-FileCopyrightText: Florian Maurer
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Limits the number of calls per second across all threads which share it.
+
+    Parameters
+    ----------
+    calls_per_second : float
+        maximum number of calls per second
+    """
+
+    def __init__(self, calls_per_second: float):
+        self.interval = 1 / calls_per_second
+        self.lock = threading.Lock()
+        self.next_call = time.monotonic()
+
+    def wait(self):
+        """
+        Blocks until the next call is allowed.
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
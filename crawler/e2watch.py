@@ -5,6 +5,7 @@
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, timedelta
 
 import pandas as pd
@@ -15,6 +16,8 @@ from common.base_crawler import BaseCrawler
 
 log = logging.getLogger("e2watch")
 default_start_date = "2023-01-01 06:00:00"
+# number of buildings whose data is written in one transaction
+BUILDINGS_PER_BATCH = 20
 metadata_info = {
     "schema_name": "e2watch",
     "data_source": "https://stadt-aachen.e2watch.de/",
@@ -102,81 +105,100 @@ class E2WatchCrawler(BaseCrawler):
         df = df.set_index(["bilanzkreis_id"])
         return df
 
-    def get_data_per_building(self, buildings: pd.DataFrame):
+    def get_building_data(self, bilanzkreis_id, latest: pd.Timestamp):
         energy = ["strom", "wasser", "waerme"]
         end_date = date.today().strftime("%d.%m.%Y")
+        start_date = latest + timedelta(hours=1)
+        if start_date.tzinfo is not None:
+            start_date_tz = start_date.tz_convert("Europe/Berlin")
+        else:
+            start_date_tz = start_date.tz_localize("UTC").tz_convert("Europe/Berlin")
+        start_date_str = start_date_tz.strftime("%d.%m.%Y %H:%M:%S")
+
+        df_last = pd.DataFrame([])
+        for measurement in energy:
+            url = f"https://stadt-aachen.e2watch.de/gebaeude/getMainChartData/{bilanzkreis_id}?medium={measurement}&from={start_date_str}&to={end_date}&type=stundenverbrauch"
+            log.info(url)
+            response = requests.get(url)
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                log.error(f"Could not get data for building: {bilanzkreis_id} {e}")
+                continue
+            data = json.loads(response.text)
+            timeseries = pd.DataFrame.from_dict(data["result"]["series"][0]["data"])
+            if timeseries.empty:
+                log.info(f"Received empty data for building: {bilanzkreis_id}")
+                continue
+            timeseries[0] = pd.to_datetime(timeseries[0], unit="ms", utc=True)
+            timeseries.columns = [
+                "timestamp",
+                (
+                    measurement + "_kwh"
+                    if measurement in ("strom", "waerme")
+                    else measurement + "_m3"
+                ),
+            ]
+            temperature = pd.DataFrame.from_dict(data["result"]["series"][1]["data"])
+            if temperature.empty:
+                log.info(f"Received empty temperature for building: {bilanzkreis_id}")
+                continue
+            temperature[0] = pd.to_datetime(temperature[0], unit="ms", utc=True)
+            temperature.columns = ["timestamp", "temperatur"]
+            timeseries = pd.merge(timeseries, temperature, on=["timestamp"])
 
-        for bilanzkreis_id in buildings.index.values:
-            df_last = pd.DataFrame([])
-            for measurement in energy:
-                start_date = self.select_latest(bilanzkreis_id) + timedelta(hours=1)
-                if start_date.tzinfo is not None:
-                    start_date_tz = start_date.tz_convert("Europe/Berlin")
-                else:
-                    start_date_tz = start_date.tz_localize("UTC").tz_convert(
-                        "Europe/Berlin"
-                    )
-                start_date_str = start_date_tz.strftime("%d.%m.%Y %H:%M:%S")
-                url = f"https://stadt-aachen.e2watch.de/gebaeude/getMainChartData/{bilanzkreis_id}?medium={measurement}&from={start_date_str}&to={end_date}&type=stundenverbrauch"
-                log.info(url)
-                response = requests.get(url)
+            if not df_last.empty:
+                df_last = pd.merge(timeseries, df_last, on=["timestamp", "temperatur"])
+
+            else:
+                df_last = timeseries
+
+        if not df_last.empty:
+            df_last.insert(0, "bilanzkreis_id", bilanzkreis_id)
+        return df_last
+
+    def get_data_per_building(self, buildings: pd.DataFrame, max_workers=8):
+        """
+        Fetches the data of all buildings concurrently
+        and yields the data of each building once it is complete.
+        """
+        latest = self.select_latest_per_building()
+        default = pd.to_datetime(default_start_date)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    self.get_building_data,
+                    bilanzkreis_id,
+                    latest.get(str(bilanzkreis_id), default),
+                ): bilanzkreis_id
+                for bilanzkreis_id in buildings.index.values
+            }
+            for future in as_completed(futures):
                 try:
-                    response.raise_for_status()
-                except requests.exceptions.HTTPError as e:
-                    log.error(f"Could not get data for building: {bilanzkreis_id} {e}")
-                    continue
-                data = json.loads(response.text)
-                timeseries = pd.DataFrame.from_dict(data["result"]["series"][0]["data"])
-                if timeseries.empty:
-                    log.info(f"Received empty data for building: {bilanzkreis_id}")
-                    continue
-                timeseries[0] = pd.to_datetime(timeseries[0], unit="ms", utc=True)
-                timeseries.columns = [
-                    "timestamp",
-                    (
-                        measurement + "_kwh"
-                        if measurement in ("strom", "waerme")
-                        else measurement + "_m3"
-                    ),
-                ]
-                temperature = pd.DataFrame.from_dict(
-                    data["result"]["series"][1]["data"]
-                )
-                if temperature.empty:
-                    log.info(
-                        f"Received empty temperature for building: {bilanzkreis_id}"
-                    )
-                    continue
-                temperature[0] = pd.to_datetime(temperature[0], unit="ms", utc=True)
-                temperature.columns = ["timestamp", "temperatur"]
-                timeseries = pd.merge(timeseries, temperature, on=["timestamp"])
-
-                if not df_last.empty:
-                    df_last = pd.merge(
-                        timeseries, df_last, on=["timestamp", "temperatur"]
-                    )
-
-                else:
-                    df_last = timeseries
+                    yield future.result()
+                except Exception as e:
+                    log.error(f"Could not get data for building: {futures[future]} {e}")
 
-            if not df_last.empty:
-                df_last.insert(0, "bilanzkreis_id", bilanzkreis_id)
-            yield df_last
-
-    def select_latest(self, bilanzkreis_id) -> pd.Timestamp:
-        # day = default_start_date
-        # today = date.today().strftime('%d.%m.%Y')
-        # sql = f"select timestamp from e2watch where timestamp > '{day}' and timestamp < '{today}' order by timestamp desc limit 1"
-        sql = f"select timestamp from e2watch where bilanzkreis_id='{bilanzkreis_id}' order by timestamp desc limit 1"
+    def select_latest_per_building(self) -> dict[str, pd.Timestamp]:
+        sql = "select bilanzkreis_id, max(timestamp) as timestamp from e2watch group by bilanzkreis_id"
         try:
             with self.engine.begin() as conn:
-                latest = pd.read_sql(sql, conn, parse_dates=["timestamp"]).values[0][0]
-            latest = pd.to_datetime(latest, unit="ns")
-            log.info(f"The latest date in the database is {latest}")
-            return latest
+                latest = pd.read_sql(sql, conn, parse_dates=["timestamp"])
+            log.info(f"The latest dates of {len(latest)} buildings are in the database")
+            # the buildings from the csv file have integer ids
+            return dict(zip(latest["bilanzkreis_id"].astype(str), latest["timestamp"]))
         except Exception as e:
             log.info(f"Using the default start date {e}")
-            return pd.to_datetime(default_start_date)
+            return {}
+
+    def write_buildings_data(self, frames: list[pd.DataFrame]):
+        df = pd.concat(frames).set_index(["timestamp", "bilanzkreis_id"])
+        # delete timezone duplicate
+        # https://stackoverflow.com/a/34297689
+        df = df[~df.index.duplicated(keep="first")]
+        with self.engine.begin() as conn:
+            df.to_sql("e2watch", con=conn, if_exists="append")
+        log.info(f"wrote {len(df)} rows of {len(frames)} buildings")
 
     def feed(self, buildings: pd.DataFrame):
         sql = "select * from buildings"
@@ -188,21 +210,16 @@ class E2WatchCrawler(BaseCrawler):
                     buildings.to_sql("buildings", con=conn, if_exists="append")
         except Exception as e:
             log.info(f"Probably no database connection: {e}")
+        frames = []
         for data_for_building in self.get_data_per_building(buildings):
             if data_for_building.empty:
                 continue
-            df_for_building = data_for_building.set_index(
-                ["timestamp", "bilanzkreis_id"]
-            )
-            # delete timezone duplicate
-            # https://stackoverflow.com/a/34297689
-            df_for_building = df_for_building[
-                ~df_for_building.index.duplicated(keep="first")
-            ]
-
-            log.info(df_for_building)
-            with self.engine.begin() as conn:
-                df_for_building.to_sql("e2watch", con=conn, if_exists="append")
+            frames.append(data_for_building)
+            if len(frames) >= BUILDINGS_PER_BATCH:
+                self.write_buildings_data(frames)
+                frames = []
+        if frames:
+            self.write_buildings_data(frames)
 
 
 def main(schema_name):
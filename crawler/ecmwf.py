@@ -2,12 +2,10 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
-import csv
 import glob
 import logging
 import os
 from datetime import date, datetime, timedelta
-from io import StringIO
 
 import cdsapi
 import geopandas as gpd
@@ -17,6 +15,7 @@ import xarray as xr
 from shapely.geometry import Point
 from sqlalchemy import create_engine, text
 
+from common.base_crawler import psql_insert_copy
 from config import db_uri
 
 """
@@ -106,24 +105,6 @@ def save_data(request, ecmwf_client: cdsapi.Client):
     ecmwf_client.retrieve("reanalysis-era5-land", request, save_downloaded_files_path)
 
 
-def psql_insert_copy(table, conn, keys: list[str], data_iter):
-    # gets a DBAPI connection that can provide a cursor
-    with conn.connection.cursor() as cur:
-        s_buf = StringIO()
-        writer = csv.writer(s_buf)
-        writer.writerows(data_iter)
-        s_buf.seek(0)
-
-        columns = ", ".join(f'"{k}"' for k in keys)
-        if table.schema:
-            table_name = f"{table.schema}.{table.name}"
-        else:
-            table_name = table.name
-
-        sql = f"COPY {table_name} ({columns}) FROM STDIN WITH CSV"
-        cur.copy_expert(sql=sql, file=s_buf)
-
-
 def build_dataframe(engine, request: dict, write_lat_lon: bool = True):
     file_path = os.path.realpath(
         os.path.join(
@@ -13,13 +13,17 @@ with sshfs you can use:
 `sshfs root@eex:/root/eex /mnt/eex/`
 """
 
+import hashlib
+import io
 import logging
 import os
 import os.path as osp
 import pathlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from glob import glob
 
 import pandas as pd
+from sqlalchemy import text
 
 from common.base_crawler import BaseCrawler
 
@@ -40,6 +44,8 @@ eex_data_path = str(pathlib.Path.home()) + "/eex"
 # eex_data_path = '/mnt/eex'
 # limit files per type which are read
 FIRST_X = int(1e9)
+# record types of the market files which are stored in their own table
+RECORD_TYPES = ["ST", "PR", "OT", "SP", "IL"]
 
 
 """
@@ -69,68 +75,95 @@ No further parsing is needed else.
 """
 
 
+def read_eex_trade_spot_file(filename):
+    df = pd.read_csv(filename, skiprows=1, index_col="Trade ID")
+    df["Time Stamp"] = pd.to_datetime(df["Time Stamp"])
+    df["Date"] = pd.to_datetime(df["Date"])
+    if "Quantity (MW)" in df.columns:
+        df["Volume (MW)"] = df["Quantity (MW)"]
+        del df["Quantity (MW)"]
+    return df
+
+
+def read_eex_market_file(filename, name):
+    """
+    Reads the lines of every record type of the market file into its own table.
+
+    Returns
+    -------
+    dict[str, pd.DataFrame]
+        table name -> records of the record type
+    """
+    # lines are routed to the record type they begin with, 'AL' is not stored
+    buffers = {key: [] for key in RECORD_TYPES}
+    header_dict = {}
+
+    with open(filename) as f:
+        for line in f:
+            # ignore lines beginning with a hashtag comment
+            if line.startswith("#"):
+                if line[2:].startswith("Data type("):
+                    key = line[12:14]
+                    header_dict[key] = line[2:].split(";")
+                continue
+            lines = buffers.get(line[:2])
+            if lines is not None:
+                lines.append(line)
+
+    tables = {}
+    for key, lines in buffers.items():
+        if not lines:
+            log.debug(f"no lines for {key} - not writing")
+        else:
+            df = pd.read_csv(
+                io.StringIO("".join(lines)),
+                sep=";",
+                decimal=",",
+                header=None,
+            )  # , index_col='Trade ID')
+            df.columns = header_dict[key]
+
+            if key in ["OT", "PR"]:
+                needed_columns = ["Strike", "Underlying", "Type"]
+                for col in needed_columns:
+                    if col not in df.columns:
+                        df[col] = None
+
+            tables[f"{name}_{key}"] = df
+    return tables
+
+
+def file_hash(filename):
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def parse_file(filename, name, known_hash=None):
+    """
+    Parses one file of the mirror in a worker process.
+    If the content did not change since it was loaded, nothing is parsed.
+
+    Returns
+    -------
+    tuple
+        hash of the file and dict of table name -> DataFrame
+    """
+    hash_ = file_hash(filename)
+    if hash_ == known_hash:
+        return hash_, {}
+    if "trade_data/power/" in filename and "/spot/csv/" in filename:
+        return hash_, {name: read_eex_trade_spot_file(filename)}
+    return hash_, read_eex_market_file(filename, name)
+
+
 class EEXCrawler(BaseCrawler):
     def __init__(self, schema_name):
         super().__init__(schema_name)
-
-    def read_eex_trade_spot_file(self, filename):
-        df = pd.read_csv(filename, skiprows=1, index_col="Trade ID")
-        df["Time Stamp"] = pd.to_datetime(df["Time Stamp"])
-        df["Date"] = pd.to_datetime(df["Date"])
-        if "Quantity (MW)" in df.columns:
-            df["Volume (MW)"] = df["Quantity (MW)"]
-            del df["Quantity (MW)"]
-        return df
-
-    def read_eex_market_file(self, filename, name):
-        try:
-            # ignore lines beginning with a hashtag comment
-            exclude_lists = {
-                "ST": [],
-                "PR": [],
-                "OT": [],
-                "SP": [],
-                "IL": [],
-                # 'AL' : [],
-            }
-
-            header_dict = {}
-
-            for i, line in enumerate(open(filename)):
-                if line.startswith("#"):
-                    if line[2:].startswith("Data type("):
-                        key = line[12:14]
-                        header_dict[key] = line[2:].split(";")
-
-                for key in exclude_lists.keys():
-                    if not line.startswith(key):
-                        exclude_lists[key].append(i)
-            line_count = i + 1
-
-            for key, exclude_list in exclude_lists.items():
-                if len(exclude_lists[key]) == line_count:
-                    log.debug(f"all lines excluded for {key} - not writing")
-                else:
-                    df = pd.read_csv(
-                        filename,
-                        skiprows=exclude_list,
-                        sep=";",
-                        decimal=",",
-                        header=None,
-                    )  # , index_col='Trade ID')
-                    df.columns = header_dict[key]
-
-                    if key in ["OT", "PR"]:
-                        needed_columns = ["Strike", "Underlying", "Type"]
-                        for col in needed_columns:
-                            if col not in df.columns:
-                                df[col] = None
-
-                    with self.engine.begin() as conn:
-                        df.to_sql(f"{name}_{key}", conn, if_exists="append")
-                    log.debug(osp.basename(filename)[:-4])
-        except Exception as e:
-            log.error(f"could not save {filename} - {e}")
+        # files of the mirror which are found by the download methods
+        self.files = []
 
     def save_trade_data_per_day(self, year_path, name):
         log.debug(year_path)
@@ -141,17 +174,127 @@ class EEXCrawler(BaseCrawler):
         ]:  # XXX limit here for debugging
             if "trade_data/power/" in file and "/spot/csv/" in file:
                 if "intraday_transactions" in file:
-                    try:
-                        df = self.read_eex_trade_spot_file(file)
-                        with self.engine.begin() as conn:
-                            df.to_sql(name, conn, if_exists="append")
-                    except Exception:
-                        log.error(f"error writing {file} to db")
+                    self.files.append((file, name))
                 else:
                     log.error(f"file does not contain intraday_transactions: {file}")
 
             else:
-                self.read_eex_market_file(file, name)
+                self.files.append((file, name))
+
+    def create_manifest(self):
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("""
+                CREATE TABLE IF NOT EXISTS manifest (
+                    path text PRIMARY KEY,
+                    size bigint,
+                    mtime double precision,
+                    hash text,
+                    rows bigint,
+                    loaded timestamp DEFAULT now()
+                )
+                """)
+            )
+
+    def load_manifest(self) -> dict:
+        with self.engine.begin() as conn:
+            result = conn.execute(text("SELECT path, size, mtime, hash FROM manifest"))
+            return {path: (size, mtime, hash_) for path, size, mtime, hash_ in result}
+
+    def seed_manifest(self, max_workers=None):
+        """
+        Adds the found files to the manifest without loading them.
+        Used once for databases which were loaded before the manifest existed,
+        so that their files are not appended a second time.
+        """
+        self.create_manifest()
+        filenames = [filename for filename, _ in self.files]
+        with (
+            ProcessPoolExecutor(max_workers=max_workers) as pool,
+            self.engine.begin() as conn,
+        ):
+            for filename, hash_ in zip(filenames, pool.map(file_hash, filenames)):
+                stat = os.stat(filename)
+                conn.execute(
+                    text("""
+                    INSERT INTO manifest (path, size, mtime, hash)
+                    VALUES (:path, :size, :mtime, :hash)
+                    ON CONFLICT (path) DO NOTHING
+                    """),
+                    {
+                        "path": filename,
+                        "size": stat.st_size,
+                        "mtime": stat.st_mtime,
+                        "hash": hash_,
+                    },
+                )
+        log.info(f"added {len(filenames)} files to the manifest")
+        self.files = []
+
+    def write_file(self, filename, stat, hash_, tables):
+        """
+        Writes the tables of one file and its manifest entry in one transaction,
+        so that a file is either loaded completely or loaded again on the next run.
+        """
+        rows = 0
+        with self.engine.begin() as conn:
+            for table_name, df in tables.items():
+                df.to_sql(table_name, conn, if_exists="append")
+                rows += len(df)
+            conn.execute(
+                text("""
+                INSERT INTO manifest (path, size, mtime, hash, rows)
+                VALUES (:path, :size, :mtime, :hash, :rows)
+                ON CONFLICT (path) DO UPDATE SET
+                    size = EXCLUDED.size, mtime = EXCLUDED.mtime, hash = EXCLUDED.hash,
+                    rows = CASE WHEN :rows > 0 THEN EXCLUDED.rows ELSE manifest.rows END,
+                    loaded = now()
+                """),
+                {
+                    "path": filename,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "hash": hash_,
+                    "rows": rows,
+                },
+            )
+        return rows
+
+    def ingest_files(self, max_workers=None):
+        """
+        Parses the found files in a process pool and writes them.
+        Files whose size and modification time match the manifest are skipped,
+        files whose hash matches are not parsed again.
+        Files whose content changed since they were loaded are skipped and reported,
+        as their previous rows can not be told apart from other rows.
+        """
+        self.create_manifest()
+        manifest = self.load_manifest()
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {}
+            for filename, name in self.files:
+                stat = os.stat(filename)
+                size, mtime, known_hash = manifest.get(filename, (None, None, None))
+                if size == stat.st_size and mtime == stat.st_mtime:
+                    continue
+                future = pool.submit(parse_file, filename, name, known_hash)
+                futures[future] = (filename, stat, known_hash)
+            log.info(f"parsing {len(futures)} of {len(self.files)} files")
+            for future in as_completed(futures):
+                filename, stat, known_hash = futures[future]
+                try:
+                    hash_, tables = future.result()
+                    if known_hash and tables:
+                        log.error(
+                            f"{filename} changed since it was loaded - skipping it, "
+                            "delete its rows and manifest entry to load it again"
+                        )
+                        continue
+                    rows = self.write_file(filename, stat, hash_, tables)
+                    log.debug(f"wrote {rows} rows of {osp.basename(filename)}")
+                except Exception as e:
+                    log.error(f"could not save {filename} - {e}")
+        self.files = []
 
     def get_trade_data_per_year(self, data_path, name):
         log.info(name)
@@ -202,6 +345,11 @@ def main(schema_name):
     crawler.download_without_country(eex_data_path + "/market_data/environmental")
     crawler.download_with_country(eex_data_path + "/market_data/power")
     crawler.download_with_country(eex_data_path + "/market_data/natgas")
+    # set once for databases which were loaded before the manifest existed
+    if os.getenv("EEX_SEED_MANIFEST", "false").lower() == "true":
+        crawler.seed_manifest()
+    else:
+        crawler.ingest_files()
     crawler.set_metadata(metadata_info)
 
 
@@ -211,7 +359,7 @@ if __name__ == "__main__":
     main("eex-pricit")
     # crawler = EEXCrawler(db_uri)
     # path_xx = '~/eex/trade_data/power/de/spot/csv/2021/20210909/intraday_transactions_germany_2021-09-09.csv'
-    # df = crawler.read_eex_trade_spot_file(path_xx)
+    # df = read_eex_trade_spot_file(path_xx)
     # df['Time Stamp'] = pd.to_datetime(df['Time Stamp'])
     # df['Date'] = pd.to_datetime(df['Date'])
     # import matplotlib.pyplot as plt
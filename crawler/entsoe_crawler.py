@@ -11,17 +11,24 @@ The resulting data is not available under an open-source license and should not
 import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from functools import partial
 
 import pandas as pd
 from entsoe import EntsoePandasClient
 from entsoe.exceptions import InvalidBusinessParameterError, NoMatchingDataError
 from entsoe.mappings import NEIGHBOURS, PSRTYPE_MAPPINGS, Area
 from requests.exceptions import HTTPError
-from sqlalchemy import text
+from sqlalchemy import inspect, text
 from tqdm import tqdm
 
-from common.base_crawler import BaseCrawler
+from common.adaptive_window import AdaptiveWindow
+from common.base_crawler import (
+    BaseCrawler,
+    insert_on_conflict_nothing,
+    psql_insert_copy,
+)
 
 log = logging.getLogger("entsoe")
 log.setLevel(logging.INFO)
@@ -77,6 +84,43 @@ def sanitize_series(seriesname):
     return st
 
 
+def is_numeric_frame(df):
+    """
+    Checks if all columns except country are numeric
+    and can therefore be stored in long format.
+    """
+    values = df.drop(columns="country")
+    return len(values.select_dtypes("number").columns) == len(values.columns)
+
+
+def quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def wide_to_long(df):
+    """
+    Converts a time indexed DataFrame with one column per series
+    and a country column into long format.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+
+    Returns
+    -------
+    dat: pd.DataFrame
+        DataFrame with columns index, country, series, value
+    """
+    dat = df.rename_axis("index").melt(
+        id_vars="country", var_name="series", value_name="value", ignore_index=False
+    )
+    return dat.reset_index()
+
+
 def calculate_nett_generation(df):
     """
     Calculates the difference between columns ending with _actual_aggregated and _actual_consumption.
@@ -122,8 +166,18 @@ class EntsoeCrawler(BaseCrawler):
     class to allow easier crawling of ENTSO-E timeseries data
     """
 
-    def __init__(self, schema_name):
+    def __init__(self, schema_name, max_workers=4, long_format=False):
         super().__init__(schema_name)
+        # number of concurrent requests against the transparency platform
+        self.max_workers = max_workers
+        # store numeric timeseries as (index, country, series, value)
+        self.long_format = long_format
+        # long format tables written in this run -> (crossborder, written series)
+        self.long_tables = {}
+        # series which are columns of the wide view of each long format table
+        self.view_series = {}
+        # procedures which were written in wide format
+        self.wide_tables = set()
 
     def init_base_sql(self):
         """
@@ -142,6 +196,85 @@ class EntsoeCrawler(BaseCrawler):
             areas.to_sql("areas", conn, if_exists="replace")
             psrtype.to_sql("psrtype", conn, if_exists="replace")
 
+    def fetch_entsoe_df(self, country, proc, start, end):
+        """
+        Crawl data from ENTSO-E transparency platform and prepare it for the database
+
+        Parameters
+        ----------
+        country : str
+            2-letter country code
+        proc :
+            procedure of entsoe-py client
+        start : pd.Timestamp
+            start time
+        end : pd.Timestamp
+            end time
+
+        Returns
+        -------
+        data : pd.DataFrame | None
+            None if no data is available
+        """
+        try:
+            data = pd.DataFrame(proc(country, start=start, end=end))
+        except NoMatchingDataError:
+            log.error(f"no data found for {proc.__name__}, {country}, {start}, {end}")
+            return None
+        except HTTPError as e:
+            log.error(f"{e.response.status_code} - {e.response.reason}")
+            if e.response.status_code == 400:
+                log.error(
+                    f"error downloading {proc.__name__}, {country}, {start}, {end}: {e}"
+                )
+                return None
+            raise
+
+        # replace spaces and invalid chars in column names
+        data.columns = [sanitize_series(x).lower() for x in data.columns]
+        data = data.fillna(0)
+
+        # XXX could have used nett=True in entsoe-py client
+        # calculate difference betweeen agg and consumption
+        data = calculate_nett_generation(data)
+
+        # add country column
+        data["country"] = country
+        return data
+
+    def write_entsoe_df(self, data, tablename):
+        """
+        Write data of a country to the database
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            result of fetch_entsoe_df
+        tablename : str
+            name of the procedure
+        """
+        if self.long_format and is_numeric_frame(data):
+            self.write_long_format(wide_to_long(data), tablename)
+            return
+        self.wide_tables.add(tablename)
+        try:
+            with self.engine.begin() as conn:
+                data.to_sql(tablename, conn, if_exists="append")
+        except Exception as e:
+            with self.engine.begin() as conn:
+                log.info(f"handling {repr(e)} by concat")
+                # merge old data with new data
+                prev = pd.read_sql_query(
+                    f"select * from {tablename}",
+                    conn,
+                    index_col="index",
+                )
+                dat = pd.concat([prev, data])
+                # convert type as pandas needs it
+                dat.index = pd.to_datetime(dat.index, utc=True)
+                dat.to_sql(tablename, conn, if_exists="replace")
+                log.info(f"replaced table {tablename}")
+
     def fetch_and_write_entsoe_df_to_db(self, country, proc, start, end):
         """
         Crawl data from ENTSO-E transparency platform and write it to the database
@@ -163,56 +296,180 @@ class EntsoeCrawler(BaseCrawler):
         """
         try:
             try:
-                data = pd.DataFrame(proc(country, start=start, end=end))
-            except NoMatchingDataError:
-                raise
-            except HTTPError as e:
-                log.error(f"{e.response.status_code} - {e.response.reason}")
-                if e.response.status_code == 400:
-                    raise
-                else:
-                    log.info(f"retrying: {repr(e)}, {start}, {end}")
-                    time.sleep(10)
-                    data = pd.DataFrame(proc(country, start=start, end=end))
-
+                data = self.fetch_entsoe_df(country, proc, start, end)
             except Exception as e:
                 log.info(f"retrying: {repr(e)}, {start}, {end}")
                 time.sleep(10)
-                data = pd.DataFrame(proc(country, start=start, end=end))
+                data = self.fetch_entsoe_df(country, proc, start, end)
+            if data is not None:
+                self.write_entsoe_df(data, proc.__name__)
+        except Exception as e:
+            log.error(
+                f"error downloading {proc.__name__}, {country}, {start}, {end}: {e}"
+            )
 
-            # replace spaces and invalid chars in column names
-            data.columns = [sanitize_series(x).lower() for x in data.columns]
-            data = data.fillna(0)
+    def create_long_format_table(self, tablename):
+        """
+        Creates the compressed hypertable {tablename}_long
+        which stores a timeseries procedure in long format
 
-            # XXX could have used nett=True in entsoe-py client
-            # calculate difference betweeen agg and consumption
-            data = calculate_nett_generation(data)
+        Parameters
+        ----------
+        tablename : str
+            name of the procedure
+        """
+        long_table = f"{tablename}_long"
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    f'''CREATE TABLE IF NOT EXISTS "{long_table}" (
+                    "index" timestamp with time zone NOT NULL,
+                    country text NOT NULL,
+                    series text NOT NULL,
+                    value double precision,
+                    PRIMARY KEY (country, series, "index"));'''
+                )
+            )
+        self.create_compressed_hypertable(long_table, "country, series")
 
-            # add country column
-            data["country"] = country
-            try:
-                with self.engine.begin() as conn:
-                    data.to_sql(proc.__name__, conn, if_exists="append")
-            except Exception as e:
-                with self.engine.begin() as conn:
-                    log.info(f"handling {repr(e)} by concat")
-                    # merge old data with new data
-                    prev = pd.read_sql_query(
-                        f"select * from {proc.__name__}",
-                        conn,
-                        index_col="index",
+    def create_compressed_hypertable(self, tablename, segmentby):
+        """
+        Converts the table into a hypertable on index
+        with compression of chunks older than 30 days
+
+        Parameters
+        ----------
+        tablename : str
+            name of the table
+        segmentby : str
+            comma separated columns to segment the compressed data by
+        """
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    text(
+                        f"SELECT public.create_hypertable('{tablename}', 'index', if_not_exists => TRUE, migrate_data => TRUE);"
                     )
-                    dat = pd.concat([prev, data])
-                    # convert type as pandas needs it
-                    dat.index = pd.to_datetime(dat.index, utc=True)
-                    dat.to_sql(proc.__name__, conn, if_exists="replace")
-                    log.info(f"replaced table {proc.__name__}")
-        except NoMatchingDataError:
-            log.error(f"no data found for {proc.__name__}, {country}, {start}, {end}")
+                )
+                conn.execute(
+                    text(
+                        f'''ALTER TABLE "{tablename}" SET (timescaledb.compress, timescaledb.compress_segmentby = '{segmentby}', timescaledb.compress_orderby = '"index"');'''
+                    )
+                )
+                conn.execute(
+                    text(
+                        f"SELECT public.add_compression_policy('{tablename}', INTERVAL '30 days', if_not_exists => TRUE);"
+                    )
+                )
         except Exception as e:
-            log.error(
-                f"error downloading {proc.__name__}, {country}, {start}, {end}: {e}"
+            log.error(f"could not create compressed hypertable {tablename}: {e}")
+
+    def write_long_format(self, data, tablename, crossborder=False):
+        """
+        Appends long format data to {tablename}_long.
+        Already existing rows are skipped, so no table rewrite is needed.
+        The table is set up on the first write of a run.
+        The wide view is updated by update_wide_view after all writes.
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            DataFrame with columns index, country, series, value
+        tablename : str
+            name of the procedure
+        crossborder : bool
+            passed to create_wide_view
+        """
+        if tablename not in self.long_tables:
+            self.create_long_format_table(tablename)
+            self.long_tables[tablename] = (crossborder, set())
+        data = data.dropna(subset=["value"])
+        with self.engine.begin() as conn:
+            data.to_sql(
+                f"{tablename}_long",
+                conn,
+                if_exists="append",
+                index=False,
+                method=insert_on_conflict_nothing,
+                chunksize=10000,
             )
+        if crossborder:
+            series = data["country"] + "-" + data["series"]
+        else:
+            series = data["series"]
+        self.long_tables[tablename][1].update(series.unique())
+
+    def update_wide_view(self, tablename):
+        """
+        Recreates the wide view of a long format table written in this run,
+        if series were written which are not yet columns of the view.
+
+        Parameters
+        ----------
+        tablename : str
+            name of the procedure
+        """
+        if tablename not in self.long_tables:
+            return
+        crossborder, series = self.long_tables[tablename]
+        known = self.view_series.get(tablename)
+        if known is not None and series <= known:
+            return
+        view_series = self.create_wide_view(tablename, crossborder)
+        if view_series is not None:
+            self.view_series[tablename] = view_series
+
+    def create_wide_view(self, tablename, crossborder=False):
+        """
+        Creates a view named like the procedure which pivots {tablename}_long
+        into the wide layout that was used before the long format existed.
+        The view is dropped and created again, as the columns of a view
+        can not be reordered by CREATE OR REPLACE VIEW.
+        If a wide table with that name already exists, the error is only logged.
+
+        Parameters
+        ----------
+        tablename : str
+            name of the procedure
+        crossborder : bool
+            if True, the columns are named {from}-{to} without country column
+
+        Returns
+        -------
+        series : set[str] | None
+            the series which are columns of the view, None if it could not be created
+        """
+        long_table = f"{tablename}_long"
+        try:
+            with self.engine.begin() as conn:
+                if crossborder:
+                    query = (
+                        f"select distinct country || '-' || series from {long_table}"
+                    )
+                else:
+                    query = f"select distinct series from {long_table}"
+                series = sorted(r[0] for r in conn.execute(text(query)))
+                if crossborder:
+                    key = "country || '-' || series"
+                    group = '"index"'
+                else:
+                    key = "series"
+                    group = '"index", country'
+                columns = ", ".join(
+                    f"max(value) FILTER (WHERE {key} = {quote_literal(s)}) AS {quote_identifier(s)}"
+                    for s in series
+                )
+                conn.execute(text(f'DROP VIEW IF EXISTS "{tablename}"'))
+                conn.execute(
+                    text(
+                        f'''CREATE VIEW "{tablename}" AS
+                        SELECT {group}, {columns} FROM "{long_table}" GROUP BY {group};'''
+                    )
+                )
+        except Exception as e:
+            log.error(f"could not create wide view {tablename}: {e}")
+            return None
+        return set(series)
 
     def get_latest_crawled_timestamp(self, start, delta, tablename, tz="Europe/Berlin"):
         """
@@ -243,6 +500,7 @@ class EntsoeCrawler(BaseCrawler):
             return start, delta
         else:
             try:
+                tablename = self.stored_table(tablename)
                 with self.engine.begin() as conn:
                     query = text(f'select max("index") from {tablename}')
                     d = conn.execute(query).fetchone()[0]
@@ -297,17 +555,176 @@ class EntsoeCrawler(BaseCrawler):
 
                 self.fetch_and_write_entsoe_df_to_db(country, proc, start_, end_)
 
+        self.create_wide_table_index(proc.__name__)
+        self.update_wide_view(proc.__name__)
+
+    def download_entsoe_missing(self, countries, proc, start, end):
+        """
+        Downloads only the intervals which are missing in the database
+        for each country, so that a country which failed before is resumed
+        without downloading the other countries again.
+        The intervals are requested in windows of adaptive size.
+
+        Parameters
+        ----------
+        countries : list[str]
+            list of country codes
+        proc :
+            procedure of entsoe-py
+        start : pd.Timestamp
+            earliest timestamp which should be available
+        end : pd.Timestamp
+            latest timestamp which should be available
+
+        Returns
+        -------
+
+        """
+        log.info(f"****** {proc.__name__} *******")
+        missing = self.get_missing_intervals(proc.__name__, countries, start, end)
+        intervals = [(c, s, e) for c in countries for s, e in missing[c]]
+        if not intervals:
+            log.info("nothing to do")
+            return
+
+        window = AdaptiveWindow(
+            self.engine,
+            proc.__name__,
+            initial=timedelta(days=30),
+            minimum=timedelta(days=1),
+            maximum=timedelta(days=365),
+        )
+        pbar = tqdm(intervals)
+        for country, start_, end_ in pbar:
+            fetch = partial(self.fetch_entsoe_df, country, proc)
+            for s, e, data in window.fetch_range(start_, end_, fetch):
+                pbar.set_description(f"{country} {s:%Y-%m-%d} to {e:%Y-%m-%d}")
+                if data is not None:
+                    self.write_entsoe_df(data, proc.__name__)
+
+        self.create_wide_table_index(proc.__name__)
+        self.update_wide_view(proc.__name__)
+
+    def get_missing_intervals(
+        self, tablename, countries, start, end, min_gap=pd.Timedelta(days=1)
+    ):
+        """
+        Finds the intervals per country which are not yet in the table.
+        Leading and trailing intervals as well as gaps between two stored
+        timestamps are detected in a single query.
+
+        Parameters
+        ----------
+        tablename : str
+            name of the table with country and index column
+        countries : list[str]
+            list of country codes
+        start : pd.Timestamp
+        end : pd.Timestamp
+        min_gap : pd.Timedelta
+            smaller holes are not considered as missing
+
+        Returns
+        -------
+        missing : dict[str, list[tuple[pd.Timestamp, pd.Timestamp]]]
+            missing intervals per country
+        """
+        tablename = self.stored_table(tablename)
+        query = text(
+            f"""
+            SELECT country, 'range' AS kind, min("index"), max("index")
+            FROM {tablename} GROUP BY country
+            UNION ALL
+            SELECT country, 'gap', prev, "index" FROM (
+                SELECT country, "index", lag("index") OVER (PARTITION BY country ORDER BY "index") AS prev
+                FROM (SELECT DISTINCT country, "index" FROM {tablename}) t
+            ) g
+            WHERE "index" - prev > :min_gap
+            """
+        )
+        try:
+            with self.engine.begin() as conn:
+                rows = conn.execute(query, {"min_gap": min_gap.to_pytimedelta()})
+                rows = rows.fetchall()
+        except Exception as e:
+            log.info(f"no data for {tablename} yet ({e})")
+            rows = []
+
+        missing = {country: [] for country in countries}
+        stored = set()
+        for country, kind, first, last in rows:
+            if country not in missing:
+                continue
+            gap_start = pd.Timestamp(first)
+            gap_end = pd.Timestamp(last)
+            if gap_start.tzinfo is None:
+                gap_start = gap_start.tz_localize(start.tz)
+                gap_end = gap_end.tz_localize(start.tz)
+            if kind == "range":
+                stored.add(country)
+                if gap_start - start > min_gap:
+                    missing[country].append((start, gap_start))
+                if end - gap_end > min_gap:
+                    missing[country].append((gap_end, end))
+            elif gap_end > start and gap_start < end:
+                missing[country].append((max(gap_start, start), min(gap_end, end)))
+        for country in countries:
+            if country not in stored:
+                missing[country] = [(start, end)]
+            missing[country].sort()
+        return missing
+
+    def stored_table(self, tablename):
+        """
+        Returns the table which stores the procedure.
+        Procedures with non-numeric data are written in wide format,
+        even if long format is enabled.
+
+        Parameters
+        ----------
+        tablename : str
+            name of the procedure
+        """
+        long_table = f"{tablename}_long"
+        if self.long_format and inspect(self.engine).has_table(long_table):
+            return long_table
+        return tablename
+
+    def create_wide_table_index(self, tablename):
+        """
+        Creates the index and hypertable of a procedure written in wide format.
+        Long format tables are set up when they are created
+        and the procedure name is their view.
+
+        Parameters
+        ----------
+        tablename : str
+            name of the procedure
+        """
+        if self.long_format and tablename not in self.wide_tables:
+            return
+        self.create_country_index_and_hypertable(tablename)
+
+    def create_country_index_and_hypertable(self, tablename):
+        """
+        creates the index on country and index as well as the hypertable
+
+        Parameters
+        ----------
+        tablename : str
+            name of the table
+        """
         # indexe anlegen für schnelles suchen
         try:
             with self.engine.begin() as conn:
-                log.info(f"creating index country_idx_{proc.__name__}")
+                log.info(f"creating index country_idx_{tablename}")
                 query = text(
-                    f'CREATE INDEX IF NOT EXISTS "country_idx_{proc.__name__}" ON "{proc.__name__}" ("country", "index");'
+                    f'CREATE INDEX IF NOT EXISTS "country_idx_{tablename}" ON "{tablename}" ("country", "index");'
                 )
                 conn.execute(query)
-                # query = text(f'CREATE INDEX IF NOT EXISTS "country_{proc.__name__}" ON "{proc.__name__}" ("country");')
+                # query = text(f'CREATE INDEX IF NOT EXISTS "country_{tablename}" ON "{tablename}" ("country");')
                 # conn.execute(query)
-                log.info(f"created indexes country_idx_{proc.__name__}")
+                log.info(f"created indexes country_idx_{tablename}")
         except Exception as e:
             log.error(f"could not create index if needed: {e}")
 
@@ -315,16 +732,50 @@ class EntsoeCrawler(BaseCrawler):
         try:
             with self.engine.begin() as conn:
                 query_create_hypertable = text(
-                    f"SELECT public.create_hypertable('{proc.__name__}', 'index', if_not_exists => TRUE, migrate_data => TRUE);"
+                    f"SELECT public.create_hypertable('{tablename}', 'index', if_not_exists => TRUE, migrate_data => TRUE);"
                 )
                 conn.execute(query_create_hypertable)
-            log.info(f"created hypertable {proc.__name__}")
+            log.info(f"created hypertable {tablename}")
         except Exception as e:
             log.error(f"could not create hypertable: {e}")
 
+    def fetch_crossborder(self, proc, n1, n2, start, end):
+        """
+        Fetches the transmission for a single border and direction
+
+        Parameters
+        ----------
+        proc :
+            crossborder procedure of entsoe-py client
+        n1 : str
+            area code of the exporting zone
+        n2 : str
+            area code of the importing zone
+        start : pd.Timestamp
+        end : pd.Timestamp
+
+        Returns
+        -------
+        data : pd.DataFrame | None
+            long format with columns index, from, to, value
+        """
+        try:
+            series = proc(n1, n2, start=start, end=end)
+        except (NoMatchingDataError, InvalidBusinessParameterError):
+            return None
+        except Exception as e:
+            log.error(f"Error crawling Crossboarders {n1}-{n2}: {e}")
+            return None
+        data = series.rename("value").rename_axis("index").reset_index()
+        data["from"] = n1.lower()
+        data["to"] = n2.lower()
+        return data
+
     def pull_crossborders(self, start, delta, times, proc, allZones=True):
         """
-        Pulls transmissions across borders from entsoe
+        Pulls transmissions across borders from entsoe.
+        The borders of a time window are fetched concurrently and
+        assembled into a single long format DataFrame.
 
         Parameters
         ----------
@@ -350,26 +801,41 @@ class EntsoeCrawler(BaseCrawler):
             log.info("nothing to do")
             return
 
+        borders = neighbours
+        if not allZones:
+            borders = neighbours[
+                (neighbours["from"].str.len() == 2) & (neighbours["to"].str.len() == 2)
+            ]
+
         for i in range(times):
-            data = pd.DataFrame()
             start_ = start + i * delta
             end_ = start + (i + 1) * delta
             log.info(start_)
 
-            for n1 in tqdm(NEIGHBOURS):
-                for n2 in NEIGHBOURS[n1]:
-                    try:
-                        if (len(n1) == 2 and len(n2) == 2) or allZones:
-                            dataN = proc(n1, n2, start=start_, end=end_)
-                            data[n1 + "-" + n2] = dataN
-                    except (NoMatchingDataError, InvalidBusinessParameterError):
-                        # log.info('no data found for ',n1,n2)
-                        pass
-                    except Exception as e:
-                        log.error(f"Error crawling Crossboarders {e}")
-                data = data.copy()
-
-            data.columns = [x.lower() for x in data.columns]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(self.fetch_crossborder, proc, n1, n2, start_, end_)
+                    for n1, n2 in zip(borders["from"], borders["to"])
+                ]
+                frames = [f.result() for f in tqdm(futures)]
+            frames = [f for f in frames if f is not None]
+            if not frames:
+                log.info(f"no crossborder data found for {start_} to {end_}")
+                continue
+            data = pd.concat(frames, ignore_index=True)
+
+            if self.long_format:
+                data = data.rename(columns={"from": "country", "to": "series"})
+                self.write_long_format(data, proc.__name__, crossborder=True)
+                continue
+
+            # keep the established wide layout with one column per border
+            data = data.pivot_table(
+                index="index",
+                columns=data["from"] + "-" + data["to"],
+                values="value",
+            )
+            data.columns.name = None
             try:
                 with self.engine.begin() as conn:
                     data.to_sql(proc.__name__, conn, if_exists="append")
@@ -395,6 +861,7 @@ class EntsoeCrawler(BaseCrawler):
                     conn.execute(query_create_hypertable)
             except Exception as e:
                 log.error(f"could not create hypertable: {e}")
+        self.update_wide_view(proc.__name__)
 
     def save_power_system_data(self):
         """
@@ -430,10 +897,156 @@ class EntsoeCrawler(BaseCrawler):
             df.to_sql("powersystemdata", conn, if_exists="replace")
         return df
 
-    def download_entsoe_plant_data(self, countries, client, start, delta, times):
+    def create_plant_tables(self):
+        """
+        Creates the dimension table plants keyed by EIC with integer ids
+        and the compressed hypertable generation_per_plant referencing them.
+        The views query_per_plant and plant_names provide the layout
+        of the tables which were used before.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("""
+                CREATE TABLE IF NOT EXISTS plants (
+                id serial PRIMARY KEY,
+                eic text UNIQUE NOT NULL,
+                name text,
+                type text,
+                country text);
+                """)
+            )
+            conn.execute(
+                text("""
+                CREATE TABLE IF NOT EXISTS generation_per_plant (
+                "index" timestamp with time zone NOT NULL,
+                plant_id integer NOT NULL REFERENCES plants (id),
+                value real,
+                PRIMARY KEY (plant_id, "index"));
+                """)
+            )
+        self.create_compressed_hypertable("generation_per_plant", "plant_id")
+        self.migrate_query_per_plant()
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("""
+                CREATE OR REPLACE VIEW query_per_plant AS
+                SELECT g."index", p.name, p.type, g.value, p.country
+                FROM generation_per_plant g JOIN plants p ON p.id = g.plant_id
+                """)
+            )
+            conn.execute(
+                text("""
+                CREATE OR REPLACE VIEW plant_names AS
+                SELECT name, country, type FROM plants
+                """)
+            )
+
+    def migrate_query_per_plant(self):
+        """
+        Moves the data of the former table query_per_plant into the plant tables
+        and drops it and the table plant_names, so that views can take their names.
+        The former table has no EIC, so its plants get the key
+        legacy:{country}:{name}:{type} and are not merged with the plants
+        which are crawled with EIC.
+        """
+        table_names = inspect(self.engine).get_table_names()
+        with self.engine.begin() as conn:
+            if "query_per_plant" in table_names:
+                log.info("migrating table query_per_plant")
+                legacy_eic = "concat_ws(':', 'legacy', q.country, q.name, q.type)"
+                conn.execute(
+                    text(f"""
+                    INSERT INTO plants (eic, name, type, country)
+                    SELECT DISTINCT {legacy_eic}, q.name, q.type, q.country
+                    FROM query_per_plant q
+                    ON CONFLICT (eic) DO NOTHING
+                    """)
+                )
+                result = conn.execute(
+                    text(f"""
+                    INSERT INTO generation_per_plant ("index", plant_id, value)
+                    SELECT q."index", p.id, q.value
+                    FROM query_per_plant q JOIN plants p ON p.eic = {legacy_eic}
+                    ON CONFLICT DO NOTHING
+                    """)
+                )
+                conn.execute(text("DROP TABLE query_per_plant"))
+                log.info(f"migrated {result.rowcount} rows of query_per_plant")
+            if "plant_names" in table_names:
+                conn.execute(text("DROP TABLE plant_names"))
+
+    def get_latest_plant_timestamps(self):
+        """
+        Returns the latest timestamp of generation per plant for each country
+
+        Returns
+        -------
+        latest : dict[str, pd.Timestamp]
+        """
+        query = text("""
+            SELECT p.country, max(g."index") FROM generation_per_plant g
+            JOIN plants p ON p.id = g.plant_id GROUP BY p.country
+            """)
+        with self.engine.begin() as conn:
+            rows = conn.execute(query).fetchall()
+        return {country: pd.Timestamp(latest) for country, latest in rows}
+
+    def write_plant_generation(self, data, country):
+        """
+        Updates the plants of the data and bulk loads the generation using COPY
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            DataFrame with columns index, eic, name, type, value
+        country : str
+            2-letter country code
+        """
+        plants = (
+            data[["eic", "name", "type"]].drop_duplicates("eic").assign(country=country)
+        )
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("""
+                INSERT INTO plants (eic, name, type, country)
+                VALUES (:eic, :name, :type, :country)
+                ON CONFLICT (eic) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    type = EXCLUDED.type,
+                    country = EXCLUDED.country
+                """),
+                plants.to_dict("records"),
+            )
+            ids = pd.read_sql_query(
+                text("SELECT eic, id AS plant_id FROM plants WHERE eic = ANY(:eics)"),
+                conn,
+                params={"eics": list(plants["eic"])},
+            )
+            fact = data.merge(ids, on="eic")[["index", "plant_id", "value"]]
+            # COPY into a staging table, as COPY can not skip existing rows
+            fact.to_sql(
+                "generation_per_plant_staging",
+                conn,
+                if_exists="replace",
+                index=False,
+                method=psql_insert_copy,
+            )
+            conn.execute(
+                text("""
+                INSERT INTO generation_per_plant ("index", plant_id, value)
+                SELECT "index", plant_id, value FROM generation_per_plant_staging
+                ON CONFLICT DO NOTHING
+                """)
+            )
+            conn.execute(text("DROP TABLE generation_per_plant_staging"))
+
+    def download_entsoe_plant_data(self, countries, client, start, end):
         """
         Allows to download the generation per power plant from entsoe.
-        Uses download_entsoe to write the data into the DB.
+        Each country is resumed from its latest stored timestamp.
+        The plants are stored in the table plants,
+        the generation in the hypertable generation_per_plant.
+        The views query_per_plant and plant_names provide the former layout.
 
         Parameters
         ----------
@@ -443,17 +1056,14 @@ class EntsoeCrawler(BaseCrawler):
             DataFrameClient of entsoe-py package
         start : pd.Timestamp
             timestamp aware pd.Timestamp
-        delta : pd.Timedelta
-            Timedelta to fetch data for per bulk
-        times : int
-            number of bulks with size delta to fetch
+        end : pd.Timestamp
+            timestamp aware pd.Timestamp
 
         Returns
         -------
 
         """
 
-        # new proxy function
         def query_per_plant(country, start, end):
             """
             wrapper function around query_generation_per_plant to convert multiindex
@@ -462,48 +1072,51 @@ class EntsoeCrawler(BaseCrawler):
             ----------
             country : str
                 country to fetch
-            start : pd.DateTime
-                param end:
-            end :
-
+            start : pd.Timestamp
+            end : pd.Timestamp
 
             Returns
             -------
-
+            pp : pd.DataFrame | None
+                DataFrame with columns index, eic, name, type, value
             """
-            ppp = client.query_generation_per_plant(country, start=start, end=end)
-            # convert multiindex into second column
+            try:
+                ppp = client.query_generation_per_plant(
+                    country, start=start, end=end, include_eic=True
+                )
+            except NoMatchingDataError:
+                return None
+            # convert multiindex into columns
             pp = ppp.melt(
-                var_name=["name", "type"],
+                var_name=["eic", "name", "type"],
                 value_name="value",
                 ignore_index=False,
             )
-            return pp
-
-        log.info(f"****** {query_per_plant.__name__} *******")
-        start_, delta_ = self.get_latest_crawled_timestamp(
-            start, delta, query_per_plant.__name__
-        )
-        self.download_entsoe(
-            countries, query_per_plant, start_, delta=delta_, times=times
-        )
+            return pp.rename_axis("index").reset_index().dropna(subset=["value"])
 
+        log.info("****** generation_per_plant *******")
         try:
-            with self.engine.begin() as conn:
-                query = text(
-                    'CREATE INDEX IF NOT EXISTS "idx_name_query_per_plant" ON "query_per_plant" ("name", "index", "country");'
-                )
-                conn.execute(query)
+            self.create_plant_tables()
+            latest = self.get_latest_plant_timestamps()
         except Exception as e:
-            log.error(f"could not create index: {e}")
+            log.error(f"could not create plant tables: {e}")
+            return
 
-        try:
-            with self.engine.begin() as conn:
-                query = "select distinct name, country,type from query_per_plant"
-                names = pd.read_sql_query(query, conn)
-                names.to_sql("plant_names", conn, if_exists="replace")
-        except Exception as e:
-            log.error(f"could not create plant_names: {e}")
+        window = AdaptiveWindow(
+            self.engine,
+            "generation_per_plant",
+            initial=timedelta(days=7),
+            minimum=timedelta(days=1),
+            maximum=timedelta(days=30),
+        )
+        pbar = tqdm(countries)
+        for country in pbar:
+            start_ = max(start, latest.get(country, start))
+            fetch = partial(query_per_plant, country)
+            for s, e, data in window.fetch_range(start_, end, fetch):
+                pbar.set_description(f"{country} {s:%Y-%m-%d} to {e:%Y-%m-%d}")
+                if data is not None and not data.empty:
+                    self.write_plant_generation(data, country)
 
     def countries_with_plant_data(
         self,
@@ -575,19 +1188,17 @@ class EntsoeCrawler(BaseCrawler):
 
         # Download load and generation
         # hier könnte man parallelisieren
+        if start is None:
+            start = pd.Timestamp("20150101", tz="Europe/Berlin")
+        end = pd.Timestamp.now(tz="Europe/Berlin")
         for proc in ts_procs:
-            start_, delta_ = self.get_latest_crawled_timestamp(
-                start, delta, proc.__name__
-            )
-            self.download_entsoe(countries, proc, start_, delta_, times=1)
+            self.download_entsoe_missing(countries, proc, start, end)
 
         self.pull_crossborders(start, delta, 1, client.query_crossborder_flows)
 
         plant_countries = self.countries_with_plant_data(client)
 
-        self.download_entsoe_plant_data(
-            plant_countries[:], client, start, delta, times=1
-        )
+        self.download_entsoe_plant_data(plant_countries[:], client, start, end)
 
         log.info("****** finished updating ENTSO-E *******")
 
@@ -623,7 +1234,8 @@ class EntsoeCrawler(BaseCrawler):
 def main(schema_name):
     api_key = os.getenv("ENTSOE_API_KEY", "ae2ed060-c25c-4eea-8ae4-007712f95375")
     client = EntsoePandasClient(api_key=api_key)
-    crawler = EntsoeCrawler(schema_name)
+    long_format = os.getenv("ENTSOE_LONG_FORMAT", "false").lower() == "true"
+    crawler = EntsoeCrawler(schema_name, long_format=long_format)
 
     start = pd.Timestamp("20150101", tz="Europe/Berlin")
     delta = pd.Timestamp.now(tz="Europe/Berlin") - start
@@ -682,6 +1294,6 @@ if __name__ == "__main__":
     crawler = EntsoeCrawler(schema_name)
 
     # 2017-12-16 bis 2018-03-15 runterladen
-    crawler.download_entsoe_plant_data(plant_countries[:], client, start, delta, times)
+    crawler.download_entsoe_plant_data(plant_countries[:], client, start, end)
 
     # create indices if not existing
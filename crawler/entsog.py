@@ -8,16 +8,18 @@ This crawler downloads all the data of the ENTSO-G transparency platform.
 The resulting data is not available under an open-source license and should not be reshared but is available for crawling yourself.
 """
 
+import io
 import logging
 import time
-import urllib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 
 import pandas as pd
 import requests
-from sqlalchemy import text
+from sqlalchemy import inspect, text
 from tqdm import tqdm
 
+from common.adaptive_window import AdaptiveWindow
 from common.base_crawler import BaseCrawler
 
 log = logging.getLogger("entsog")
@@ -37,6 +39,20 @@ metadata_info = {
 
 api_endpoint = "https://transparency.entsog.eu/api/v1/"
 
+# natural keys of the reference tables, tables which are not listed use id
+REFERENCE_KEYS = {
+    "connectionpoints": ["pointkey"],
+    "operators": ["operatorkey"],
+    "balancingzones": ["bzkey"],
+    "operatorpointdirections": ["operatorkey", "pointkey", "directionkey"],
+}
+# integer ids of the reference tables which are referenced by the operational data
+# table -> (id column, key column)
+REFERENCE_IDS = {
+    "connectionpoints": ("point_id", "pointkey"),
+    "operators": ("operator_id", "operatorkey"),
+}
+
 fr = date(2020, 5, 18)
 to = date.today()
 
@@ -50,52 +66,129 @@ data = pd.DataFrame(response.json()['AggregatedData'])
 """
 
 
-def getDataFrame(name, params=["limit=10000"], useJson=False):
-    params_str = ""
-    if len(params) > 0:
-        params_str = "?"
-    for param in params[:-1]:
-        params_str = params_str + param + "&"
-    params_str += params[-1]
-
-    i = 0
-    data = pd.DataFrame()
-    success = False
-    while i < 10 and not success:
-        try:
-            i += 1
-            if useJson:
-                url = f"{api_endpoint}{name}.json{params_str}"
-                response = requests.get(url)
-                data = pd.DataFrame(response.json()[name])
-                # replace empty string with None
-                data = data.replace([""], [None])
-            else:
-                url = f"{api_endpoint}{name}.csv{params_str}"
-                data = pd.read_csv(url, index_col=False)
-            success = True
-        except requests.exceptions.InvalidURL:
-            raise
-        except requests.exceptions.HTTPError as e:
-            log.error("Error getting Dataframe")
-            if e.response.status_code >= 500:
-                log.info(f"{e.response.reason} - waiting 30 seconds..")
-                time.sleep(30)
-        except urllib.error.HTTPError as e:
-            log.error("Error getting Dataframe")
-            if e.code >= 500:
-                log.info(f"{e.msg} - waiting 30 seconds..")
-                time.sleep(30)
-
-    if data.empty:
-        raise Exception("could not get any data for params:", params_str)
-    data.columns = [x.lower() for x in data.columns]
-    return data
+def parse_retry_after(value: str | None, default: float) -> float:
+    """
+    Returns the seconds of a Retry-After header.
+    The header might also be a HTTP date, then the default is used.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class EntsogClient:
+    """
+    Client for the ENTSOG transparency API.
+    Results are requested in pages of page_size records, the pages after the first
+    are requested concurrently. Connection errors, server errors and rate limits
+    are retried with an exponential backoff.
+
+    Parameters
+    ----------
+    page_size : int
+        number of records per request
+    max_workers : int
+        number of concurrent requests
+    retries : int
+        number of attempts per page
+    backoff : float
+        seconds to wait before the first retry, doubled with every attempt
+    """
+
+    def __init__(self, page_size=10000, max_workers=4, retries=5, backoff=5):
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+
+    def request(self, url: str, params: dict):
+        """
+        Returns the response or None if the API has no data for the query.
+        Connection errors, timeouts, server errors and rate limits are retried.
+        """
+        for attempt in range(self.retries):
+            wait = self.backoff * 2**attempt
+            try:
+                response = self.session.get(url, params=params, timeout=300)
+            except requests.exceptions.RequestException as e:
+                log.info(f"{e!r} for {url} - waiting {wait}s")
+                time.sleep(wait)
+                continue
+            if response.status_code == 404:
+                # the API answers with 404 if there is no data for the query
+                return None
+            if response.status_code == 429 or response.status_code >= 500:
+                wait = parse_retry_after(response.headers.get("Retry-After"), wait)
+                log.info(f"{response.status_code} for {url} - waiting {wait}s")
+                time.sleep(wait)
+                continue
+            response.raise_for_status()
+            return response
+        raise Exception(f"could not get {url} with {params}")
+
+    def get_page(self, name: str, params: dict, offset: int):
+        """
+        Returns the records of one page and the total number of records, if known.
+        """
+        url = f"{api_endpoint}{name}.json"
+        params = {**params, "limit": self.page_size, "offset": offset}
+        response = self.request(url, params)
+        if response is None:
+            return [], 0
+        payload = response.json()
+        records = next((v for k, v in payload.items() if k.lower() == name.lower()), [])
+        total = payload.get("meta", {}).get("total")
+        return records, total
+
+    def get_csv_frame(self, name: str, params: dict | None = None) -> pd.DataFrame:
+        """
+        Returns all records of the endpoint for the given query parameters
+        in a single csv request.
+        The csv has other columns than the json, so it is used where
+        existing tables were created from it.
+        """
+        params = {**(params or {}), "limit": -1}
+        response = self.request(f"{api_endpoint}{name}.csv", params)
+        if response is None or not response.text.strip():
+            return pd.DataFrame()
+        data = pd.read_csv(io.StringIO(response.text), index_col=False)
+        data.columns = [x.lower() for x in data.columns]
+        return data
+
+    def get_data_frame(self, name: str, params: dict | None = None) -> pd.DataFrame:
+        """
+        Returns all records of the endpoint for the given query parameters.
+        """
+        params = params or {}
+        records, total = self.get_page(name, params, 0)
+        pages = [pd.DataFrame.from_records(records)]
+        if total is not None:
+            offsets = range(self.page_size, total, self.page_size)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for page, _ in executor.map(
+                    lambda offset: self.get_page(name, params, offset), offsets
+                ):
+                    pages.append(pd.DataFrame.from_records(page))
+        else:
+            # without total the pages are requested until one is not full
+            offset = 0
+            while len(records) == self.page_size:
+                offset += self.page_size
+                records, _ = self.get_page(name, params, offset)
+                pages.append(pd.DataFrame.from_records(records))
+        data = pd.concat(pages, ignore_index=True)
+        # replace empty string with None
+        data = data.replace([""], [None])
+        data.columns = [x.lower() for x in data.columns]
+        return data
 
 
 class EntsogCrawler(BaseCrawler):
     def __init__(self, schema_name):
         super().__init__(schema_name)
+        self.client = EntsogClient()
 
     def pullData(self, names):
         pbar = tqdm(names)
@@ -106,21 +199,125 @@ class EntsogCrawler(BaseCrawler):
                 # TODO Json somehow has different data
                 # connectionpoints count differ
                 # and tpTSO column are named tSO in connpointdirections
-                data = getDataFrame(name, useJson=True)
-
-                with self.engine.begin() as conn:
-                    tbl_name = name.lower().replace(" ", "_")
-                    data.to_sql(tbl_name, conn, if_exists="replace")
+                data = self.client.get_data_frame(name)
+                if data.empty:
+                    log.warning(f"got no data for {name}")
+                    continue
 
+                tbl_name = name.lower().replace(" ", "_")
+                self.upsert_reference_table(tbl_name, data)
             except Exception:
                 log.exception("error pulling data")
 
-        if "operatorpointdirections" in names:
+    def create_reference_table(self, conn, tbl_name, staging, keys):
+        key_columns = ", ".join(keys)
+        conn.execute(text(f"CREATE TABLE {tbl_name} (LIKE {staging})"))
+        if tbl_name in REFERENCE_IDS:
+            id_column, _ = REFERENCE_IDS[tbl_name]
+            conn.execute(text(f"ALTER TABLE {tbl_name} ADD COLUMN {id_column} serial"))
+            conn.execute(
+                text(
+                    f"CREATE UNIQUE INDEX {tbl_name}_{id_column} ON {tbl_name} ({id_column})"
+                )
+            )
+        conn.execute(
+            text(f"CREATE UNIQUE INDEX {tbl_name}_key ON {tbl_name} ({key_columns})")
+        )
+        log.info(f"created reference table {tbl_name}")
+
+    def upsert_reference_table(self, tbl_name, data):
+        """
+        Refreshes the reference table by inserting new and updating changed rows.
+        Rows which are no longer returned by the API are kept,
+        as the operational data might still reference them.
+        The table and its indexes are only created once.
+        """
+        keys = REFERENCE_KEYS.get(tbl_name, ["id"])
+        if any(key not in data.columns for key in keys):
+            log.warning(f"{tbl_name} has no key {keys} - replacing the table")
             with self.engine.begin() as conn:
-                query = text(
-                    'CREATE INDEX IF NOT EXISTS "idx_opd" ON operatorpointdirections (operatorKey, pointKey,directionkey);'
+                data.to_sql(tbl_name, conn, if_exists="replace")
+            return
+        data = data.dropna(subset=keys).drop_duplicates(subset=keys, keep="last")
+        staging = f"{tbl_name}_staging"
+        with self.engine.begin() as conn:
+            data.to_sql(staging, conn, if_exists="replace", index=False)
+            inspector = inspect(conn)
+            if not inspector.has_table(tbl_name):
+                self.create_reference_table(conn, tbl_name, staging, keys)
+                inspector = inspect(conn)
+            index_names = [index["name"] for index in inspector.get_indexes(tbl_name)]
+            if f"{tbl_name}_key" not in index_names:
+                # tables of previous versions were replaced on every run
+                conn.execute(text(f"DROP TABLE {tbl_name}"))
+                self.create_reference_table(conn, tbl_name, staging, keys)
+                inspector = inspect(conn)
+            existing = {column["name"] for column in inspector.get_columns(tbl_name)}
+            for column in inspector.get_columns(staging):
+                if column["name"] not in existing:
+                    log.info(f"add column {column['name']} to {tbl_name}")
+                    conn.execute(
+                        text(
+                            f'ALTER TABLE {tbl_name} ADD COLUMN "{column["name"]}" {column["type"]}'
+                        )
+                    )
+            columns = ", ".join(f'"{column}"' for column in data.columns)
+            updates = ", ".join(
+                f'"{column}" = EXCLUDED."{column}"'
+                for column in data.columns
+                if column not in keys
+            )
+            target = ", ".join(f'{tbl_name}."{column}"' for column in data.columns)
+            excluded = ", ".join(f'EXCLUDED."{column}"' for column in data.columns)
+            if updates:
+                on_conflict = f"""DO UPDATE SET {updates}
+                WHERE ({target}) IS DISTINCT FROM ({excluded})"""
+            else:
+                # all columns are part of the key, so there is nothing to update
+                on_conflict = "DO NOTHING"
+            result = conn.execute(
+                text(f"""
+                INSERT INTO {tbl_name} ({columns})
+                SELECT {columns} FROM {staging}
+                ON CONFLICT ({", ".join(keys)}) {on_conflict}
+                """)
+            )
+            conn.execute(text(f"DROP TABLE {staging}"))
+        log.info(f"inserted or updated {result.rowcount} rows of {tbl_name}")
+
+    def load_reference_ids(self, tbl_name) -> dict:
+        id_column, key_column = REFERENCE_IDS[tbl_name]
+        try:
+            with self.engine.begin() as conn:
+                query = text(f"SELECT {key_column}, {id_column} FROM {tbl_name}")
+                return dict(conn.execute(query).fetchall())
+        except Exception as e:
+            log.error(f"could not load ids of {tbl_name}: {e}")
+            return {}
+
+    def add_reference_ids(self, tbl_name):
+        """
+        Adds the integer ids of the reference tables to an existing operational data table.
+        Only runs once, when the id columns do not exist yet.
+        """
+        with self.engine.begin() as conn:
+            inspector = inspect(conn)
+            if not inspector.has_table(tbl_name):
+                return
+            existing = {column["name"] for column in inspector.get_columns(tbl_name)}
+            for reference, (id_column, key_column) in REFERENCE_IDS.items():
+                if id_column in existing:
+                    continue
+                log.info(f"add {id_column} to {tbl_name}")
+                conn.execute(
+                    text(f"ALTER TABLE {tbl_name} ADD COLUMN {id_column} integer")
+                )
+                conn.execute(
+                    text(f"""
+                    UPDATE {tbl_name} SET {id_column} = r.{id_column}
+                    FROM {reference} r WHERE {tbl_name}.{key_column} = r.{key_column}
+                    """)
                 )
-                conn.execute(query)
 
     def findNewBegin(self, table_name):
         try:
@@ -145,6 +342,12 @@ class EntsogCrawler(BaseCrawler):
             else:
                 begin = self.findNewBegin(tbl_name)
 
+            self.add_reference_ids(tbl_name)
+            ids = {
+                reference: self.load_reference_ids(reference)
+                for reference in REFERENCE_IDS
+            }
+
             bulks = (end - begin).days
             log.info(
                 f"start: {begin}, end: {end}, days: {bulks}, indicator: {indicator}"
@@ -152,27 +355,39 @@ class EntsogCrawler(BaseCrawler):
 
             if bulks < 1:
                 return
-            delta = timedelta(days=1)
 
-            pbar = tqdm(range(int(bulks)))
-            for i in pbar:
-                beg1 = begin + i * delta
-                end1 = begin + (i + 1) * delta
+            def fetch(beg1, end1):
+                params = {
+                    "indicator": indicator,
+                    "from": str(beg1),
+                    "to": str(end1),
+                    "periodType": "hour",
+                }
+                # the existing tables were created from the csv columns
+                # a failing request is retried by the window with a smaller range
+                return self.client.get_csv_frame("operationaldata", params)
+
+            window = AdaptiveWindow(
+                self.engine,
+                f"operationaldata_{tbl_name}",
+                initial=timedelta(days=1),
+                minimum=timedelta(days=1),
+                maximum=timedelta(days=31),
+                target_seconds=50,
+            )
+            pbar = tqdm(total=bulks)
+            for beg1, end1, df in window.fetch_range(begin, end, fetch):
                 pbar.set_description(f"op {beg1} to {end1}")
-
-                params = [
-                    "limit=-1",
-                    "indicator=" + urllib.parse.quote(indicator),
-                    "from=" + str(beg1),
-                    "to=" + str(end1),
-                    "periodType=hour",
-                ]
-                time.sleep(5)
-                # impact of sleeping here is quite small in comparison to 50s query length
-                # rate limiting Gateway Timeouts
-                df = getDataFrame("operationaldata", params)
+                pbar.update((end1 - beg1).days)
+                if df.empty:
+                    continue
                 df["periodfrom"] = pd.to_datetime(df["periodfrom"])
                 df["periodto"] = pd.to_datetime(df["periodto"])
+                for reference, (id_column, key_column) in REFERENCE_IDS.items():
+                    if key_column in df.columns:
+                        df[id_column] = (
+                            df[key_column].map(ids[reference]).astype("Int32")
+                        )
 
                 try:
                     with self.engine.begin() as conn:
@@ -198,6 +413,16 @@ class EntsogCrawler(BaseCrawler):
             except Exception as e:
                 log.error(f"could not create hypertable {tbl_name}: {e}")
 
+            try:
+                with self.engine.begin() as conn:
+                    for id_column, _ in REFERENCE_IDS.values():
+                        query = text(
+                            f'CREATE INDEX IF NOT EXISTS "idx_{tbl_name}_{id_column}" ON {tbl_name} ({id_column}, periodfrom);'
+                        )
+                        conn.execute(query)
+            except Exception as e:
+                log.error(f"could not create id indexes on {tbl_name}: {e}")
+
         # sqlite will only use one index. EXPLAIN QUERY PLAIN shows if index is used
         # ref: https://www.sqlite.org/optoverview.html#or_optimizations
         # reference https://stackoverflow.com/questions/31031561/sqlite-query-to-get-the-closest-datetime
@@ -4,6 +4,7 @@
 
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 
 import pandas as pd
@@ -12,6 +13,7 @@ from sqlalchemy import text
 
 from common.base_crawler import BaseCrawler
 from common.config import db_uri
+from common.rate_limiter import RateLimiter
 
 log = logging.getLogger("eview")
 log.setLevel(logging.INFO)
@@ -29,23 +31,28 @@ metadata_info = {
 }
 
 default_start_date = date(2022, 11, 1)
+# number of rows which are written in one transaction
+BATCH_ROWS = 100_000
 # using http instead of https to be faster
 
 
 class EViewCrawler(BaseCrawler):
-    def __init__(self, schema_name):
+    def __init__(self, schema_name, calls_per_second=5):
         super().__init__(schema_name)
+        # shared by all threads fetching from eview
+        self.rate_limiter = RateLimiter(calls_per_second)
 
     def get_solar_units(self):
         # crawl available pv units
         data = requests.get("http://www.eview.de/solarstromdaten/login.php")
         return re.findall("login\.php\?p=;(\w{2});", data.text)
 
-    def crawl_unit_date(self, unit, fetch_date):
+    def fetch_unit_date(self, unit, fetch_date):
         log.info(f"fetching {fetch_date} for {unit}")
 
         day = datetime.strftime(fetch_date, "%d.%m.%Y")
         url = f"http://www.eview.de/solarstromdaten/export.php?p=;{unit};z;dg1;f0;t{day}/1;km250"
+        self.rate_limiter.wait()
         try:
             df = pd.read_csv(
                 url,
@@ -57,12 +64,15 @@ class EViewCrawler(BaseCrawler):
                 dayfirst=True,
             )
             log.info(f"num records {df.size}")
+        except OSError:
+            # network errors and timeouts stop the unit, so the day is fetched again
+            raise
         except Exception:
             log.info("not data")
-            return
+            return None
         if df.size < 2:
             log.info("not data")
-            return
+            return None
         ddf = df.unstack()
         ddf = ddf.reset_index()
         ddf.index = ddf["Datum und Uhrzeit"]
@@ -70,26 +80,72 @@ class EViewCrawler(BaseCrawler):
         del ddf["Datum und Uhrzeit"]
         ddf.columns = ["plant", "value"]
         ddf["plant_id"] = unit
-        with self.engine.begin() as conn:
-            ddf.to_sql("eview", con=conn, if_exists="append")
+        return ddf
 
-    def crawl_unit(self, unit, begin_date):
-        first_date = pd.to_datetime(begin_date) + timedelta(days=1)
+    def write_frames(self, frames) -> bool:
+        try:
+            with self.engine.begin() as conn:
+                pd.concat(frames).to_sql("eview", con=conn, if_exists="append")
+        except Exception:
+            log.exception("Error writing eview data")
+            return False
+        return True
+
+    def crawl_units(self, units, max_workers=8):
+        """
+        Fetches the missing days of all units concurrently,
+        the rate limiter bounds the requests to eview.
+        The fetched days are written in date order per unit in batches
+        of about BATCH_ROWS rows, as the next run resumes from the latest day.
+        After an error, the remaining days of the unit are skipped.
+        """
+        latest = self.select_latest_per_unit()
         last_date = date.today() - timedelta(days=1)
-        log.info(f"fetching from {first_date} until {last_date}")
-        for fetch_date in pd.date_range(first_date, last_date):
-            self.crawl_unit_date(unit, fetch_date)
-
-    def select_latest(self, unit):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            jobs = []
+            for unit in units:
+                begin_date = latest.get(unit, default_start_date)
+                first_date = (pd.to_datetime(begin_date) + timedelta(days=1)).date()
+                log.info(f"fetching {unit} from {first_date} until {last_date}")
+                for fetch_date in pd.date_range(first_date, last_date):
+                    future = executor.submit(self.fetch_unit_date, unit, fetch_date)
+                    jobs.append((unit, fetch_date, future))
+
+            failed = set()
+            frames, rows = [], 0
+            # results are taken in submission order, so the days of a unit stay ordered
+            for unit, fetch_date, future in jobs:
+                if unit in failed:
+                    future.cancel()
+                    continue
+                try:
+                    df = future.result()
+                except Exception:
+                    log.exception(f"Error with {unit} at {fetch_date}")
+                    failed.add(unit)
+                    continue
+                if df is None:
+                    continue
+                frames.append(df)
+                rows += len(df)
+                if rows >= BATCH_ROWS:
+                    if not self.write_frames(frames):
+                        failed.update(frame["plant_id"].iloc[0] for frame in frames)
+                    frames, rows = [], 0
+            if frames:
+                self.write_frames(frames)
+
+    def select_latest_per_unit(self) -> dict:
         day = datetime.strftime(default_start_date, "%Y-%m-%d")
         today = datetime.strftime(date.today(), "%Y-%m-%d")
-        sql = f"select datetime from eview where plant_id='{unit}' and datetime > '{day}' and datetime < '{today}' order by datetime desc limit 1"
+        sql = f"select plant_id, max(datetime) as datetime from eview where datetime > '{day}' and datetime < '{today}' group by plant_id"
         try:
             with self.engine.begin() as conn:
-                return pd.read_sql(sql, conn, parse_dates=["datetime"]).values[0][0]
+                latest = pd.read_sql(sql, conn, parse_dates=["datetime"])
+            return dict(zip(latest["plant_id"], latest["datetime"]))
         except Exception as e:
             log.error(e)
-            return default_start_date
+            return {}
 
     def create_hypertable(self):
         try:
@@ -106,14 +162,7 @@ class EViewCrawler(BaseCrawler):
 def main(schema_name):
     ec = EViewCrawler(schema_name)
     solar_plants = ec.get_solar_units()
-
-    for plant in solar_plants:
-        log.info(f"fetching {plant}")
-        try:
-            begin_date = ec.select_latest(plant)
-            ec.crawl_unit(plant, begin_date)
-        except Exception:
-            log.exception(f"Error with {plant}")
+    ec.crawl_units(solar_plants)
 
     ec.create_hypertable()
     ec.set_metadata(metadata_info)
@@ -126,9 +175,7 @@ if __name__ == "__main__":
     db_conn = db_uri("eview")
     log.info(f"connect to {db_conn}")
     ec = EViewCrawler("eview")
-    plant = "FI"
-    begin_date = ec.select_latest(plant)
-    ec.crawl_unit(plant, begin_date)
+    ec.crawl_units(["FI"])
     ec.create_hypertable()
 
 #    main(db_uri)
@@ -13,6 +13,9 @@ https://data.boerman.dev/d/5CYxW2JVz/flows-scheduled-commercial-exchanges-day-ah
 """
 
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
 import pandas as pd
@@ -25,6 +28,7 @@ from sqlalchemy import MetaData, text
 from sqlalchemy.exc import OperationalError
 
 from .common.base_crawler import BaseCrawler
+from .common.rate_limiter import RateLimiter
 
 log = logging.getLogger("jao")
 
@@ -41,6 +45,10 @@ metadata_info = {
 }
 
 MIN_WEEKLY_DATE = datetime(2023, 1, 1)
+# number of auctions whose bids are written in one transaction
+BID_BATCH_SIZE = 50
+# corridors write concurrently into the same tables, which might not exist yet
+write_lock = threading.Lock()
 
 DELTAS = {
     "seasonal": relativedelta(years=1),
@@ -109,6 +117,15 @@ class DatabaseManager(BaseCrawler):
         max_date_query = text(f"SELECT MAX({column_name}) FROM {table_name}")
         return self.execute(max_date_query).scalar()
 
+    def create_auction_index(self):
+        query = text(
+            "CREATE INDEX IF NOT EXISTS auctions_corridor_horizon_date_idx ON auctions (corridor, horizon, date)"
+        )
+        try:
+            self.execute(query)
+        except Exception as e:
+            log.error(f"could not create index on auctions: {e}")
+
     def create_hypertables(self):
         for table_name in self.get_tables():
             try:
@@ -120,10 +137,13 @@ class DatabaseManager(BaseCrawler):
 
 
 class JaoClientWrapper:
-    def __init__(self, api_key):
+    def __init__(self, api_key, calls_per_second=5):
         self.client = JaoAPIClient(api_key)
+        # shared by all threads, so that the crawl stays within the API budget
+        self.rate_limiter = RateLimiter(calls_per_second)
 
     def get_bids(self, auction_id: str):
+        self.rate_limiter.wait()
         try:
             return self.client.query_auction_bids_by_id(auction_id)
         except requests.exceptions.HTTPError as e:
@@ -138,6 +158,7 @@ class JaoClientWrapper:
         horizon="Monthly",
     ) -> pd.DataFrame:
         from_date, to_date = string_to_timestamp(from_date, to_date)
+        self.rate_limiter.wait()
         try:
             return self.client.query_auction_stats(
                 from_date, to_date, corridor, horizon
@@ -150,28 +171,99 @@ class JaoClientWrapper:
             return pd.DataFrame()
 
     def get_horizons(self):
+        self.rate_limiter.wait()
         return self.client.query_auction_horizons()
 
     def get_corridors(self):
+        self.rate_limiter.wait()
         return self.client.query_auction_corridors()
 
 
-def calculate_min_max(db_manager, corridor, horizon="Yearly"):
-    table_name = "auctions"
+def load_coverage(db_manager) -> dict[tuple[str, str], tuple[datetime, datetime]]:
+    """
+    Loads the first and last auction date of every corridor and horizon in one query.
+
+    Returns
+    -------
+    dict
+        (corridor, horizon) -> (first date, last date)
+    """
+    query = text(
+        "SELECT corridor, horizon, MIN(date), MAX(date) FROM auctions GROUP BY corridor, horizon"
+    )
     try:
-        query = text(
-            f"SELECT MIN(date), MAX(date) FROM auctions where corridor='{corridor}' and horizon='{horizon}'"
-        )
-        scalar = db_manager.execute(query).first()
-        min_date = scalar[0]
-        max_date = scalar[1]
-        return string_to_timestamp(min_date), string_to_timestamp(max_date)
+        rows = db_manager.execute(query).fetchall()
     except Exception as e:
-        log.error(f"error crawling {e}")
-        log.info(
-            f"The table '{table_name}' did not exist or was empty. Crawling whole interval"
-        )
-        return None, None
+        log.error(f"error loading coverage {e}")
+        log.info("The table 'auctions' did not exist. Crawling whole interval")
+        return {}
+    return {
+        (corridor, horizon): tuple(string_to_timestamp(min_date, max_date))
+        for corridor, horizon, min_date, max_date in rows
+    }
+
+
+def plan_intervals(
+    horizons: list[str],
+    corridors: list[str],
+    coverage: dict,
+    from_date: datetime,
+    to_date: datetime,
+) -> list[tuple[str, str, datetime, datetime]]:
+    """
+    Plans the intervals which are missing before the first and after the last
+    auction of every corridor and horizon.
+
+    Returns
+    -------
+    list
+        (corridor, horizon, start, end) of every missing interval
+    """
+    intervals = []
+    for horizon in horizons:
+        if "intraday" == horizon.lower():
+            continue
+        horizon_from_date = from_date
+        if horizon.lower() == "weekly":
+            horizon_from_date = max(MIN_WEEKLY_DATE, from_date)
+        delta = DELTAS.get(horizon.lower(), timedelta(days=1))
+        for corridor in corridors:
+            first_date, last_date = coverage.get((corridor, horizon), (None, None))
+            if not first_date:
+                first_date = to_date
+            if horizon_from_date < first_date:
+                intervals.append((corridor, horizon, horizon_from_date, first_date))
+            # must be at least one horizon ahead, otherwise we are crawling duplicates
+            if last_date and to_date - delta > last_date:
+                intervals.append((corridor, horizon, last_date, to_date))
+    return intervals
+
+
+def write_frame(db_manager, df: pd.DataFrame, table_name: str):
+    with write_lock:
+        try:
+            with db_manager.engine.begin() as connection:
+                df.to_sql(
+                    table_name,
+                    connection,
+                    if_exists="append",
+                    index=False,
+                    method="multi",
+                    chunksize=10_000,
+                )
+        except OperationalError:
+            log.exception(f"database error writing {len(df)} entries - trying again")
+            time.sleep(5)
+            with db_manager.engine.begin() as connection:
+                df.to_sql(table_name, connection, if_exists="append", index=False)
+
+
+def fetch_bids(jao_client, auction_id, auction_date):
+    bids_data = jao_client.get_bids(auction_id)
+    if not bids_data.empty:
+        bids_data["auctionId"] = auction_id
+        bids_data["date"] = auction_date
+    return bids_data
 
 
 def crawl_single_horizon(
@@ -181,6 +273,7 @@ def crawl_single_horizon(
     to_date,
     corridor,
     horizon,
+    bid_pool,
 ):
     table_name = f"bids_{horizon.lower()}"
     table_name = table_name.replace("-", "_").replace(" ", "_")
@@ -197,56 +290,27 @@ def crawl_single_horizon(
         f"started crawling bids of {corridor} - {horizon} for {len(auctions_data)} auctions"
     )
     auctions_data["horizon"] = horizon
-
-    try:
-        with db_manager.engine.begin() as connection:
-            auctions_data.to_sql(
-                "auctions",
-                connection,
-                if_exists="append",
-                index=False,
-                method="multi",
-                chunksize=10_000,
-            )
-    except OperationalError:
-        log.exception(
-            f"database error writing {len(auctions_data)} entries - trying again"
-        )
-        import time
-
-        time.sleep(5)
-        with db_manager.engine.begin() as connection:
-            auctions_data.to_sql(
-                "auctions", connection, if_exists="append", index=False
-            )
-
-    for auction_id, auction_date in auctions_data.loc[:, ["id", "date"]].values:
-        bids_data = jao_client.get_bids(auction_id)
-
+    write_frame(db_manager, auctions_data, "auctions")
+
+    futures = {
+        bid_pool.submit(fetch_bids, jao_client, auction_id, auction_date): auction_id
+        for auction_id, auction_date in auctions_data.loc[:, ["id", "date"]].values
+    }
+    batch = []
+    for future in as_completed(futures):
+        try:
+            bids_data = future.result()
+        except Exception as e:
+            log.error(f"Did not get bids for auction {futures[future]}: {e}")
+            continue
         if bids_data.empty:
             continue
-
-        bids_data["auctionId"] = auction_id
-        bids_data["date"] = auction_date
-        try:
-            with db_manager.engine.begin() as connection:
-                bids_data.to_sql(
-                    table_name,
-                    connection,
-                    if_exists="append",
-                    index=False,
-                    method="multi",
-                    chunksize=10_000,
-                )
-        except OperationalError:
-            log.error(f"database error writing {len(bids_data)} entries - trying again")
-            import time
-
-            time.sleep(5)
-            with db_manager.engine.begin() as connection:
-                bids_data.to_sql(
-                    table_name, connection, if_exists="append", index=False
-                )
+        batch.append(bids_data)
+        if len(batch) >= BID_BATCH_SIZE:
+            write_frame(db_manager, pd.concat(batch, ignore_index=True), table_name)
+            batch = []
+    if batch:
+        write_frame(db_manager, pd.concat(batch, ignore_index=True), table_name)
 
 
 def run_data_crawling(
@@ -254,43 +318,50 @@ def run_data_crawling(
     from_date: datetime,
     to_date: datetime,
     db_manager: DatabaseManager,
+    max_workers: int = 4,
+    bid_workers: int = 8,
 ):
+    """
+    Plans the missing intervals of all corridors and horizons up front
+    and crawls them concurrently.
+    The bids of the auctions are fetched in a shared pool,
+    the rate limiter of the jao_client bounds the requests to the API.
+    """
     log.info(f"starting run_data_crawling from {from_date} to {to_date}")
-    for horizon in jao_client.get_horizons():
-        for corridor in jao_client.get_corridors():
-            if "intraday" == horizon.lower():
-                continue
-
-            if horizon.lower() == "weekly":
-                from_date = max(MIN_WEEKLY_DATE, from_date)
-
-            first_date, last_date = calculate_min_max(db_manager, corridor, horizon)
-            log.info(f"crawl {horizon}, {corridor} - {from_date} - {to_date}")
-            if not first_date:
-                first_date = to_date
-            if from_date < first_date:
-                log.info(f"crawling before {from_date} until {first_date}")
-                crawl_single_horizon(
-                    jao_client,
-                    db_manager,
-                    from_date,
-                    first_date,
-                    corridor,
-                    horizon,
-                )
-            delta = DELTAS.get(horizon.lower(), timedelta(days=1))
-            if last_date and to_date - delta > last_date:
-                # must be at least one horizon ahead, otherwise we are crawling duplicates
-                log.info(f"crawling before {last_date} until {to_date}")
-                crawl_single_horizon(
-                    jao_client,
-                    db_manager,
-                    last_date,
-                    to_date,
-                    corridor,
-                    horizon,
-                )
-            log.info(f"finished crawling bids of {corridor} - {horizon}")
+    intervals = plan_intervals(
+        jao_client.get_horizons(),
+        jao_client.get_corridors(),
+        load_coverage(db_manager),
+        from_date,
+        to_date,
+    )
+    log.info(f"planned {len(intervals)} intervals to crawl")
+    with (
+        ThreadPoolExecutor(max_workers=bid_workers) as bid_pool,
+        ThreadPoolExecutor(max_workers=max_workers) as interval_pool,
+    ):
+        futures = {}
+        for corridor, horizon, start, end in intervals:
+            future = interval_pool.submit(
+                crawl_single_horizon,
+                jao_client,
+                db_manager,
+                start,
+                end,
+                corridor,
+                horizon,
+                bid_pool,
+            )
+            futures[future] = f"{corridor} - {horizon} from {start} until {end}"
+        for future in as_completed(futures):
+            try:
+                future.result()
+                log.info(f"finished crawling {futures[future]}")
+            except Exception as e:
+                log.error(f"error crawling {futures[future]}: {e}")
+    # backs the coverage query of the next run,
+    # created afterwards as the auctions table only exists after the first crawl
+    db_manager.create_auction_index()
     log.info(f"finished run_data_crawling from {from_date} to {to_date}")
 
 
@@ -4,19 +4,37 @@
 
 import io
 import logging
+import multiprocessing
+import os
+import queue
+import re
+import tempfile
+import threading
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.etree import ElementTree
 
+import numpy as np
 import pandas as pd
 import requests
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
 
-from common.base_crawler import create_schema_only, set_metadata_only
+from common.base_crawler import (
+    create_schema_only,
+    psql_insert_copy,
+    set_metadata_only,
+)
 from common.config import db_uri
 
 logging.basicConfig()
 log = logging.getLogger("MaStR")
 log.setLevel(logging.INFO)
 
+# number of records which are written at once
+BATCH_SIZE = 50_000
+# number of characters which are decoded and parsed at once
+CHUNK_SIZE = 1024 * 1024
+
 metadata_info = {
     "schema_name": "mastr",
     "data_source": "https://download.marktstammdatenregister.de/Gesamtdatenexport",
@@ -49,13 +67,362 @@ def get_mastr_url():
     return html_site[begin:end]
 
 
-def get_data_from_mastr(data_url):
-    response = requests.get(data_url)
+def download_export(data_url, file_path):
+    with requests.get(data_url, stream=True) as response:
+        response.raise_for_status()
+        with open(file_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+
+
+def get_xml_files(zip_path):
+    with zipfile.ZipFile(zip_path) as zip_file:
+        return [
+            info.filename
+            for info in zip_file.infolist()
+            if info.filename.endswith(".xml")
+        ]
+
+
+def iter_batches(file, batch_size=BATCH_SIZE):
+    """
+    Streams the records of a MaStR xml file.
+    The file is decoded from UTF-16 incrementally and every record is removed
+    from the tree once it is read, so the memory does not depend on the file size.
+
+    Parameters
+    ----------
+    file :
+        binary file object of the xml file
+    batch_size : int
+        number of records per batch
+
+    Yields
+    ------
+    pd.DataFrame
+        batch of records with one column per field
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    text_stream = io.TextIOWrapper(file, encoding="utf-16le")
+    root = None
+    depth = 0
+    records = []
+    while chunk := text_stream.read(CHUNK_SIZE):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == "start":
+                if root is None:
+                    root = element
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            records.append({field.tag: field.text for field in element})
+            root.clear()
+            if len(records) >= batch_size:
+                yield pd.DataFrame(records)
+                records = []
+    parser.close()
+    if records:
+        yield pd.DataFrame(records)
+
+
+# columns which may look numeric but are identifiers, have leading zeros
+# or are free text, the types of the table are not changed during an import
+TEXT_COLUMN_PARTS = [
+    "nummer",
+    "postleitzahl",
+    "gemeindeschluessel",
+    "telefon",
+    "fax",
+    "flurstueck",
+    "gemarkung",
+    "strasse",
+    "ort",
+    "name",
+    "bezeichnung",
+]
+
+
+def infer_type(column, values) -> str:
+    """
+    Derives the sql type of a column which is not yet in the catalog
+    from its name and the values of the first batch in which it appears.
+    """
+    if "datum" in column.lower():
+        return "timestamp"
+    if any(part in column.lower() for part in TEXT_COLUMN_PARTS):
+        return "text"
+    values = values.dropna()
+    if values.empty:
+        return "text"
+    numbers = pd.to_numeric(values, errors="coerce")
+    if numbers.isna().any():
+        return "text"
+    if (numbers % 1 == 0).all():
+        return "bigint"
+    return "double precision"
+
+
+def type_kind(sql_type: str) -> str:
+    sql_type = sql_type.lower()
+    if "timestamp" in sql_type or "date" in sql_type:
+        return "datetime"
+    if "int" in sql_type:
+        return "integer"
+    if any(name in sql_type for name in ["double", "float", "real", "numeric"]):
+        return "float"
+    if "bool" in sql_type:
+        return "boolean"
+    return "text"
+
+
+def apply_types(df, types: dict[str, str]):
+    """
+    Converts the raw string columns of the batch to the types of the catalog.
+    Values which do not match the type are logged and stored as NULL,
+    as changing the type would rewrite the whole table.
+    """
+    for column in df.columns:
+        kind = type_kind(types[column])
+        values = df[column]
+        if kind == "datetime":
+            converted = pd.to_datetime(values, errors="coerce", format="ISO8601")
+        elif kind == "integer":
+            numbers = pd.to_numeric(values, errors="coerce")
+            converted = numbers.where(numbers % 1 == 0).astype("Int64")
+        elif kind == "float":
+            converted = pd.to_numeric(values, errors="coerce")
+        elif kind == "boolean":
+            converted = values.str.lower().map(
+                {"true": True, "false": False, "1": True, "0": False}
+            )
+        else:
+            continue
+        lost = (values.notna() & converted.isna()).sum()
+        if lost:
+            unmatched = values[values.notna() & converted.isna()].unique()[:5]
+            log.warning(
+                f"{lost} values of {column} do not match {types[column]}, e.g. {list(unmatched)}"
+            )
+        df[column] = converted
+    return df
+
+
+def load_types(conn, table_name) -> dict[str, str]:
+    if not inspect(conn).has_table(table_name):
+        return {}
+    return {
+        column["name"]: str(column["type"]).lower()
+        for column in inspect(conn).get_columns(table_name)
+    }
+
+
+def prepare_batch(conn, table_name, df, types: dict[str, str], pk=None):
+    """
+    Creates the table or adds the columns of the batch which are not yet in the
+    catalog and converts the batch to the types of the catalog.
+
+    Parameters
+    ----------
+    types : dict[str, str]
+        catalog of the table, mapping column names to sql types.
+        Loaded from the table on first use and extended by new columns.
+    pk : str | None
+        primary key of a table which is created
+    """
+    if not types:
+        types.update(load_types(conn, table_name))
+    new_types = {
+        column: infer_type(column, df[column])
+        for column in df.columns
+        if column not in types
+    }
+    if new_types and not types:
+        columns = ", ".join(f'"{column}" {t}' for column, t in new_types.items())
+        if pk is not None:
+            # replaced records are deleted by id while the table is filled
+            columns += f', PRIMARY KEY ("{pk}")'
+        log.info(f"create table {table_name}")
+        conn.execute(text(f'CREATE TABLE "{table_name}" ({columns})'))
+    elif new_types:
+        for column, sql_type in new_types.items():
+            log.info(f"add column {column} to {table_name}")
+            conn.execute(
+                text(f'ALTER TABLE "{table_name}" ADD COLUMN "{column}" {sql_type}')
+            )
+    types.update(new_types)
+    return apply_types(df.copy(), types)
+
+
+def write_batch(conn, table_name, df):
+    """
+    Appends the prepared batch to the table.
+    """
+    if conn.dialect.name == "postgresql":
+        method = psql_insert_copy
+    else:
+        method = None
+    df.to_sql(table_name, conn, if_exists="append", index=False, method=method)
+
+
+def hash_values(values) -> np.ndarray:
+    return pd.util.hash_pandas_object(values, index=False).to_numpy().view("int64")
+
+
+def record_keys(batch, pk) -> pd.DataFrame:
+    """
+    Returns the id and a hash of every record of the raw batch.
+    The hash is built from the raw non-null fields of the record sorted by name,
+    so it depends neither on the inferred types nor on the other columns of the batch.
+    """
+    fields = pd.Series("", index=batch.index)
+    for column in sorted(batch.columns):
+        values = batch[column]
+        field = column + "\x1f" + values.astype(str) + "\x1e"
+        fields += field.where(values.notna(), "")
+    return pd.DataFrame({"id": batch[pk].astype(str), "hash": hash_values(fields)})
+
+
+def create_record_hashes_table(engine):
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+            CREATE TABLE IF NOT EXISTS record_hashes (
+                table_name text,
+                id text,
+                hash bigint,
+                PRIMARY KEY (table_name, id)
+            )
+            """)
+        )
+        conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS export_dates (export_date date PRIMARY KEY, imported timestamp DEFAULT now())"
+            )
+        )
+
+
+def upsert_hashes(conn, table_name, keys):
+    buffer = io.StringIO()
+    keys.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    conn.execute(
+        text(
+            "CREATE TEMP TABLE IF NOT EXISTS hash_staging (id text, hash bigint) ON COMMIT DELETE ROWS"
+        )
+    )
+    with conn.connection.cursor() as cur:
+        cur.copy_expert("COPY hash_staging (id, hash) FROM STDIN WITH CSV", buffer)
+    conn.execute(
+        text("""
+        INSERT INTO record_hashes (table_name, id, hash)
+        SELECT :table_name, id, hash FROM hash_staging
+        ON CONFLICT (table_name, id) DO UPDATE SET hash = EXCLUDED.hash
+        """),
+        {"table_name": table_name},
+    )
+
 
-    with zipfile.ZipFile(io.BytesIO(response.content)) as zip_file:
-        for info in zip_file.infolist():
-            with zip_file.open(info) as file:
-                yield file, info
+def write_changes(engine, table_name, pk, df, keys, types: dict[str, str]):
+    """
+    Writes only the records of the batch which are new or whose hash changed.
+    Changed records are replaced. Records without a stored hash are replaced
+    as well, as they might have been imported before the hashes were stored.
+
+    Returns
+    -------
+    tuple
+        number of inserted and updated records
+    """
+    unique = ~keys["id"].duplicated(keep="last").to_numpy()
+    df, keys = df[unique], keys[unique]
+    with engine.begin() as conn:
+        stored = pd.read_sql(
+            text(
+                "SELECT id, hash FROM record_hashes WHERE table_name = :table_name AND id = ANY(:ids)"
+            ),
+            conn,
+            params={"table_name": table_name, "ids": keys["id"].tolist()},
+        )
+        merged = keys.merge(
+            stored.astype({"hash": "Int64"}),
+            on="id",
+            how="left",
+            suffixes=("", "_stored"),
+        )
+        known = merged["hash_stored"].notna().to_numpy()
+        changed = (
+            (merged["hash_stored"] != merged["hash"]).fillna(True).to_numpy(dtype=bool)
+        )
+        updated = known & changed
+        if changed.any():
+            typed = prepare_batch(conn, table_name, df[changed], types, pk)
+            conn.execute(
+                text(f'DELETE FROM "{table_name}" WHERE "{pk}" = ANY(:ids)'),
+                {"ids": typed[pk].tolist()},
+            )
+            write_batch(conn, table_name, typed)
+            upsert_hashes(conn, table_name, keys[changed])
+    return int((changed & ~known).sum()), int(updated.sum())
+
+
+def delete_missing(engine, table_name, pk, seen: np.ndarray):
+    """
+    Deletes the records of the table which were not part of the export.
+
+    Parameters
+    ----------
+    seen : np.ndarray
+        sorted hashes of the ids which were part of the export
+    """
+    missing = []
+    query = text("SELECT id FROM record_hashes WHERE table_name = :table_name")
+    with engine.connect() as conn:
+        for chunk in pd.read_sql(
+            query, conn, params={"table_name": table_name}, chunksize=BATCH_SIZE * 10
+        ):
+            ids = chunk["id"]
+            missing.extend(ids[~np.isin(hash_values(ids), seen)])
+    if missing:
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    f'DELETE FROM "{table_name}" WHERE CAST("{pk}" AS text) = ANY(:ids)'
+                ),
+                {"ids": missing},
+            )
+            conn.execute(
+                text(
+                    "DELETE FROM record_hashes WHERE table_name = :table_name AND id = ANY(:ids)"
+                ),
+                {"table_name": table_name, "ids": missing},
+            )
+    return len(missing)
+
+
+def get_export_date(data_url):
+    match = re.search(r"(\d{8})", data_url)
+    if match is None:
+        return None
+    return pd.to_datetime(match.group(1), format="%Y%m%d").date()
+
+
+def is_imported(engine, export_date) -> bool:
+    query = text("SELECT 1 FROM export_dates WHERE export_date = :export_date")
+    with engine.connect() as conn:
+        return conn.execute(query, {"export_date": export_date}).first() is not None
+
+
+def set_imported(engine, export_date):
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO export_dates (export_date) VALUES (:export_date) ON CONFLICT DO NOTHING"
+            ),
+            {"export_date": export_date},
+        )
 
 
 def init_database(connection, database):
@@ -94,49 +461,141 @@ def set_index(data_):
             return field
 
 
-def create_db_from_export(connection):
+def parse_file(zip_path, filename, batches):
+    """
+    Parses one xml file of the export in a worker process
+    and puts its batches into the queue.
+    A batch of None marks the end of the file.
+    """
+    table_name = filename[0:-4].split("_")[0]
+    log.info(f"read file {filename}")
+    try:
+        with zipfile.ZipFile(zip_path) as zip_file, zip_file.open(filename) as file:
+            for batch in iter_batches(file):
+                pk = set_index(batch)
+                keys = record_keys(batch, pk) if pk else None
+                batches.put((table_name, pk, batch, keys))
+    finally:
+        batches.put((table_name, None, None, None))
+
+
+def write_table(engine, table_name, pk, table_batches, seen: list, failed: set):
+    """
+    Writes all batches of one table until None is received.
+    Only this writer changes the table, so its catalog of column types stays consistent.
+    The hashes of the ids of all written batches are appended to seen.
+    If a batch fails, the table is added to failed.
+    """
+    types = {}
+    inserted, updated = 0, 0
+    while (item := table_batches.get()) is not None:
+        df, keys = item
+        try:
+            if pk is None:
+                # without id the records can not be compared
+                with engine.begin() as conn:
+                    write_batch(
+                        conn, table_name, prepare_batch(conn, table_name, df, types)
+                    )
+                continue
+            batch_inserted, batch_updated = write_changes(
+                engine, table_name, pk, df, keys, types
+            )
+            seen.append(hash_values(keys["id"]))
+            inserted += batch_inserted
+            updated += batch_updated
+        except Exception:
+            log.exception(f"error writing batch of {table_name}")
+            failed.add(table_name)
+    log.info(f"{table_name}: {inserted} inserted, {updated} updated")
+
+
+def create_db_from_export(connection, max_workers=None):
     tables = {}
+    writers = {}
+    max_workers = max_workers or os.cpu_count()
 
     data_url = get_mastr_url()
+    export_date = get_export_date(data_url)
+    create_record_hashes_table(connection)
+    if export_date and is_imported(connection, export_date):
+        log.info(f"export of {export_date} is already imported")
+        return tables
     log.info(f"get data from MaStR with url {data_url}")
-    for file, info in get_data_from_mastr(data_url):
-        log.info(f"read file {info.filename}")
-        if info.filename.endswith(".xml"):
-            table_name = info.filename[0:-4].split("_")[0]
-            df = pd.read_xml(file.read(), encoding="utf-16le")
-            pk = set_index(df)
-
-            # parse date if possible
-            for column in df.columns:
-                if "Datum" in column:
-                    df[column] = pd.to_datetime(df[column], errors="coerce")
-
-            try:
-                # this will fail if there is a new column
-                with connection.begin() as conn:
-                    df.to_sql(table_name, conn, if_exists="append", index=False)
-            except Exception as e:
-                log.info(repr(e))
-                with connection.begin() as conn:
-                    data = pd.read_sql(f'SELECT * FROM "{table_name}"', conn)
-                if "level_0" in data.columns:
-                    del data["level_0"]
-                if "index" in data.columns:
-                    del data["index"]
-                pk = set_index(data)
-                df2 = pd.concat([data, df])
-                with connection.begin() as conn:
-                    df2.to_sql(
-                        name=table_name,
-                        con=connection,
-                        if_exists="replace",
-                        index=False,
+    failed_tables = set()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        zip_path = os.path.join(tmp_dir, "mastr.zip")
+        download_export(data_url, zip_path)
+        filenames = get_xml_files(zip_path)
+        with (
+            multiprocessing.Manager() as manager,
+            ProcessPoolExecutor(max_workers=max_workers) as pool,
+        ):
+            # bounds the parsed batches which wait for their writer
+            batches = manager.Queue(maxsize=2 * max_workers)
+            futures = {
+                pool.submit(parse_file, zip_path, filename, batches): filename
+                for filename in filenames
+            }
+            remaining = len(filenames)
+            while remaining:
+                try:
+                    table_name, pk, df, keys = batches.get(timeout=60)
+                except queue.Empty:
+                    # a crashed worker does not send the end of its file
+                    if all(future.done() for future in futures):
+                        failed_tables.update(writers.keys())
+                        break
+                    continue
+                if df is None:
+                    remaining -= 1
+                    continue
+                if table_name not in writers:
+                    tables[table_name] = pk
+                    table_batches = queue.Queue(maxsize=2)
+                    seen = []
+                    writer = threading.Thread(
+                        target=write_table,
+                        args=(
+                            connection,
+                            table_name,
+                            pk,
+                            table_batches,
+                            seen,
+                            failed_tables,
+                        ),
                     )
-
-            if table_name not in tables.keys():
-                tables[table_name] = pk
+                    writer.start()
+                    writers[table_name] = (writer, table_batches, seen)
+                writers[table_name][1].put((df, keys))
+
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    log.exception(f"error reading {futures[future]}")
+                    failed_tables.add(futures[future][0:-4].split("_")[0])
+        for writer, table_batches, _ in writers.values():
+            table_batches.put(None)
+        for writer, _, _ in writers.values():
+            writer.join()
+
+    for table_name, (_, _, seen) in writers.items():
+        pk = tables[table_name]
+        # a missing file would delete all of its records
+        if pk is None or not seen or table_name in failed_tables:
+            continue
+        deleted = delete_missing(
+            connection, table_name, pk, np.unique(np.concatenate(seen))
+        )
+        log.info(f"{table_name}: {deleted} deleted")
 
     for table_name, pk in tables.items():
+        if pk is None:
+            continue
+        if inspect(connection).get_pk_constraint(table_name)["constrained_columns"]:
+            # primary key exists from a previous import
+            continue
         if str(connection.url).startswith("sqlite:/"):
             query = f"CREATE UNIQUE INDEX idx_{table_name}_{pk} ON {table_name}({pk});"
         else:
@@ -146,6 +605,8 @@ def create_db_from_export(connection):
                 conn.execute(text(query))
         except Exception:
             log.exception("Error adding pk")
+    if export_date and not failed_tables:
+        set_imported(connection, export_date)
     return tables
 
 
@@ -18,6 +18,10 @@ import io
 import logging
 import os
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pandas as pd
 import requests
@@ -28,7 +32,8 @@ from common.base_crawler import BaseCrawler
 log = logging.getLogger("netztransparenz")
 log.setLevel(logging.INFO)
 api_date_format = "%Y-%m-%dT%H:%M:%S"
-csv_date_format = "%Y-%m-%d %H:%M %Z"
+API_URL = "https://ds.netztransparenz.de/api/v1"
+ACCESS_TOKEN_URL = "https://identity.netztransparenz.de/users/connect/token"
 
 metadata_info = {
     "schema_name": "netztransparenz",
@@ -43,17 +48,288 @@ metadata_info = {
 }
 
 
+def month_ranges(start_of_data: str, end_of_data: str) -> list[tuple[str, str]]:
+    """
+    Splits the range into ranges which end at the start of a month,
+    so that large history pulls are requested in monthly chunks.
+    """
+    start = dt.datetime.strptime(start_of_data, api_date_format)
+    end = dt.datetime.strptime(end_of_data, api_date_format)
+    ranges = []
+    while start < end:
+        next_month = (start.replace(day=1) + dt.timedelta(days=32)).replace(
+            day=1, hour=0, minute=0, second=0
+        )
+        chunk_end = min(next_month, end)
+        ranges.append(
+            (start.strftime(api_date_format), chunk_end.strftime(api_date_format))
+        )
+        start = chunk_end
+    return ranges
+
+
+def read_csv(text: str, thousands: str | None = None) -> pd.DataFrame:
+    return pd.read_csv(
+        io.StringIO(text),
+        sep=";",
+        header=0,
+        decimal=",",
+        thousands=thousands,
+        na_values=["N.A."],
+    )
+
+
+def to_utc_strptime(dates, times, zones, date_format: str) -> pd.Series:
+    """
+    Parses the concatenated date, time and time zone strings of every row.
+    Used if the time zone marker is unknown and as reference for the benchmark.
+    """
+    if zones is None:
+        return pd.to_datetime(
+            dates + " " + times, format=f"{date_format} %H:%M", utc=True
+        ).dt.tz_localize(None)
+    return pd.to_datetime(
+        dates + " " + times + " " + zones,
+        format=f"{date_format} %H:%M %Z",
+        utc=True,
+    ).dt.tz_localize(None)
+
+
+def parse_unique(values: pd.Series, parse) -> pd.Index:
+    """
+    Parses every distinct value only once and spreads the result over the rows.
+    Missing values become NaT.
+    """
+    codes, uniques = pd.factorize(values)
+    return parse(uniques).take(codes, allow_fill=True, fill_value=pd.NaT)
+
+
+def to_utc(dates, times, zones=None, date_format: str = "%Y-%m-%d") -> pd.Series:
+    """
+    Builds naive UTC timestamps from the separate date, time and time zone columns.
+    The few distinct dates and times are parsed separately and added as
+    integer offsets, the rows of each time zone marker are localized at once.
+    The markers are time zone names like UTC or CET, where CET observes
+    daylight saving time like when parsing the concatenated strings.
+    This is much faster than parsing the concatenated strings of every row.
+
+    Parameters
+    ----------
+    dates : pd.Series
+        dates in date_format
+    times : pd.Series
+        times as HH:MM
+    zones : pd.Series | None
+        time zone markers like UTC, None if the times are in UTC
+    date_format : str
+        format of the dates
+
+    Returns
+    -------
+    pd.Series
+        timestamps in UTC without time zone
+    """
+    days = parse_unique(
+        dates, lambda u: pd.DatetimeIndex(pd.to_datetime(u, format=date_format))
+    )
+    time_of_day = parse_unique(
+        times, lambda u: pd.TimedeltaIndex(pd.to_timedelta(u + ":00"))
+    )
+    timestamps = days + time_of_day
+    if zones is None:
+        return pd.Series(timestamps, index=dates.index)
+    values = timestamps.to_numpy().copy()
+    values[zones.isna().to_numpy()] = None
+    for zone in zones.dropna().unique():
+        rows = (zones == zone).to_numpy()
+        try:
+            local = timestamps[rows].tz_localize(zone)
+        except KeyError:
+            # not a time zone name
+            return to_utc_strptime(dates, times, zones, date_format)
+        values[rows] = local.tz_convert("UTC").tz_localize(None).to_numpy()
+    return pd.Series(values, index=dates.index)
+
+
+def benchmark_timestamps(file_paths, repeat=3):
+    """
+    Compares the timestamp assembly of to_utc with parsing the concatenated strings
+    on recorded hochrechnung csv files.
+
+    python netztransparenz.py benchmark hochrechnung1.csv hochrechnung2.csv
+    """
+    frames = []
+    for file_path in file_paths:
+        with open(file_path, encoding="utf-8") as f:
+            df = read_csv(f.read(), thousands=".")
+        frames.append(df.rename(mapper=database_friendly, axis="columns"))
+    results = {}
+    for name, assemble in [("strptime", to_utc_strptime), ("to_utc", to_utc)]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for df in frames:
+                for column in ["von", "bis"]:
+                    assemble(
+                        df["datum"], df[column], df[f"zeitzone_{column}"], "%Y-%m-%d"
+                    )
+        results[name] = (time.perf_counter() - start) / repeat
+        rows = sum(len(df) for df in frames)
+        log.info(f"{name}: {results[name]:.3f}s for {rows} rows")
+    return results
+
+
+def parse_hochrechnung(text: str) -> pd.DataFrame:
+    """
+    Parses the csv of the prognose, hochrechnung and vermarktung endpoints,
+    which have a separate time zone for the start and the end of each interval.
+    """
+    df = read_csv(text, thousands=".")
+    df.rename(mapper=database_friendly, axis="columns", inplace=True)
+    df["von"] = to_utc(df["datum"], df["von"], df["zeitzone_von"])
+    df["bis"] = to_utc(df["datum"], df["bis"], df["zeitzone_bis"])
+    return df.drop(["datum", "zeitzone_von", "zeitzone_bis"], axis=1).set_index("von")
+
+
+def parse_nrvsaldo(text: str) -> pd.DataFrame:
+    """
+    Parses the csv of the nrvsaldo endpoints, which have a single time zone per row.
+    """
+    df = read_csv(text)
+    df.rename(mapper=str.lower, axis="columns", inplace=True)
+    df["von"] = to_utc(df["datum"], df["von"], df["zeitzone"], "%d.%m.%Y")
+    df["bis"] = to_utc(df["datum"], df["bis"], df["zeitzone"], "%d.%m.%Y")
+    return df.drop(["datum", "zeitzone"], axis=1).set_index("von")
+
+
+def parse_redispatch(text: str) -> pd.DataFrame:
+    df = read_csv(text)
+    df.rename(mapper=str.lower, axis="columns", inplace=True)
+    df["beginn"] = to_utc(
+        df["beginn_datum"], df["beginn_uhrzeit"], date_format="%d.%m.%Y"
+    )
+    df["ende"] = to_utc(df["ende_datum"], df["ende_uhrzeit"], date_format="%d.%m.%Y")
+    return df.drop(
+        [
+            "beginn_datum",
+            "beginn_uhrzeit",
+            "ende_datum",
+            "ende_uhrzeit",
+            "zeitzone_von",
+            "zeitzone_bis",
+        ],
+        axis=1,
+    ).set_index("beginn")
+
+
+# Every endpoint which is crawled. New endpoints only need a new entry here.
+#   path: path of the endpoint below /data/
+#   table: name of the table the data is appended to
+#   start: start of the data if the table is empty
+#   end: fixed end of the data, otherwise the data is crawled until delay_days ago
+#   delay_days: days to wait until the data of a day is final
+#   parser: function which creates the DataFrame from the csv text
+#   time_column: index column of the table, which is used for the hypertable
+#   latest_column: column whose maximum is the start of the next request
+ENDPOINTS = [
+    # Prognose contains historical data, relevant data is only found in the timeframe below
+    {
+        "path": "prognose/Solar",
+        "table": "prognose_solar",
+        "start": "2011-03-31T22:00:00",
+        "end": "2022-12-14T23:00:00",
+        "parser": parse_hochrechnung,
+    },
+    {
+        "path": "prognose/Wind",
+        "table": "prognose_wind",
+        "start": "2011-03-31T22:00:00",
+        "end": "2022-12-14T23:00:00",
+        "parser": parse_hochrechnung,
+    },
+    {
+        "path": "hochrechnung/Solar",
+        "table": "hochrechnung_solar",
+        "start": "2011-03-31T22:00:00",
+        "delay_days": 1,
+        "parser": parse_hochrechnung,
+    },
+    {
+        "path": "hochrechnung/Wind",
+        "table": "hochrechnung_wind",
+        "start": "2011-03-31T22:00:00",
+        "delay_days": 1,
+        "parser": parse_hochrechnung,
+    },
+    {
+        "path": "vermarktung/InanspruchnahmeAusgleichsenergie",
+        "table": "vermarktung_inanspruchnahme_ausgleichsenergie",
+        "start": "2011-03-31T22:00:00",
+        "delay_days": 1,
+        "parser": parse_hochrechnung,
+    },
+    {
+        "path": "redispatch",
+        "table": "redispatch",
+        "start": "2013-01-01T00:00:00",
+        "delay_days": 1,
+        "parser": parse_redispatch,
+        "time_column": "beginn",
+        "latest_column": "ende",
+    },
+    # Data might be subject to change for 20 Work days, so we wait 30 calendar days to crawl
+    {
+        "path": "nrvsaldo/NRVSaldo/Qualitaetsgesichert",
+        "table": "nrv_saldo",
+        "start": "2014-01-01T00:00:00",
+        "delay_days": 30,
+        "parser": parse_nrvsaldo,
+    },
+    {
+        "path": "nrvsaldo/RZSaldo/Qualitaetsgesichert",
+        "table": "rz_saldo",
+        "start": "2014-01-01T00:00:00",
+        "delay_days": 30,
+        "parser": parse_nrvsaldo,
+    },
+    {
+        "path": "nrvsaldo/AktivierteSRL/Qualitaetsgesichert",
+        "table": "aktivierte_srl",
+        "start": "2013-01-01T00:00:00",
+        "delay_days": 30,
+        "parser": parse_nrvsaldo,
+    },
+    {
+        "path": "nrvsaldo/AktivierteMRL/Qualitaetsgesichert",
+        "table": "aktivierte_mrl",
+        "start": "2013-01-01T00:00:00",
+        "delay_days": 30,
+        "parser": parse_nrvsaldo,
+    },
+    {
+        "path": "nrvsaldo/VoAA/Qualitaetsgesichert",
+        "table": "value_of_avoided_activation",
+        "start": "2023-11-01T00:00:00",
+        "delay_days": 30,
+        "parser": parse_nrvsaldo,
+    },
+]
+
+
 class NetztransparenzCrawler(BaseCrawler):
-    def __init__(self, schema_name):
+    def __init__(self, schema_name, max_workers=4):
         super().__init__(schema_name)
+        self.max_workers = max_workers
+        # all requests share one session, which carries the current token
+        self.session = requests.Session()
+        self.token_lock = threading.Lock()
+        self.refresh_token()
 
+    def refresh_token(self):
         # add your Client-ID and Client-secret from the API Client configuration GUI to
         # your environment variable first
         IPNT_CLIENT_ID = os.environ.get("IPNT_CLIENT_ID")
         IPNT_CLIENT_SECRET = os.environ.get("IPNT_CLIENT_SECRET")
 
-        ACCESS_TOKEN_URL = "https://identity.netztransparenz.de/users/connect/token"
-
         # Ask for the token providing above authorization data
         response = requests.post(
             ACCESS_TOKEN_URL,
@@ -67,6 +343,7 @@ class NetztransparenzCrawler(BaseCrawler):
         # Parse the token from the response if the response was OK
         if response.ok:
             self.token = response.json()["access_token"]
+            self.session.headers["Authorization"] = f"Bearer {self.token}"
         else:
             message = (
                 f"Error retrieving token\n{response.status_code}:{response.reason}"
@@ -74,416 +351,120 @@ class NetztransparenzCrawler(BaseCrawler):
             log.error(message)
             raise Exception(f"Login failed. {message}")
 
+    def get(self, url):
+        token = self.token
+        response = self.session.get(url)
+        if response.status_code == 401:
+            with self.token_lock:
+                # another thread might have refreshed the expired token already
+                if self.token == token:
+                    log.info("token expired, requesting a new one")
+                    self.refresh_token()
+            response = self.session.get(url)
+        response.raise_for_status()
+        return response
+
     def check_health(self):
-        url = "https://ds.netztransparenz.de/api/v1/health"
-        response = requests.get(url, headers={"Authorization": f"Bearer {self.token}"})
+        response = self.get(f"{API_URL}/health")
         print(response.text, file=sys.stdout)
 
-    def forecast_solar(self):
-        # Prognose Solar contains historical data, relevant data is only found in the timeframe below
-        start_of_data = "2011-03-31T22:00:00"
-        end_of_data = "2022-12-14T23:00:00"
-        url = f"https://ds.netztransparenz.de/api/v1/data/prognose/Solar/{start_of_data}/{end_of_data}"
-        response = requests.get(url, headers={"Authorization": f"Bearer {self.token}"})
-        df = pd.read_csv(
-            io.StringIO(response.text),
-            sep=";",
-            header=0,
-            decimal=",",
-            thousands=".",
-            na_values=["N.A."],
-        )
-        df.rename(mapper=lambda x: database_friendly(x), axis="columns", inplace=True)
-        df["von"] = pd.to_datetime(
-            df["datum"] + " " + df["von"] + " " + df["zeitzone_von"],
-            format=csv_date_format,
-            utc=True,
-        ).dt.tz_localize(None)
-        df["bis"] = pd.to_datetime(
-            df["datum"] + " " + df["bis"] + " " + df["zeitzone_bis"],
-            format=csv_date_format,
-            utc=True,
-        ).dt.tz_localize(None)
-        df = df.drop(["datum", "zeitzone_von", "zeitzone_bis"], axis=1).set_index("von")
-        with self.engine.begin() as conn:
-            df.to_sql("prognose_solar", conn, if_exists="replace")
-
-    def forecast_wind(self):
-        # Prognose Solar contains historical data, relevant data is only found in the timeframe below
-        start_of_data = "2011-03-31T22:00:00"
-        end_of_data = "2022-12-14T23:00:00"
-        url = f"https://ds.netztransparenz.de/api/v1/data/prognose/Wind/{start_of_data}/{end_of_data}"
-        response = requests.get(url, headers={"Authorization": f"Bearer {self.token}"})
-        df = pd.read_csv(
-            io.StringIO(response.text),
-            sep=";",
-            header=0,
-            decimal=",",
-            thousands=".",
-            na_values=["N.A."],
-        )
-        df.rename(mapper=lambda x: database_friendly(x), axis="columns", inplace=True)
-        df["von"] = pd.to_datetime(
-            df["datum"] + " " + df["von"] + " " + df["zeitzone_von"],
-            format=csv_date_format,
-            utc=True,
-        ).dt.tz_localize(None)
-        df["bis"] = pd.to_datetime(
-            df["datum"] + " " + df["bis"] + " " + df["zeitzone_bis"],
-            format=csv_date_format,
-            utc=True,
-        ).dt.tz_localize(None)
-        df = df.drop(["datum", "zeitzone_von", "zeitzone_bis"], axis=1).set_index("von")
-        with self.engine.begin() as conn:
-            df.to_sql("prognose_wind", conn, if_exists="replace")
-
-    def extrapolation_solar(self):
-        tablename = "hochrechnung_solar"
-        start_of_data = "2011-03-31T22:00:00"
-        start_of_data = self.find_latest(tablename, "bis", start_of_data)
-        end_of_data = dt.date.today() - dt.timedelta(days=1)
-        end_of_data = dt.datetime.combine(end_of_data, dt.datetime.min.time()).strftime(
-            api_date_format
-        )
-        if start_of_data < end_of_data:
-            url = f"https://ds.netztransparenz.de/api/v1/data/hochrechnung/Solar/{start_of_data}/{end_of_data}"
-            response = requests.get(
-                url, headers={"Authorization": f"Bearer {self.token}"}
-            )
-            df = pd.read_csv(
-                io.StringIO(response.text),
-                sep=";",
-                header=0,
-                decimal=",",
-                thousands=".",
-                na_values=["N.A."],
-            )
-            df.rename(
-                mapper=lambda x: database_friendly(x),
-                axis="columns",
-                inplace=True,
-            )
-            df["von"] = pd.to_datetime(
-                df["datum"] + " " + df["von"] + " " + df["zeitzone_von"],
-                format=csv_date_format,
-                utc=True,
-            ).dt.tz_localize(None)
-            df["bis"] = pd.to_datetime(
-                df["datum"] + " " + df["bis"] + " " + df["zeitzone_bis"],
-                format=csv_date_format,
-                utc=True,
-            ).dt.tz_localize(None)
-            df = df.drop(["datum", "zeitzone_von", "zeitzone_bis"], axis=1).set_index(
-                "von"
-            )
-            with self.engine.begin() as conn:
-                df.to_sql(tablename, conn, if_exists="append")
-
-    def extrapolation_wind(self):
-        tablename = "hochrechnung_wind"
-        start_of_data = "2011-03-31T22:00:00"
-        start_of_data = self.find_latest(tablename, "bis", start_of_data)
-        end_of_data = dt.date.today() - dt.timedelta(days=1)
-        end_of_data = dt.datetime.combine(end_of_data, dt.datetime.min.time()).strftime(
-            api_date_format
-        )
-        if start_of_data < end_of_data:
-            url = f"https://ds.netztransparenz.de/api/v1/data/hochrechnung/Wind/{start_of_data}/{end_of_data}"
-            response = requests.get(
-                url, headers={"Authorization": f"Bearer {self.token}"}
-            )
-            df = pd.read_csv(
-                io.StringIO(response.text),
-                sep=";",
-                header=0,
-                decimal=",",
-                thousands=".",
-                na_values=["N.A."],
-            )
-            df.rename(
-                mapper=lambda x: database_friendly(x),
-                axis="columns",
-                inplace=True,
-            )
-            df["von"] = pd.to_datetime(
-                df["datum"] + " " + df["von"] + " " + df["zeitzone_von"],
-                format=csv_date_format,
-                utc=True,
-            ).dt.tz_localize(None)
-            df["bis"] = pd.to_datetime(
-                df["datum"] + " " + df["bis"] + " " + df["zeitzone_bis"],
-                format=csv_date_format,
-                utc=True,
-            ).dt.tz_localize(None)
-            df = df.drop(["datum", "zeitzone_von", "zeitzone_bis"], axis=1).set_index(
-                "von"
-            )
-            with self.engine.begin() as conn:
-                df.to_sql(tablename, conn, if_exists="append")
-
-    def utilization_balancing_energy(self):
-        tablename = "vermarktung_inanspruchnahme_ausgleichsenergie"
-        start_of_data = "2011-03-31T22:00:00"
-        start_of_data = self.find_latest(tablename, "bis", start_of_data)
-        end_of_data = dt.date.today() - dt.timedelta(days=1)
-        end_of_data = dt.datetime.combine(end_of_data, dt.datetime.min.time()).strftime(
-            api_date_format
+    def get_range(self, endpoint: dict):
+        start_of_data = self.find_latest(
+            endpoint["table"],
+            endpoint.get("latest_column", "bis"),
+            endpoint["start"],
         )
-        if start_of_data < end_of_data:
-            url = f"https://ds.netztransparenz.de/api/v1/data/vermarktung/InanspruchnahmeAusgleichsenergie/{start_of_data}/{end_of_data}"
-            response = requests.get(
-                url, headers={"Authorization": f"Bearer {self.token}"}
-            )
-            df = pd.read_csv(
-                io.StringIO(response.text),
-                sep=";",
-                header=0,
-                decimal=",",
-                thousands=".",
-                na_values=["N.A."],
-            )
-            df.rename(
-                mapper=lambda x: database_friendly(x),
-                axis="columns",
-                inplace=True,
-            )
-            df["von"] = pd.to_datetime(
-                df["datum"] + " " + df["von"] + " " + df["zeitzone_von"],
-                format=csv_date_format,
-                utc=True,
-            ).dt.tz_localize(None)
-            df["bis"] = pd.to_datetime(
-                df["datum"] + " " + df["bis"] + " " + df["zeitzone_bis"],
-                format=csv_date_format,
-                utc=True,
-            ).dt.tz_localize(None)
-            df = df.drop(["datum", "zeitzone_von", "zeitzone_bis"], axis=1).set_index(
-                "von"
+        end_of_data = endpoint.get("end")
+        if end_of_data is None:
+            end_of_data = dt.date.today() - dt.timedelta(days=endpoint["delay_days"])
+            end_of_data = dt.datetime.combine(
+                end_of_data, dt.datetime.min.time()
+            ).strftime(api_date_format)
+        return start_of_data, end_of_data
+
+    def fetch_chunk(self, endpoint: dict, start, end, last: bool, retries=3):
+        url = f"{API_URL}/data/{endpoint['path']}/{start}/{end}"
+        for attempt in range(retries):
+            try:
+                response = self.get(url)
+                if not response.text.strip():
+                    return None
+                df = endpoint["parser"](response.text)
+                break
+            except Exception as e:
+                if attempt == retries - 1:
+                    raise
+                log.info(f"retrying {endpoint['table']} for {start} - {end}: {e}")
+                time.sleep(5 * (attempt + 1))
+        if not last:
+            # the interval starting at the end of the chunk is part of the next chunk
+            df = df[df.index < pd.Timestamp(end)]
+        return df
+
+    def crawl_endpoint(self, endpoint: dict, download_pool: ThreadPoolExecutor):
+        """
+        Crawls the endpoint in monthly chunks, which are downloaded concurrently
+        and written in order as soon as they are parsed.
+        If a chunk fails, the later chunks are not written,
+        so that the next run continues with the failed chunk.
+        """
+        tablename = endpoint["table"]
+        start_of_data, end_of_data = self.get_range(endpoint)
+        if start_of_data >= end_of_data:
+            log.info(f"{tablename} is up to date")
+            return
+        chunks = deque(month_ranges(start_of_data, end_of_data))
+        pending = deque()
+        rows = 0
+
+        def submit_next():
+            start, end = chunks.popleft()
+            future = download_pool.submit(
+                self.fetch_chunk, endpoint, start, end, end == end_of_data
             )
+            pending.append((start, end, future))
+
+        # only a few chunks are held in memory at once
+        while chunks and len(pending) < self.max_workers:
+            submit_next()
+        while pending:
+            start, end, future = pending.popleft()
+            try:
+                df = future.result()
+            except Exception as e:
+                log.error(f"could not crawl {tablename} for {start} - {end}: {e}")
+                for *_, later in pending:
+                    later.cancel()
+                break
+            if chunks:
+                submit_next()
+            if df is None or df.empty:
+                continue
             with self.engine.begin() as conn:
                 df.to_sql(tablename, conn, if_exists="append")
-
-    def redispatch(self):
-        tablename = "redispatch"
-        start_of_data = "2013-01-01T00:00:00"
-        start_of_data = self.find_latest(tablename, "bis", start_of_data)
-        end_of_data = dt.date.today() - dt.timedelta(days=1)
-        end_of_data = dt.datetime.combine(end_of_data, dt.datetime.min.time()).strftime(
-            api_date_format
-        )
-        if start_of_data < end_of_data:
-            url = f"https://ds.netztransparenz.de/api/v1/data/redispatch/{start_of_data}/{end_of_data}"
-            response = requests.get(
-                url, headers={"Authorization": f"Bearer {self.token}"}
-            )
-            df = pd.read_csv(
-                io.StringIO(response.text),
-                sep=";",
-                header=0,
-                decimal=",",
-                na_values=["N.A."],
-            )
-            df.rename(mapper=str.lower, axis="columns", inplace=True)
-            df["beginn"] = pd.to_datetime(
-                df["beginn_datum"] + " " + df["beginn_uhrzeit"],
-                format="%d.%m.%Y %H:%M",
-                utc=True,
-            ).dt.tz_localize(None)
-            df["ende"] = pd.to_datetime(
-                df["ende_datum"] + " " + df["ende_uhrzeit"],
-                format="%d.%m.%Y %H:%M",
-                utc=True,
-            ).dt.tz_localize(None)
-            df = df.drop(
-                [
-                    "beginn_datum",
-                    "beginn_uhrzeit",
-                    "ende_datum",
-                    "ende_uhrzeit",
-                    "zeitzone_von",
-                    "zeitzone_bis",
-                ],
-                axis=1,
-            ).set_index("beginn")
-            with self.engine.begin() as conn:
-                df.to_sql(tablename, conn, if_exists="append")
-
-    def gcc_balance(self):
-        tablename = "nrv_saldo"
-        start_of_data = "2014-01-01T00:00:00"
-        start_of_data = self.find_latest(tablename, "bis", start_of_data)
-        # Data might be subject to change for 20 Work days, so we wait 30 calendar days to crawl
-        end_of_data = dt.date.today() - dt.timedelta(days=30)
-        end_of_data = dt.datetime.combine(end_of_data, dt.datetime.min.time()).strftime(
-            api_date_format
-        )
-        if start_of_data < end_of_data:
-            url = f"https://ds.netztransparenz.de/api/v1/data/nrvsaldo/NRVSaldo/Qualitaetsgesichert/{start_of_data}/{end_of_data}"
-            response = requests.get(
-                url, headers={"Authorization": f"Bearer {self.token}"}
-            )
-            df = pd.read_csv(
-                io.StringIO(response.text),
-                sep=";",
-                header=0,
-                decimal=",",
-                na_values=["N.A."],
-            )
-            df.rename(mapper=str.lower, axis="columns", inplace=True)
-            df["von"] = pd.to_datetime(
-                df["datum"] + " " + df["von"] + " " + df["zeitzone"],
-                format="%d.%m.%Y %H:%M %Z",
-                utc=True,
-            ).dt.tz_localize(None)
-            df["bis"] = pd.to_datetime(
-                df["datum"] + " " + df["bis"] + " " + df["zeitzone"],
-                format="%d.%m.%Y %H:%M %Z",
-                utc=True,
-            ).dt.tz_localize(None)
-            df = df.drop(["datum", "zeitzone"], axis=1).set_index("von")
-            with self.engine.begin() as conn:
-                df.to_sql(tablename, conn, if_exists="append")
-
-    def lfc_area_balance(self):
-        tablename = "rz_saldo"
-        start_of_data = "2014-01-01T00:00:00"
-        start_of_data = self.find_latest(tablename, "bis", start_of_data)
-        # Data might be subject to change for 20 Work days, so we wait 30 calendar days to crawl
-        end_of_data = dt.date.today() - dt.timedelta(days=30)
-        end_of_data = dt.datetime.combine(end_of_data, dt.datetime.min.time()).strftime(
-            api_date_format
-        )
-        if start_of_data < end_of_data:
-            url = f"https://ds.netztransparenz.de/api/v1/data/nrvsaldo/RZSaldo/Qualitaetsgesichert/{start_of_data}/{end_of_data}"
-            response = requests.get(
-                url, headers={"Authorization": f"Bearer {self.token}"}
-            )
-            df = pd.read_csv(
-                io.StringIO(response.text),
-                sep=";",
-                header=0,
-                decimal=",",
-                na_values=["N.A."],
-            )
-            df.rename(mapper=str.lower, axis="columns", inplace=True)
-            df["von"] = pd.to_datetime(
-                df["datum"] + " " + df["von"] + " " + df["zeitzone"],
-                format="%d.%m.%Y %H:%M %Z",
-                utc=True,
-            ).dt.tz_localize(None)
-            df["bis"] = pd.to_datetime(
-                df["datum"] + " " + df["bis"] + " " + df["zeitzone"],
-                format="%d.%m.%Y %H:%M %Z",
-                utc=True,
-            ).dt.tz_localize(None)
-            df = df.drop(["datum", "zeitzone"], axis=1).set_index("von")
-            with self.engine.begin() as conn:
-                df.to_sql(tablename, conn, if_exists="append")
-
-    def activated_automatic_balancing_capacity(self):
-        tablename = "aktivierte_srl"
-        start_of_data = "2013-01-01T00:00:00"
-        start_of_data = self.find_latest(tablename, "bis", start_of_data)
-        end_of_data = dt.date.today() - dt.timedelta(days=30)
-        end_of_data = dt.datetime.combine(end_of_data, dt.datetime.min.time()).strftime(
-            api_date_format
-        )
-        if start_of_data < end_of_data:
-            url = f"https://ds.netztransparenz.de/api/v1/data/nrvsaldo/AktivierteSRL/Qualitaetsgesichert/{start_of_data}/{end_of_data}"
-            response = requests.get(
-                url, headers={"Authorization": f"Bearer {self.token}"}
-            )
-            df = pd.read_csv(
-                io.StringIO(response.text),
-                sep=";",
-                header=0,
-                decimal=",",
-                na_values=["N.A."],
-            )
-            df.rename(mapper=str.lower, axis="columns", inplace=True)
-            df["von"] = pd.to_datetime(
-                df["datum"] + " " + df["von"] + " " + df["zeitzone"],
-                format="%d.%m.%Y %H:%M %Z",
-                utc=True,
-            ).dt.tz_localize(None)
-            df["bis"] = pd.to_datetime(
-                df["datum"] + " " + df["bis"] + " " + df["zeitzone"],
-                format="%d.%m.%Y %H:%M %Z",
-                utc=True,
-            ).dt.tz_localize(None)
-            df = df.drop(["datum", "zeitzone"], axis=1).set_index("von")
-            with self.engine.begin() as conn:
-                df.to_sql(tablename, conn, if_exists="append")
-
-    def activated_manual_balancing_capacity(self):
-        tablename = "aktivierte_mrl"
-        start_of_data = "2013-01-01T00:00:00"
-        start_of_data = self.find_latest(tablename, "bis", start_of_data)
-        end_of_data = dt.date.today() - dt.timedelta(days=30)
-        end_of_data = dt.datetime.combine(end_of_data, dt.datetime.min.time()).strftime(
-            api_date_format
-        )
-        if start_of_data < end_of_data:
-            url = f"https://ds.netztransparenz.de/api/v1/data/nrvsaldo/AktivierteMRL/Qualitaetsgesichert/{start_of_data}/{end_of_data}"
-            response = requests.get(
-                url, headers={"Authorization": f"Bearer {self.token}"}
-            )
-            df = pd.read_csv(
-                io.StringIO(response.text),
-                sep=";",
-                header=0,
-                decimal=",",
-                na_values=["N.A."],
-            )
-            df.rename(mapper=str.lower, axis="columns", inplace=True)
-            df["von"] = pd.to_datetime(
-                df["datum"] + " " + df["von"] + " " + df["zeitzone"],
-                format="%d.%m.%Y %H:%M %Z",
-                utc=True,
-            ).dt.tz_localize(None)
-            df["bis"] = pd.to_datetime(
-                df["datum"] + " " + df["bis"] + " " + df["zeitzone"],
-                format="%d.%m.%Y %H:%M %Z",
-                utc=True,
-            ).dt.tz_localize(None)
-            df = df.drop(["datum", "zeitzone"], axis=1).set_index("von")
-            with self.engine.begin() as conn:
-                df.to_sql(tablename, conn, if_exists="append")
-
-    def value_of_avoided_activation(self):
-        tablename = "value_of_avoided_activation"
-        start_of_data = "2023-11-01T00:00:00"
-        start_of_data = self.find_latest(tablename, "bis", start_of_data)
-        end_of_data = dt.date.today() - dt.timedelta(days=30)
-        end_of_data = dt.datetime.combine(end_of_data, dt.datetime.min.time()).strftime(
-            api_date_format
-        )
-        if start_of_data < end_of_data:
-            url = f"https://ds.netztransparenz.de/api/v1/data/nrvsaldo/VoAA/Qualitaetsgesichert/{start_of_data}/{end_of_data}"
-            response = requests.get(
-                url, headers={"Authorization": f"Bearer {self.token}"}
-            )
-            df = pd.read_csv(
-                io.StringIO(response.text),
-                sep=";",
-                header=0,
-                decimal=",",
-                na_values=["N.A."],
-            )
-            df.rename(mapper=str.lower, axis="columns", inplace=True)
-            df["von"] = pd.to_datetime(
-                df["datum"] + " " + df["von"] + " " + df["zeitzone"],
-                format="%d.%m.%Y %H:%M %Z",
-                utc=True,
-            ).dt.tz_localize(None)
-            df["bis"] = pd.to_datetime(
-                df["datum"] + " " + df["bis"] + " " + df["zeitzone"],
-                format="%d.%m.%Y %H:%M %Z",
-                utc=True,
-            ).dt.tz_localize(None)
-            df = df.drop(["datum", "zeitzone"], axis=1).set_index("von")
-            with self.engine.begin() as conn:
-                df.to_sql(tablename, conn, if_exists="append")
+            rows += len(df)
+        log.info(f"wrote {rows} rows to {tablename}")
+
+    def crawl_endpoints(self, endpoints: list[dict] = ENDPOINTS):
+        """
+        Crawls the given endpoints concurrently.
+        A failing endpoint is logged and does not stop the others.
+        """
+        with (
+            ThreadPoolExecutor(max_workers=self.max_workers) as download_pool,
+            ThreadPoolExecutor(max_workers=self.max_workers) as executor,
+        ):
+            futures = {
+                executor.submit(self.crawl_endpoint, endpoint, download_pool): endpoint[
+                    "table"
+                ]
+                for endpoint in endpoints
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    log.error(f"could not crawl {futures[future]}: {e}")
 
     def find_latest(self, tablename: str, column_name: str, default):
         try:
@@ -494,26 +475,17 @@ class NetztransparenzCrawler(BaseCrawler):
         except Exception:
             return default
 
-    def create_hypertable(self):
-        try:
-            with self.engine.begin() as conn:
-                for tablename in [
-                    "prognose_solar",
-                    "prognose_wind",
-                    "hochrechnung_solar",
-                    "hochrechnung_wind",
-                    "vermarktung_inanspruchnahme_ausgleichsenergie" "redispatch",
-                    "nrv_saldo",
-                    "rz_saldo",
-                    "aktivierte_srl",
-                    "aktivierte_mrl",
-                    "value_of_avoided_activation",
-                ]:
-                    query_create_hypertable = f"SELECT create_hypertable('{tablename}', 'von', if_not_exists => TRUE, migrate_data => TRUE);"
+    def create_hypertable(self, endpoints: list[dict] = ENDPOINTS):
+        for endpoint in endpoints:
+            tablename = endpoint["table"]
+            time_column = endpoint.get("time_column", "von")
+            try:
+                with self.engine.begin() as conn:
+                    query_create_hypertable = f"SELECT create_hypertable('{tablename}', '{time_column}', if_not_exists => TRUE, migrate_data => TRUE);"
                     conn.execute(sql.text(query_create_hypertable))
-            log.info("created hypertables for netztransparenz")
-        except Exception as e:
-            log.error(f"could not create hypertable: {e}")
+            except Exception as e:
+                log.error(f"could not create hypertable {tablename}: {e}")
+        log.info("created hypertables for netztransparenz")
 
     def check_table_exists(self, tablename):
         return sql.inspect(self.engine).has_table(tablename)
@@ -527,25 +499,15 @@ def main(schema_name):
     crawler = NetztransparenzCrawler(schema_name)
 
     # crawler.check_health()
-    if not crawler.check_table_exists("prognose_solar"):
-        log.info("No Solar")
-        crawler.forecast_solar()
-    if not crawler.check_table_exists("prognose_wind"):
-        log.info("No Wind")
-        crawler.forecast_wind()
-    crawler.extrapolation_solar()
-    crawler.extrapolation_wind()
-    crawler.utilization_balancing_energy()
-    crawler.redispatch()
-    crawler.gcc_balance()
-    crawler.lfc_area_balance()
-    crawler.activated_automatic_balancing_capacity()
-    crawler.activated_manual_balancing_capacity()
-    crawler.value_of_avoided_activation()
+    crawler.crawl_endpoints()
     crawler.create_hypertable()
 
     crawler.set_metadata(metadata_info)
 
 
 if __name__ == "__main__":
-    main("netztransparenz")
+    logging.basicConfig()
+    if len(sys.argv) > 2 and sys.argv[1] == "benchmark":
+        benchmark_timestamps(sys.argv[2:])
+    else:
+        main("netztransparenz")
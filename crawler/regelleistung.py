@@ -6,29 +6,27 @@
 https://regelleistung.net/
 """
 
-import functools as ft
-import json
+import importlib.util
+import io
 import logging
-import os.path
 import sys
+import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import date, datetime, timedelta
 
-import numpy as np
 import pandas as pd
+import requests
 import sqlalchemy
 from sqlalchemy import create_engine, text
 
-from .config import db_uri
+from common.config import db_uri
 
 log = logging.getLogger("regelleistung")
 log.setLevel(logging.INFO)
 
 EARLIEST_DATE_TO_WRITE = datetime.strptime("2019-01-01", "%Y-%m-%d").date()
 
-DATES_IN_DB = {}
-FILE_PATH_DATE_IN_DB = "regelleistung_dates_written_in_db.json"
-
 # Regelleistungsmarkt
 TABLE_NAME_FCR_DEMANDS = "fcr_bedarfe"
 URL_FCR_DEMANDS = "https://www.regelleistung.net/apps/cpp-publisher/api/v1/download/tenders/demands?date={date_str}&exportFormat=xlsx&market=CAPACITY&productTypes=FCR"
@@ -74,31 +72,40 @@ URL_ABLA_RESULTS_ENERGY = "https://www.regelleistung.net/apps/cpp-publisher/api/
 TABLE_NAME_ABLA_ANONYM_RESULTS_ENERGY = "abla_anonyme_ergebnisse"
 URL_ABLA_ANONYM_RESULTS_ENERGY = "https://www.regelleistung.net/apps/cpp-publisher/api/v1/download/tenders/anonymousresults?date={date_str}&exportFormat=xlsx&market=CAPACITY&productTypes=ABLA"
 
+TABLES = {
+    # Regelleistungsmarkt
+    TABLE_NAME_FCR_DEMANDS: URL_FCR_DEMANDS,
+    TABLE_NAME_FCR_RESULTS: URL_FCR_RESULTS,
+    TABLE_NAME_FCR_ANONYM_RESULTS: URL_FCR_ANONYM_RESULTS,
+    TABLE_NAME_AFRR_DEMANDS_CAPACITY: URL_AFRR_DEMANDS_CAPACITY,
+    TABLE_NAME_AFRR_RESULTS_CAPACITY: URL_AFRR_RESULTS_CAPACITY,
+    TABLE_NAME_AFRR_ANONYM_RESULTS_CAPACITY: URL_AFRR_ANONYM_RESULTS_CAPACITY,
+    TABLE_NAME_MFRR_DEMANDS_CAPACITY: URL_MFRR_DEMANDS_CAPACITY,
+    TABLE_NAME_MFRR_RESULTS_CAPACITY: URL_MFRR_RESULTS_CAPACITY,
+    TABLE_NAME_MFRR_ANONYM_RESULTS_CAPACITY: URL_MFRR_ANONYM_RESULTS_CAPACITY,
+    # Regelarbeitsmarkt
+    TABLE_NAME_AFRR_DEMANDS_ENERGY: URL_AFRR_DEMANDS_ENERGY,
+    TABLE_NAME_AFRR_RESULTS_ENERGY: URL_AFRR_RESULTS_ENERGY,
+    TABLE_NAME_AFRR_ANONYM_RESULTS_ENERGY: URL_AFRR_ANONYM_RESULTS_ENERGY,
+    TABLE_NAME_MFRR_DEMANDS_ENERGY: URL_MFRR_DEMANDS_ENERGY,
+    TABLE_NAME_MFRR_RESULTS_ENERGY: URL_MFRR_RESULTS_ENERGY,
+    TABLE_NAME_MFRR_ANONYM_RESULTS_ENERGY: URL_MFRR_ANONYM_RESULTS_ENERGY,
+    # Abschaltbare Lasten
+    TABLE_NAME_ABLA_DEMANDS_ENERGY: URL_ABLA_DEMANDS_ENERGY,
+    TABLE_NAME_ABLA_RESULTS_ENERGY: URL_ABLA_RESULTS_ENERGY,
+    TABLE_NAME_ABLA_ANONYM_RESULTS_ENERGY: URL_ABLA_ANONYM_RESULTS_ENERGY,
+}
 
-def add_latest_date_to_dict(date, table_name):
-    if date is not None:
-        if f"latest_date_in_db_{table_name}" in DATES_IN_DB.keys():
-            latest_date_str = DATES_IN_DB[f"latest_date_in_db_{table_name}"]
-            latest_date = datetime.strptime(latest_date_str, "%Y-%m-%d").date()
-            if latest_date < date:
-                DATES_IN_DB[f"latest_date_in_db_{table_name}"] = date.strftime(
-                    "%Y-%m-%d"
-                )
-        else:
-            DATES_IN_DB[f"latest_date_in_db_{table_name}"] = date.strftime("%Y-%m-%d")
-
-
-def add_earliest_date_to_dict(date, table_name):
-    if date is not None:
-        if f"earliest_date_in_db_{table_name}" in DATES_IN_DB.keys():
-            earliest_date_str = DATES_IN_DB[f"earliest_date_in_db_{table_name}"]
-            earliest_date = datetime.strptime(earliest_date_str, "%Y-%m-%d").date()
-            if earliest_date > date:
-                DATES_IN_DB[f"earliest_date_in_db_{table_name}"] = date.strftime(
-                    "%Y-%m-%d"
-                )
-        else:
-            DATES_IN_DB[f"earliest_date_in_db_{table_name}"] = date.strftime("%Y-%m-%d")
+# concurrent downloads of daily exports over all tables
+MAX_DOWNLOADS = 8
+# tables which are crawled at the same time
+MAX_TABLES = 4
+# days which are fetched ahead of the writer of a table
+DAYS_PER_BATCH = 28
+
+
+# exports of days which are not older than this might still be published later
+DAYS_UNTIL_UNAVAILABLE = 7
 
 
 def get_date_column_from_table_name(table_name):
@@ -108,61 +115,127 @@ def get_date_column_from_table_name(table_name):
         return "date_from"
 
 
-def get_date_from_sql(engine, table_name, sql):
-    try:
-        with engine.begin() as conn:
-            date_col = get_date_column_from_table_name(table_name)
-            df = pd.read_sql(sql, conn, parse_dates=[date_col])
-            date = (df[date_col][0]).date()
-            return date
-    except sqlalchemy.exc.ProgrammingError as e:
-        _, err_obj, _ = sys.exc_info()
-        if "psycopg2.errors.UndefinedTable" in str(err_obj):
-            log.info(f"There does not exist a table {table_name} yet.")
-            return None
-        elif (
-            f'(psycopg2.errors.UndefinedColumn) column "{date_col}" does not exist'
-            in str(err_obj)
-        ):
-            log.info(
-                f'The date column "{date_col}" does not exist in the table "{table_name}".'
-            )
-        else:
-            log.error(e)
-    except Exception as e:
-        log.error(e)
+def days_to_bitmap(first_day, days):
+    if not days:
+        return ""
+    bits = ["0"] * ((max(days) - first_day).days + 1)
+    for day in days:
+        bits[(day - first_day).days] = "1"
+    return "".join(bits)
 
 
-def get_latest_date(engine, table_name):
-    latest_date = get_latest_date_if_table_exists(engine, table_name)
-    if latest_date is None and f"latest_date_in_db_{table_name}" in DATES_IN_DB.keys():
-        latest_date_str = DATES_IN_DB[f"latest_date_in_db_{table_name}"]
-        latest_date = datetime.strptime(latest_date_str, "%Y-%m-%d").date()
+def bitmap_to_days(first_day, bitmap):
+    return {
+        first_day + timedelta(days=i)
+        for i, bit in enumerate(bitmap or "")
+        if bit == "1"
+    }
 
-    return latest_date
 
-
-def get_earliest_date(engine, table_name):
-    earliest_date = get_earliest_date_if_table_exists(engine, table_name)
-    if (
-        earliest_date is None
-        and f"earliest_date_in_db_{table_name}" in DATES_IN_DB.keys()
-    ):
-        earliest_date_str = DATES_IN_DB[f"earliest_date_in_db_{table_name}"]
-        earliest_date = datetime.strptime(earliest_date_str, "%Y-%m-%d").date()
-    return earliest_date
+def create_coverage_table(engine):
+    """
+    The table coverage stores for each table a bitmap of the days which are written
+    and a bitmap of the days for which no export is available.
+    Bit i refers to the day first_day + i.
+    """
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+            CREATE TABLE IF NOT EXISTS coverage (
+            table_name text PRIMARY KEY,
+            first_day date NOT NULL,
+            written bit varying NOT NULL,
+            unavailable bit varying NOT NULL)
+            """)
+        )
 
 
-def get_latest_date_if_table_exists(engine, table_name):
-    date_col = get_date_column_from_table_name(table_name)
-    sql = f"SELECT max({date_col}) AS {date_col} FROM {table_name}"
-    return get_date_from_sql(engine, table_name, sql)
+def mark_days(engine, table_name, days, column="written"):
+    """
+    Sets the bits of the given days in the written or unavailable bitmap of the table
+    """
+    with engine.begin() as conn:
+        row = conn.execute(
+            text(
+                "SELECT first_day, written, unavailable FROM coverage WHERE table_name = :table_name FOR UPDATE"
+            ),
+            {"table_name": table_name},
+        ).fetchone()
+        marked = {"written": set(), "unavailable": set()}
+        if row is not None:
+            first_day, written, unavailable = row
+            marked["written"] = bitmap_to_days(first_day, written)
+            marked["unavailable"] = bitmap_to_days(first_day, unavailable)
+        marked[column].update(days)
+        marked["unavailable"] -= marked["written"]
+        all_days = marked["written"] | marked["unavailable"]
+        first_day = min(all_days) if all_days else EARLIEST_DATE_TO_WRITE
+        conn.execute(
+            text("""
+            INSERT INTO coverage (table_name, first_day, written, unavailable)
+            VALUES (:table_name, :first_day, CAST(:written AS bit varying), CAST(:unavailable AS bit varying))
+            ON CONFLICT (table_name) DO UPDATE SET
+                first_day = EXCLUDED.first_day,
+                written = EXCLUDED.written,
+                unavailable = EXCLUDED.unavailable
+            """),
+            {
+                "table_name": table_name,
+                "first_day": first_day,
+                "written": days_to_bitmap(first_day, marked["written"]),
+                "unavailable": days_to_bitmap(first_day, marked["unavailable"]),
+            },
+        )
 
 
-def get_earliest_date_if_table_exists(engine, table_name):
+def init_coverage(engine, table_name):
+    """
+    Derives the written days once from the table, if it was written before the coverage existed
+    """
+    with engine.begin() as conn:
+        row = conn.execute(
+            text("SELECT 1 FROM coverage WHERE table_name = :table_name"),
+            {"table_name": table_name},
+        ).fetchone()
+    if row is not None:
+        return
     date_col = get_date_column_from_table_name(table_name)
-    sql = f"SELECT min({date_col}) AS {date_col} FROM {table_name}"
-    return get_date_from_sql(engine, table_name, sql)
+    try:
+        with engine.begin() as conn:
+            result = conn.execute(
+                text(f"SELECT DISTINCT CAST({date_col} AS date) FROM {table_name}")
+            )
+            days = [r[0] for r in result]
+        log.info(f"initialized coverage of {table_name} with {len(days)} days")
+    except sqlalchemy.exc.ProgrammingError:
+        log.info(f"There does not exist a table {table_name} yet.")
+        days = []
+    mark_days(engine, table_name, days)
+
+
+def get_missing_days(engine, table_name, first_day, last_day):
+    """
+    Returns all days between first_day and last_day
+    which are neither written nor known to be unavailable
+    """
+    query = text("""
+        SELECT CAST(d AS date) FROM generate_series(
+            CAST(:first_day AS date), CAST(:last_day AS date), interval '1 day') AS d
+        LEFT JOIN coverage c ON c.table_name = :table_name
+        WHERE c.table_name IS NULL
+        OR CAST(d AS date) < c.first_day
+        OR (
+            substring(c.written FROM CAST(d AS date) - c.first_day + 1 FOR 1) IS DISTINCT FROM B'1'
+            AND substring(c.unavailable FROM CAST(d AS date) - c.first_day + 1 FOR 1) IS DISTINCT FROM B'1'
+        )
+        ORDER BY 1
+        """)
+    with engine.begin() as conn:
+        result = conn.execute(
+            query,
+            {"table_name": table_name, "first_day": first_day, "last_day": last_day},
+        )
+        return [r[0] for r in result]
 
 
 def database_friendly(string):
@@ -243,315 +316,221 @@ def col_rename_fcr_demand(string):
     )
 
 
-def prepare_demands_df(df):
-    df.rename(mapper=lambda x: col_rename_fcr_demand(x), axis="columns", inplace=True)
-    col_mapping = {}
-    id_vars = []
-    demand_cols = []
-    export_cols = []
-    nuclear_portion_cols = []
-    for col_name in df.columns:
-        if col_name.endswith("_demand_mw"):
-            area_name = (
-                col_name.rsplit("_", 2)[0]
-                if col_name == "total_demand_mw"
-                else col_name.rsplit("_", 3)[0]
-            )
-            col_mapping.update({col_name: area_name})
-            demand_cols.append(col_name)
-        elif col_name.endswith("_export_limit_mw"):
-            area_name = (
-                col_name.rsplit("_", 3)[0]
-                if col_name == "total_export_limit_mw"
-                else col_name.rsplit("_", 4)[0]
-            )
-            col_mapping.update({col_name: area_name})
-            export_cols.append(col_name)
-        elif col_name.endswith("_core_portion_mw"):
-            area_name = (
-                col_name.rsplit("_", 3)[0]
-                if col_name == "total_core_portion_mw"
-                else col_name.rsplit("_", 4)[0]
-            )
-            col_mapping.update({col_name: area_name})
-            nuclear_portion_cols.append(col_name)
-        else:
-            id_vars.append(col_name)
-    var_col_name = "area"
-    df_melted_demand = df.melt(
-        id_vars=id_vars,
-        value_vars=demand_cols,
-        var_name=var_col_name,
-        value_name="demand_mw",
-    )
-    df_melted_demand[var_col_name] = df_melted_demand[var_col_name].replace(col_mapping)
-    df_melted_export = df.melt(
-        id_vars=id_vars,
-        value_vars=export_cols,
-        var_name=var_col_name,
-        value_name="export_limit_mw",
-    )
-    df_melted_export[var_col_name] = df_melted_export[var_col_name].replace(col_mapping)
-    df_melted_nuclear = df.melt(
-        id_vars=id_vars,
-        value_vars=nuclear_portion_cols,
-        var_name=var_col_name,
-        value_name="nuclear_portion_mw",
-    )
-    df_melted_nuclear[var_col_name] = df_melted_nuclear[var_col_name].replace(
-        col_mapping
-    )
+def reshape_area_columns(df, value_names, area_of=lambda prefix: prefix):
+    """
+    Converts the columns named {area}{suffix} into one row per area
+    with one column per suffix in a single transform.
 
-    dfs = [df_melted_demand, df_melted_export, df_melted_nuclear]
-    dfs = [df.set_index([*id_vars, var_col_name]) for df in dfs]
-    df_final = ft.reduce(lambda left, right: left.join(right, how="outer"), dfs)
+    Parameters
+    ----------
+    df : pd.DataFrame
+        parsed exports of one or many days
+    value_names : dict[str, str]
+        maps the column suffix to the name of the resulting value column
+    area_of : Callable
+        derives the area from the column name without suffix
+
+    Returns
+    -------
+    pd.DataFrame
+        id columns, area column and one column per value name
+    """
+    value_cols = {}
+    for col_name in df.columns:
+        for suffix, value_name in value_names.items():
+            if col_name.endswith(suffix):
+                value_cols[col_name] = (area_of(col_name[: -len(suffix)]), value_name)
+                break
+    if not value_cols:
+        return df
+    df = df.reset_index(drop=True)
+    id_vars = [col_name for col_name in df.columns if col_name not in value_cols]
 
-    df_final = df_final.dropna(
-        subset=["demand_mw", "export_limit_mw", "nuclear_portion_mw"], how="all"
+    values = df[list(value_cols)]
+    values.columns = pd.MultiIndex.from_tuples(
+        list(value_cols.values()), names=["area", "value_name"]
     )
+    values = values.melt(value_name="value", ignore_index=False)
+    values = values.set_index(["area", "value_name"], append=True)["value"]
+    values = values.unstack("value_name").dropna(how="all")
+    values.columns.name = None
+    values = values.reset_index(level="area")
 
-    return df_final.reset_index()
+    ids = df[id_vars].loc[values.index].reset_index(drop=True)
+    return pd.concat([ids, values.reset_index(drop=True)], axis=1)
 
 
-def prepare_fcr_results_df(df):
-    col_mapping = {}
-    id_vars = []
-    demand_cols = []
-    settlementcapacity_cols = []
-    deficit_surplus_cols = []
-    for col_name in df.columns:
-        if col_name.endswith("_demand_mw"):
-            area_name = col_name.rsplit("_", 2)[0]
-            col_mapping.update({col_name: area_name})
-            demand_cols.append(col_name)
-        elif col_name.endswith("_settlementcapacity_price_eur_mw"):
-            area_name = col_name.rsplit("_", 4)[0]
-            col_mapping.update({col_name: area_name})
-            settlementcapacity_cols.append(col_name)
-        elif col_name.endswith("_deficit_surplus_mw"):
-            area_name = col_name.rsplit("_", 3)[0]
-            col_mapping.update({col_name: area_name})
-            deficit_surplus_cols.append(col_name)
-        else:
-            id_vars.append(col_name)
-    df_melted_demand = df.melt(
-        id_vars=id_vars,
-        value_vars=demand_cols,
-        var_name="area",
-        value_name="demand_mw",
-    )
-    df_melted_demand["area"] = df_melted_demand["area"].replace(col_mapping)
-    df_melted_settlementcapacity = df.melt(
-        id_vars=id_vars,
-        value_vars=settlementcapacity_cols,
-        var_name="area",
-        value_name="settlementcapacity_price_eur_mw",
-    )
-    df_melted_settlementcapacity["area"] = df_melted_settlementcapacity["area"].replace(
-        col_mapping
-    )
-    df_melted_deficit_surplus = df.melt(
-        id_vars=id_vars,
-        value_vars=deficit_surplus_cols,
-        var_name="area",
-        value_name="deficit_surplus_mw",
-    )
-    df_melted_deficit_surplus["area"] = df_melted_deficit_surplus["area"].replace(
-        col_mapping
+def prepare_demands_df(df):
+    df.rename(mapper=lambda x: col_rename_fcr_demand(x), axis="columns", inplace=True)
+    return reshape_area_columns(
+        df,
+        {
+            "_demand_mw": "demand_mw",
+            "_export_limit_mw": "export_limit_mw",
+            "_core_portion_mw": "nuclear_portion_mw",
+        },
+        # germany_country_demand_mw belongs to germany
+        area_of=lambda prefix: (
+            prefix if prefix == "total" else prefix.rsplit("_", 1)[0]
+        ),
     )
 
-    dfs = [
-        df_melted_demand,
-        df_melted_settlementcapacity,
-        df_melted_deficit_surplus,
-    ]
-    dfs = [df.set_index([*id_vars, "area"]) for df in dfs]
-    df_final = ft.reduce(lambda left, right: left.join(right, how="outer"), dfs)
-
-    df_final = df_final.dropna(
-        subset=[
-            "demand_mw",
-            "settlementcapacity_price_eur_mw",
-            "deficit_surplus_mw",
-        ],
-        how="all",
+
+def prepare_fcr_results_df(df):
+    return reshape_area_columns(
+        df,
+        {
+            "_demand_mw": "demand_mw",
+            "_settlementcapacity_price_eur_mw": "settlementcapacity_price_eur_mw",
+            "_deficit_surplus_mw": "deficit_surplus_mw",
+        },
     )
-    return df_final.reset_index()
 
 
 def prepare_afrr_mfrr_results_df(df):
-    col_mapping = {}
-    id_vars = []
-    min_cap_price_cols = []
-    avg_cap_price_cols = []
-    max_cap_price_cols = []
-    import_export_cols = []
-    sum_off_cap_cols = []
-    min_energy_price_cols = []
-    avg_energy_price_cols = []
-    max_energy_price_cols = []
-    for col_name in df.columns:
-        if col_name.endswith("_min_capacity_price_eur_mwh"):
-            area_name = col_name.rsplit("_", 5)[0]
-            col_mapping.update({col_name: area_name})
-            min_cap_price_cols.append(col_name)
-        elif col_name.endswith("_average_capacity_price_eur_mwh"):
-            area_name = col_name.rsplit("_", 5)[0]
-            col_mapping.update({col_name: area_name})
-            avg_cap_price_cols.append(col_name)
-        elif col_name.endswith("_marginal_capacity_price_eur_mwh"):
-            area_name = col_name.rsplit("_", 5)[0]
-            col_mapping.update({col_name: area_name})
-            max_cap_price_cols.append(col_name)
-        elif col_name.endswith("_import_export_mw"):
-            area_name = col_name.rsplit("_", 3)[0]
-            col_mapping.update({col_name: area_name})
-            import_export_cols.append(col_name)
-        elif col_name.endswith("_sum_of_offered_capacity_mw"):
-            area_name = col_name.rsplit("_", 5)[0]
-            col_mapping.update({col_name: area_name})
-            sum_off_cap_cols.append(col_name)
-        elif col_name.endswith("_min_energy_price_eur_mwh"):
-            area_name = col_name.rsplit("_", 5)[0]
-            col_mapping.update({col_name: area_name})
-            min_energy_price_cols.append(col_name)
-        elif col_name.endswith("_average_energy_price_eur_mwh"):
-            area_name = col_name.rsplit("_", 5)[0]
-            col_mapping.update({col_name: area_name})
-            avg_energy_price_cols.append(col_name)
-        elif col_name.endswith("_marginal_energy_price_eur_mwh"):
-            area_name = col_name.rsplit("_", 5)[0]
-            col_mapping.update({col_name: area_name})
-            max_energy_price_cols.append(col_name)
-        else:
-            id_vars.append(col_name)
-    df_melted_min_cap_price = df.melt(
-        id_vars=id_vars,
-        value_vars=min_cap_price_cols,
-        var_name="area",
-        value_name="min_capacity_price_eur_mwh",
-    )
-    df_melted_min_cap_price["area"] = df_melted_min_cap_price["area"].replace(
-        col_mapping
-    )
-    df_melted_avg_cap_price = df.melt(
-        id_vars=id_vars,
-        value_vars=avg_cap_price_cols,
-        var_name="area",
-        value_name="average_capacity_price_eur_mwh",
-    )
-    df_melted_avg_cap_price["area"] = df_melted_avg_cap_price["area"].replace(
-        col_mapping
-    )
-    df_melted_max_cap_price = df.melt(
-        id_vars=id_vars,
-        value_vars=max_cap_price_cols,
-        var_name="area",
-        value_name="marginal_capacity_price_eur_mwh",
-    )
-    df_melted_max_cap_price["area"] = df_melted_max_cap_price["area"].replace(
-        col_mapping
-    )
-    df_melted_import_export = df.melt(
-        id_vars=id_vars,
-        value_vars=import_export_cols,
-        var_name="area",
-        value_name="import_export_mw",
-    )
-    df_melted_import_export["area"] = df_melted_import_export["area"].replace(
-        col_mapping
-    )
-    df_melted_sum_off_cap = df.melt(
-        id_vars=id_vars,
-        value_vars=sum_off_cap_cols,
-        var_name="area",
-        value_name="sum_of_offered_capacity_mw",
-    )
-    df_melted_sum_off_cap["area"] = df_melted_sum_off_cap["area"].replace(col_mapping)
-    df_melted_min_energy_price = df.melt(
-        id_vars=id_vars,
-        value_vars=min_energy_price_cols,
-        var_name="area",
-        value_name="min_energy_price_eur_mwh",
-    )
-    df_melted_min_energy_price["area"] = df_melted_min_energy_price["area"].replace(
-        col_mapping
-    )
-    df_melted_avg_energy_price = df.melt(
-        id_vars=id_vars,
-        value_vars=avg_energy_price_cols,
-        var_name="area",
-        value_name="average_energy_price_eur_mwh",
-    )
-    df_melted_avg_energy_price["area"] = df_melted_avg_energy_price["area"].replace(
-        col_mapping
-    )
-    df_melted_max_energy_price = df.melt(
-        id_vars=id_vars,
-        value_vars=max_energy_price_cols,
-        var_name="area",
-        value_name="marginal_energy_price_eur_mwh",
-    )
-    df_melted_max_energy_price["area"] = df_melted_max_energy_price["area"].replace(
-        col_mapping
-    )
-
-    dfs = [
-        df_melted_min_cap_price,
-        df_melted_avg_cap_price,
-        df_melted_max_cap_price,
-        df_melted_import_export,
-        df_melted_sum_off_cap,
-        df_melted_min_energy_price,
-        df_melted_avg_energy_price,
-        df_melted_max_energy_price,
-    ]
-    dfs = [df.set_index([*id_vars, "area"]) for df in dfs]
-    df_final = ft.reduce(lambda left, right: left.join(right, how="outer"), dfs)
-
-    pivot_cols = [
-        "min_capacity_price_eur_mwh",
-        "average_capacity_price_eur_mwh",
-        "marginal_capacity_price_eur_mwh",
-        "import_export_mw",
-        "sum_of_offered_capacity_mw",
-        "min_energy_price_eur_mwh",
-        "average_energy_price_eur_mwh",
-        "marginal_energy_price_eur_mwh",
-    ]
-
-    df_final = df_final.dropna(subset=pivot_cols, how="all")
-    return df_final.reset_index()
+    return reshape_area_columns(
+        df,
+        {
+            "_min_capacity_price_eur_mwh": "min_capacity_price_eur_mwh",
+            "_average_capacity_price_eur_mwh": "average_capacity_price_eur_mwh",
+            "_marginal_capacity_price_eur_mwh": "marginal_capacity_price_eur_mwh",
+            "_import_export_mw": "import_export_mw",
+            "_sum_of_offered_capacity_mw": "sum_of_offered_capacity_mw",
+            "_min_energy_price_eur_mwh": "min_energy_price_eur_mwh",
+            "_average_energy_price_eur_mwh": "average_energy_price_eur_mwh",
+            "_marginal_energy_price_eur_mwh": "marginal_energy_price_eur_mwh",
+        },
+    )
+
+
+def download_export(url, date_to_get):
+    date_str = date_to_get.strftime("%Y-%m-%d")
+    url_with_date = url.format(date_str=date_str)
+    response = requests.get(url_with_date, timeout=120)
+    response.raise_for_status()
+    return response.content
 
 
 def get_df_for_date(url, date_to_get, table_name):
-    date_str = date_to_get.strftime("%Y-%m-%d")
-    url_with_date = url.format(date_str=date_str)
+    content = download_export(url, date_to_get)
+    return prepare_df(parse_export(content, get_xlsx_engine(url)), table_name)
+
+
+def fetch_days(url, table_name, dates, downloader, parser):
+    """
+    Downloads the exports of the given dates concurrently and parses them in the process pool.
+    Yields the date with the DataFrame or the raised exception in the order of dates.
+    """
+    engine = get_xlsx_engine(url)
+    downloads = [downloader.submit(download_export, url, d) for d in dates]
+    parsed = []
+    for download in downloads:
+        try:
+            content = download.result()
+            parsed.append(parser.submit(parse_export, content, engine))
+        except Exception as e:
+            parsed.append(e)
+    for date_to_get, result in zip(dates, parsed):
+        if isinstance(result, Exception):
+            yield date_to_get, result
+            continue
+        try:
+            yield date_to_get, result.result()
+        except Exception as e:
+            yield date_to_get, e
+
+
+def get_xlsx_engine(url):
+    """
+    The exports of the cpp-publisher contain only plain values,
+    so they can be read with calamine, which is much faster than openpyxl.
+    """
+    if "cpp-publisher" in url and importlib.util.find_spec("python_calamine"):
+        return "calamine"
+    return "openpyxl"
+
+
+def read_export(content, engine="openpyxl"):
     warnings.filterwarnings(
         action="ignore",
         category=UserWarning,
         message="Workbook contains no default style, apply openpyxl's default",
     )
-    df = pd.read_excel(url_with_date, sheet_name="001", na_values=["-", "n.a.", "n.e."])
+    return pd.read_excel(
+        io.BytesIO(content),
+        sheet_name="001",
+        na_values=["-", "n.a.", "n.e."],
+        engine=engine,
+    )
+
+
+def benchmark_xlsx_engines(file_paths, repeat=3):
+    """
+    Compares the time to read recorded exports with openpyxl and calamine.
+
+    python regelleistung.py benchmark export1.xlsx export2.xlsx
+    """
+    contents = []
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            contents.append(f.read())
+    results = {}
+    for engine in ["openpyxl", "calamine"]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for content in contents:
+                read_export(content, engine)
+        results[engine] = (time.perf_counter() - start) / repeat
+        log.info(f"{engine}: {results[engine]:.3f}s for {len(contents)} files")
+    return results
+
+
+def parse_products(products):
+    """
+    Extracts the start and end hour of products like POS_00_04 as integer columns.
+    Products which do not match are NA.
+    """
+    hours = products.str.extract(r"^[^_]*_(\d+)_(\d+)")
+    hours = hours.apply(pd.to_numeric, errors="coerce").astype("Int16")
+    hours.columns = ["hours_from", "hours_to"]
+    return hours
+
+
+def unknown_products(df, table_name) -> list:
+    """
+    Returns the products of a parsed export whose hours can not be extracted.
+    """
+    if get_date_column_from_table_name(table_name) != "date_from" or df.empty:
+        return []
+    unknown = parse_products(df["product"]).isna().any(axis="columns").to_numpy()
+    return list(df.loc[unknown, "product"].unique())
+
+
+def parse_export(content, engine="openpyxl"):
+    df = read_export(content, engine)
     df.rename(mapper=lambda x: database_friendly(x), axis="columns", inplace=True)
+    return df
 
-    # adapt date_from and date_to column if from regelleistungsmarkt
-    if get_date_column_from_table_name(table_name) == "date_from" and df.shape[0] > 0:
-        product_split_array = (df["product"].str.split("_")).to_numpy()
-        hours_from = np.array([product_list[1] for product_list in product_split_array])
-        hours_to = np.array([product_list[2] for product_list in product_split_array])
-        timedelta_from = np.array([timedelta(hours=int(hour)) for hour in hours_from])
-        timedelta_to = np.array([timedelta(hours=int(hour)) for hour in hours_to])
-        df["date_from"] = df["date_from"] + pd.to_timedelta(timedelta_from, "d")
-        df["date_to"] = df["date_to"] + pd.to_timedelta(timedelta_to, "d")
-
-    # adapt mw column to mwh column
+
+def prepare_df(df, table_name):
+    """
+    Prepares the parsed exports of one or many days for the database
+    """
     if get_date_column_from_table_name(table_name) == "date_from" and df.shape[0] > 0:
-        hours_from = np.array([product_list[1] for product_list in product_split_array])
-        hours_to = np.array([product_list[2] for product_list in product_split_array])
-        hours_from_int = (hours_from).astype(np.int16)
-        hours_to_int = (hours_to).astype(np.int16)
-        hours_diff = hours_to_int - hours_from_int
+        hours = parse_products(df["product"])
+        valid = hours.notna().all(axis="columns").to_numpy()
+        if not valid.all():
+            unknown = list(df.loc[~valid, "product"].unique())
+            log.warning(
+                f"skipping {(~valid).sum()} rows of {table_name} with unknown products {unknown}"
+            )
+            df, hours = df[valid].copy(), hours[valid]
+        # adapt date_from and date_to column if from regelleistungsmarkt
+        df["date_from"] = df["date_from"] + pd.to_timedelta(hours["hours_from"], "h")
+        df["date_to"] = df["date_to"] + pd.to_timedelta(hours["hours_to"], "h")
+
+        # adapt mw column to mwh column
+        hours_diff = hours["hours_to"] - hours["hours_from"]
         cols_to_adapt = [
             "total_min_capacity_price_eur_mw",
             "total_average_capacity_price_eur_mw",
@@ -642,106 +621,66 @@ def write_concat_table(engine, table_name, new_data):
         complete_data.to_sql(table_name, conn, if_exists="replace", index=False)
 
 
-def write_past_entries(
-    engine,
-    table_name,
-    url,
-    earliest_date,
-    earliest_date_to_write=EARLIEST_DATE_TO_WRITE,
-):
-    data_for_date_exists = True
-    wrote_data = False
-    start_date = earliest_date - timedelta(days=1)
-
-    while data_for_date_exists and (earliest_date_to_write < earliest_date):
-        try:
-            earliest_date -= timedelta(days=1)
-            df = get_df_for_date(url, earliest_date, table_name)
-            with engine.begin() as conn:
-                df.to_sql(table_name, conn, if_exists="append", index=False)
-            wrote_data = True
-        except sqlalchemy.exc.ProgrammingError as e:
-            _, err_obj, _ = sys.exc_info()
-            if "psycopg2.errors.UndefinedColumn" in str(err_obj):
-                log.info(f"handling {repr(e)} by concat")
-                write_concat_table(engine, table_name, df)
-                log.info(f"replaced table {table_name}")
-                wrote_data = True
+def write_df(engine, table_name, df):
+    try:
+        with engine.begin() as conn:
+            df.to_sql(table_name, conn, if_exists="append", index=False)
+    except sqlalchemy.exc.ProgrammingError as e:
+        _, err_obj, _ = sys.exc_info()
+        if "psycopg2.errors.UndefinedColumn" in str(err_obj):
+            log.info(f"handling {repr(e)} by concat")
+            write_concat_table(engine, table_name, df)
+            log.info(f"replaced table {table_name}")
+        else:
+            raise
+
+
+def write_batch(engine, table_name, frames, parser):
+    """
+    Prepares the parsed exports of many days at once and writes them in one transaction
+    """
+    if not frames:
+        return False
+    batch = pd.concat(frames, ignore_index=True)
+    df = parser.submit(prepare_df, batch, table_name).result()
+    write_df(engine, table_name, df)
+    return True
+
+
+def write_missing_days(engine, table_name, url, missing_days, downloader, parser):
+    today_date = date.today()
+    for i in range(0, len(missing_days), DAYS_PER_BATCH):
+        dates = missing_days[i : i + DAYS_PER_BATCH]
+        frames = []
+        written = []
+        unavailable = []
+        for date_to_get, df in fetch_days(url, table_name, dates, downloader, parser):
+            if not isinstance(df, Exception):
+                if unknown := unknown_products(df, table_name):
+                    # the day is not marked as written, so it is retried
+                    log.error(
+                        f"unknown products {unknown} in {table_name} for {date_to_get}"
+                    )
+                    continue
+                frames.append(df)
+                written.append(date_to_get)
+            elif (
+                isinstance(df, requests.HTTPError)
+                and df.response.status_code < 500
+                and (today_date - date_to_get).days > DAYS_UNTIL_UNAVAILABLE
+            ):
+                unavailable.append(date_to_get)
             else:
-                log.error(f"Encountered error {e}")
-                data_for_date_exists = False
+                log.info(f"could not get {table_name} for {date_to_get}: {df}")
+        try:
+            write_batch(engine, table_name, frames, parser)
+            mark_days(engine, table_name, written)
         except Exception as e:
-            log.info(
-                f"The earliest date for {table_name} is the date {earliest_date}. {e}"
-            )
-            add_earliest_date_to_dict(earliest_date, table_name)
-            data_for_date_exists = False
-
-    if wrote_data:
-        log.info(
-            f"Finished writing {table_name} to Database with earliest date {earliest_date}"
-        )
-        add_latest_date_to_dict(start_date, table_name)
-        add_earliest_date_to_dict(earliest_date, table_name)
-    elif not wrote_data and data_for_date_exists:
-        log.info(
-            f"The defined date for the earliest entry was already reached in {table_name}. If you want to have more data, simply adjust the earliest date to write parameter."
-        )
-        add_earliest_date_to_dict(earliest_date, table_name)
-    else:
-        log.info(f"No past data was written for {table_name}")
-
-
-def create_table_and_write_past_data(
-    engine, url, table_name, earliest_date_to_write=EARLIEST_DATE_TO_WRITE
-):
-    log.info(f"Start creating table {table_name} and adding new data")
-    earliest_date = date.today()
-    write_past_entries(engine, table_name, url, earliest_date, earliest_date_to_write)
-
-
-def add_additional_past_entries(
-    engine, table_name, url, earliest_date_to_write=EARLIEST_DATE_TO_WRITE
-):
-    log.info(f"Start writing missing past entries in table {table_name} if any")
-    earliest_date = get_earliest_date(engine, table_name)
-    write_past_entries(engine, table_name, url, earliest_date, earliest_date_to_write)
-
-
-def write_new_data_from_latest_date_to_today(engine, url, table_name, latest_data_date):
-    log.info(f"Start writing new data to {table_name}")
-
-    today_date = datetime.today().date()
-
-    if latest_data_date == (today_date - timedelta(days=1)):
-        log.info(f"Table {table_name} has already the newest data.")
-    else:
-        latest_data_date = latest_data_date + timedelta(days=1)
-        encountered_problem = False
-        while latest_data_date < today_date and not encountered_problem:
-            try:
-                df = get_df_for_date(url, latest_data_date, table_name)
-                with engine.begin() as conn:
-                    df.to_sql(table_name, conn, if_exists="append", index=False)
-                latest_data_date += timedelta(days=1)
-            except sqlalchemy.exc.ProgrammingError as e:
-                _, err_obj, _ = sys.exc_info()
-                if "psycopg2.errors.UndefinedColumn" in str(err_obj):
-                    log.info(f"handling {repr(e)} by concat")
-                    write_concat_table(engine, table_name, df)
-                    log.info(f"replaced table {table_name}")
-                else:
-                    log.error(f"Encountered error {e}")
-                    encountered_problem = True
-            except Exception:
-                encountered_problem = True
-
-        if not encountered_problem:
-            add_latest_date_to_dict(latest_data_date - timedelta(days=1), table_name)
-
-        log.info(
-            f"Finished writing new data to {table_name} with newest date being yesterday {(latest_data_date - timedelta(days=1))}"
-        )
+            log.error(f"Encountered error {e}")
+            return
+        if unavailable:
+            mark_days(engine, table_name, unavailable, "unavailable")
+    log.info(f"Finished writing {len(missing_days)} missing days to {table_name}")
 
 
 def create_hypertable(engine, table_name):
@@ -759,98 +698,58 @@ def write_data_in_table(
     engine,
     table_name,
     url,
+    downloader,
+    parser,
     earliest_date_to_write=EARLIEST_DATE_TO_WRITE,
-    write_additional_past_entries_if_any=True,
 ):
-    if os.path.isfile(FILE_PATH_DATE_IN_DB):
-        f = open(FILE_PATH_DATE_IN_DB)
-        global DATES_IN_DB
-        DATES_IN_DB = json.load(f)
-
-    latest_date = get_latest_date(engine, table_name)
-    add_latest_date_to_dict(latest_date, table_name)
-    if latest_date is not None:
-        write_new_data_from_latest_date_to_today(engine, url, table_name, latest_date)
-        if write_additional_past_entries_if_any:
-            add_additional_past_entries(engine, table_name, url, earliest_date_to_write)
-    else:
-        create_table_and_write_past_data(
-            engine, url, table_name, earliest_date_to_write
+    init_coverage(engine, table_name)
+    yesterday = date.today() - timedelta(days=1)
+    missing_days = get_missing_days(
+        engine, table_name, earliest_date_to_write, yesterday
+    )
+    if missing_days:
+        log.info(
+            f"Start writing {len(missing_days)} missing days to {table_name} from {missing_days[0]} to {missing_days[-1]}"
         )
+        write_missing_days(engine, table_name, url, missing_days, downloader, parser)
+    else:
+        log.info(f"Table {table_name} has already the newest data.")
     create_hypertable(engine, table_name)
 
-    with open(FILE_PATH_DATE_IN_DB, "w") as outfile:
-        json.dump(DATES_IN_DB, outfile)
-
 
 def write_all_tables(engine):
-    # Regelleistungsmarkt
-    write_data_in_table(engine, TABLE_NAME_FCR_DEMANDS, URL_FCR_DEMANDS)
-    write_data_in_table(engine, TABLE_NAME_FCR_RESULTS, URL_FCR_RESULTS)
-    write_data_in_table(engine, TABLE_NAME_FCR_ANONYM_RESULTS, URL_FCR_ANONYM_RESULTS)
-
-    write_data_in_table(
-        engine, TABLE_NAME_AFRR_DEMANDS_CAPACITY, URL_AFRR_DEMANDS_CAPACITY
-    )
-    write_data_in_table(
-        engine, TABLE_NAME_AFRR_RESULTS_CAPACITY, URL_AFRR_RESULTS_CAPACITY
-    )
-    write_data_in_table(
-        engine,
-        TABLE_NAME_AFRR_ANONYM_RESULTS_CAPACITY,
-        URL_AFRR_ANONYM_RESULTS_CAPACITY,
-    )
-
-    write_data_in_table(
-        engine, TABLE_NAME_MFRR_DEMANDS_CAPACITY, URL_MFRR_DEMANDS_CAPACITY
-    )
-    write_data_in_table(
-        engine, TABLE_NAME_MFRR_RESULTS_CAPACITY, URL_MFRR_RESULTS_CAPACITY
-    )
-    write_data_in_table(
-        engine,
-        TABLE_NAME_MFRR_ANONYM_RESULTS_CAPACITY,
-        URL_MFRR_ANONYM_RESULTS_CAPACITY,
-    )
-
-    # Regelarbeitsmarkt
-    write_data_in_table(engine, TABLE_NAME_AFRR_DEMANDS_ENERGY, URL_AFRR_DEMANDS_ENERGY)
-    write_data_in_table(engine, TABLE_NAME_AFRR_RESULTS_ENERGY, URL_AFRR_RESULTS_ENERGY)
-    write_data_in_table(
-        engine,
-        TABLE_NAME_AFRR_ANONYM_RESULTS_ENERGY,
-        URL_AFRR_ANONYM_RESULTS_ENERGY,
-    )
-
-    write_data_in_table(engine, TABLE_NAME_MFRR_DEMANDS_ENERGY, URL_MFRR_DEMANDS_ENERGY)
-    write_data_in_table(engine, TABLE_NAME_MFRR_RESULTS_ENERGY, URL_MFRR_RESULTS_ENERGY)
-    write_data_in_table(
-        engine,
-        TABLE_NAME_MFRR_ANONYM_RESULTS_ENERGY,
-        URL_MFRR_ANONYM_RESULTS_ENERGY,
-    )
-
-    # Abschaltbare Lasten
-    write_data_in_table(engine, TABLE_NAME_ABLA_DEMANDS_ENERGY, URL_ABLA_DEMANDS_ENERGY)
-    write_data_in_table(engine, TABLE_NAME_ABLA_RESULTS_ENERGY, URL_ABLA_RESULTS_ENERGY)
-    write_data_in_table(
-        engine,
-        TABLE_NAME_ABLA_ANONYM_RESULTS_ENERGY,
-        URL_ABLA_ANONYM_RESULTS_ENERGY,
-    )
+    """
+    Writes all tables concurrently.
+    The exports are downloaded in a shared thread pool and parsed in a process pool,
+    while the missing days of each table are written in order by the thread of the table.
+    """
+    create_coverage_table(engine)
+    with (
+        ThreadPoolExecutor(max_workers=MAX_DOWNLOADS) as downloader,
+        ProcessPoolExecutor() as parser,
+        ThreadPoolExecutor(max_workers=MAX_TABLES) as table_executor,
+    ):
+        futures = {
+            table_executor.submit(
+                write_data_in_table, engine, table_name, url, downloader, parser
+            ): table_name
+            for table_name, url in TABLES.items()
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                log.error(f"could not write table {futures[future]}: {e}")
 
 
 def main(db_uri):
-    if os.path.isfile(FILE_PATH_DATE_IN_DB):
-        f = open(FILE_PATH_DATE_IN_DB)
-        global DATES_IN_DB
-        DATES_IN_DB = json.load(f)
     engine = create_engine(db_uri)
     write_all_tables(engine)
-    with open(FILE_PATH_DATE_IN_DB, "w") as outfile:
-        json.dump(DATES_IN_DB, outfile)
 
 
 if __name__ == "__main__":
     logging.basicConfig()
-    main(db_uri("regelleistung"))
+    if len(sys.argv) > 2 and sys.argv[1] == "benchmark":
+        benchmark_xlsx_engines(sys.argv[2:])
+    else:
+        main(db_uri("regelleistung"))
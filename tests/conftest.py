@@ -0,0 +1,12 @@
+# SPDX-FileCopyrightText: Florian Maurer
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import os
+import sys
+
+# the crawlers import their helpers like when they are run from the crawler folder
+# the tests need a crawler/common/config.py like the crawlers
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, "crawler"))
+sys.path.insert(0, root)
@@ -0,0 +1,95 @@
+# SPDX-FileCopyrightText: Florian Maurer
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+
+from common.adaptive_window import AdaptiveWindow
+
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def engine():
+    return create_engine("sqlite://")
+
+
+def make_window(engine, initial=timedelta(days=4)):
+    return AdaptiveWindow(
+        engine,
+        "test",
+        initial=initial,
+        minimum=timedelta(days=1),
+        maximum=timedelta(days=8),
+    )
+
+
+def test_clip_to_multiple_of_minimum(engine):
+    window = make_window(engine)
+    assert window.clip(timedelta(hours=60)) == timedelta(days=2)
+    assert window.clip(timedelta(hours=1)) == timedelta(days=1)
+    assert window.clip(timedelta(days=100)) == timedelta(days=8)
+
+
+def test_adapt_grows_and_shrinks(engine):
+    window = make_window(engine)
+    window.adapt(duration=1, rows=10)
+    assert window.size == timedelta(days=8)
+    window.adapt(duration=100, rows=10)
+    assert window.size == timedelta(days=4)
+    window.adapt(duration=1, rows=window.max_rows + 1)
+    assert window.size == timedelta(days=2)
+
+
+def test_fetch_range_covers_range(engine):
+    window = make_window(engine)
+    end = START + timedelta(days=10)
+    windows = [(s, e) for s, e, _ in window.fetch_range(START, end, lambda s, e: None)]
+    assert windows[0][0] == START
+    assert windows[-1][1] == end
+    for (_, previous_end), (next_start, _) in zip(windows, windows[1:]):
+        assert previous_end == next_start
+
+
+def test_fetch_range_retries_with_smaller_window(engine):
+    window = make_window(engine)
+    calls = []
+
+    def fetch(start, end):
+        calls.append(end - start)
+        if end - start > timedelta(days=1):
+            raise ValueError("too large")
+        return None
+
+    windows = list(window.fetch_range(START, START + timedelta(days=2), fetch))
+    # the range is shorter than the window, so it fails twice with two days
+    days = [call.days for call in calls]
+    assert days == [2, 2, 1, 1]
+    assert [e for _, e, _ in windows] == [
+        START + timedelta(days=1),
+        START + timedelta(days=2),
+    ]
+
+
+def test_fetch_range_stops_at_failing_minimum_window(engine):
+    window = make_window(engine, initial=timedelta(days=1))
+    failing = START + timedelta(days=1)
+
+    def fetch(start, end):
+        if start == failing:
+            raise ValueError("no data")
+        return None
+
+    windows = list(window.fetch_range(START, START + timedelta(days=5), fetch))
+    # later windows would make the failed one a permanent gap
+    assert [(s, e) for s, e, _ in windows] == [(START, failing)]
+
+
+def test_learned_size_is_stored(engine):
+    window = make_window(engine)
+    window.size = timedelta(days=2)
+    window.save_size()
+    assert make_window(engine).size == timedelta(days=2)
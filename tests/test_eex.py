@@ -0,0 +1,43 @@
+# SPDX-FileCopyrightText: Florian Maurer
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from eex import file_hash, read_eex_market_file
+
+MARKET_FILE = """# Prices
+# Data type(ST);Trading Date;Product;Volume
+# Data type(PR);Trading Date;Product;Price
+# Data type(AL);Trading Date;Text
+ST;2024-01-02;F1BY;12,5
+AL;2024-01-02;ignored
+PR;2024-01-02;F1BY;80,25
+ST;2024-01-03;F1BY;3
+"""
+
+
+def test_read_eex_market_file(tmp_path):
+    filename = tmp_path / "market.csv"
+    filename.write_text(MARKET_FILE)
+    tables = read_eex_market_file(filename, "power")
+    # record types without lines and 'AL' lines are not stored
+    assert sorted(tables) == ["power_PR", "power_ST"]
+
+    st = tables["power_ST"]
+    assert st.columns[:3].tolist() == ["Data type(ST)", "Trading Date", "Product"]
+    assert st["Trading Date"].tolist() == ["2024-01-02", "2024-01-03"]
+    assert st.iloc[:, 3].tolist() == [12.5, 3.0]
+
+    pr = tables["power_PR"]
+    assert len(pr) == 1
+    assert pr.iloc[0, 3] == 80.25
+    for column in ["Strike", "Underlying", "Type"]:
+        assert pr[column].isna().all()
+
+
+def test_file_hash_changes_with_content(tmp_path):
+    filename = tmp_path / "market.csv"
+    filename.write_text(MARKET_FILE)
+    first = file_hash(filename)
+    assert file_hash(filename) == first
+    filename.write_text(MARKET_FILE + "ST;2024-01-04;F1BY;1\n")
+    assert file_hash(filename) != first
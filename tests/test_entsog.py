@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: Florian Maurer
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import pytest
+import requests
+
+import entsog
+from entsog import EntsogClient, parse_retry_after
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, payload=None, headers=None, text=""):
+        self.status_code = status_code
+        self.payload = payload or {}
+        self.headers = headers or {}
+        self.text = text
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(str(self.status_code))
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append(params)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waits = []
+    monkeypatch.setattr(entsog.time, "sleep", waits.append)
+    return waits
+
+
+def make_client(responses, page_size=2):
+    client = EntsogClient(page_size=page_size, max_workers=1, retries=3, backoff=1)
+    client.session = FakeSession(responses)
+    return client
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2", 5) == 2.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT", 5) == 5
+    assert parse_retry_after(None, 5) == 5
+
+
+def test_request_retries_transport_and_server_errors(sleeps):
+    client = make_client(
+        [
+            requests.exceptions.Timeout("slow"),
+            FakeResponse(429, headers={"Retry-After": "7"}),
+            FakeResponse(200, {"operators": [{"operatorKey": "A"}]}),
+        ]
+    )
+    data = client.get_data_frame("operators")
+    assert data["operatorkey"].tolist() == ["A"]
+    assert sleeps == [1, 7]
+
+
+def test_request_gives_up_after_retries(sleeps):
+    client = make_client([FakeResponse(503)] * 3)
+    with pytest.raises(Exception, match="could not get"):
+        client.request("url", {})
+    assert sleeps == [1, 2, 4]
+
+
+def test_not_found_is_empty(sleeps):
+    client = make_client([FakeResponse(404)])
+    assert client.get_page("operators", {}, 0) == ([], 0)
+    assert sleeps == []
+
+
+def test_get_data_frame_requests_all_pages(sleeps):
+    client = make_client(
+        [
+            FakeResponse(
+                200, {"operators": [{"a": 1}, {"a": 2}], "meta": {"total": 3}}
+            ),
+            FakeResponse(200, {"operators": [{"a": 3}]}),
+        ]
+    )
+    data = client.get_data_frame("operators", {"from": "2024-01-01"})
+    assert data["a"].tolist() == [1, 2, 3]
+    assert [call["offset"] for call in client.session.calls] == [0, 2]
+    assert client.session.calls[1]["from"] == "2024-01-01"
+
+
+def test_get_csv_frame(sleeps):
+    client = make_client([FakeResponse(200, text="periodFrom,Value\n2024-01-01,1\n")])
+    data = client.get_csv_frame("operationaldata")
+    assert data.columns.tolist() == ["periodfrom", "value"]
+    assert client.session.calls[0]["limit"] == -1
@@ -0,0 +1,42 @@
+# SPDX-FileCopyrightText: Florian Maurer
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("jao")
+
+from crawler.jao_crawler import MIN_WEEKLY_DATE, plan_intervals  # noqa: E402
+
+FROM_DATE = datetime(2022, 1, 1)
+TO_DATE = datetime(2024, 1, 1)
+
+
+def test_plan_intervals_without_coverage():
+    intervals = plan_intervals(["Daily"], ["A", "B"], {}, FROM_DATE, TO_DATE)
+    assert intervals == [
+        ("A", "Daily", FROM_DATE, TO_DATE),
+        ("B", "Daily", FROM_DATE, TO_DATE),
+    ]
+
+
+def test_plan_intervals_before_and_after_coverage():
+    coverage = {("A", "Daily"): (datetime(2023, 1, 1), datetime(2023, 6, 1))}
+    intervals = plan_intervals(["Daily"], ["A"], coverage, FROM_DATE, TO_DATE)
+    assert intervals == [
+        ("A", "Daily", FROM_DATE, datetime(2023, 1, 1)),
+        ("A", "Daily", datetime(2023, 6, 1), TO_DATE),
+    ]
+
+
+def test_plan_intervals_complete_coverage():
+    coverage = {("A", "Daily"): (FROM_DATE, TO_DATE)}
+    assert plan_intervals(["Daily"], ["A"], coverage, FROM_DATE, TO_DATE) == []
+
+
+def test_plan_intervals_horizons():
+    intervals = plan_intervals(["Intraday", "Weekly"], ["A"], {}, FROM_DATE, TO_DATE)
+    # intraday is not crawled, weekly auctions start later
+    assert intervals == [("A", "Weekly", MIN_WEEKLY_DATE, TO_DATE)]
@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: Florian Maurer
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import pandas as pd
+
+from mastr import apply_types, infer_type, record_keys
+
+
+def test_record_keys_do_not_depend_on_batch_columns():
+    narrow = pd.DataFrame({"EinheitMastrNummer": ["SEE1"], "Leistung": ["10.5"]})
+    wide = pd.DataFrame(
+        {
+            "Leistung": ["10.5", "3"],
+            "EinheitMastrNummer": ["SEE1", "SEE2"],
+            "Ort": [None, "Aachen"],
+        }
+    )
+    narrow_keys = record_keys(narrow, "EinheitMastrNummer")
+    wide_keys = record_keys(wide, "EinheitMastrNummer")
+    assert narrow_keys["id"].tolist() == ["SEE1"]
+    assert wide_keys["id"].tolist() == ["SEE1", "SEE2"]
+    assert narrow_keys["hash"][0] == wide_keys["hash"][0]
+
+
+def test_record_keys_change_with_values():
+    before = pd.DataFrame({"id": ["1", "1"], "Ort": ["Aachen", None]})
+    after = pd.DataFrame({"id": ["1", "1"], "Ort": ["Köln", ""]})
+    hashes = record_keys(before, "id")["hash"] != record_keys(after, "id")["hash"]
+    # an empty string is a value, unlike a missing field
+    assert hashes.tolist() == [True, True]
+
+
+def test_infer_type():
+    assert infer_type("Hausnummer", pd.Series(["12"])) == "text"
+    assert infer_type("Inbetriebnahmedatum", pd.Series(["2020-01-01"])) == "timestamp"
+    assert infer_type("Leistung", pd.Series(["10", None])) == "bigint"
+    assert infer_type("Leistung", pd.Series(["10.5"])) == "double precision"
+    assert infer_type("Leistung", pd.Series(["10", "viel"])) == "text"
+    assert infer_type("Leistung", pd.Series([None])) == "text"
+
+
+def test_apply_types_stores_mismatches_as_null():
+    df = pd.DataFrame(
+        {
+            "Leistung": ["10", "10.5", None],
+            "Datum": ["2020-01-01", "kein", None],
+            "Ort": ["Aachen", "1", None],
+        }
+    )
+    types = {"Leistung": "bigint", "Datum": "timestamp", "Ort": "text"}
+    result = apply_types(df.copy(), types)
+    assert result["Leistung"].isna().tolist() == [False, True, True]
+    assert result["Leistung"][0] == 10
+    assert result["Datum"][0] == pd.Timestamp("2020-01-01")
+    assert result["Datum"].isna().tolist() == [False, True, True]
+    assert result["Ort"].tolist() == df["Ort"].tolist()
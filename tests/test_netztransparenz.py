@@ -0,0 +1,58 @@
+# SPDX-FileCopyrightText: Florian Maurer
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import pandas as pd
+
+from netztransparenz import month_ranges, to_utc, to_utc_strptime
+
+
+def test_month_ranges_split_at_month_start():
+    assert month_ranges("2024-01-15T12:00:00", "2024-03-02T00:00:00") == [
+        ("2024-01-15T12:00:00", "2024-02-01T00:00:00"),
+        ("2024-02-01T00:00:00", "2024-03-01T00:00:00"),
+        ("2024-03-01T00:00:00", "2024-03-02T00:00:00"),
+    ]
+
+
+def test_month_ranges_within_month():
+    assert month_ranges("2024-05-02T00:00:00", "2024-05-03T00:00:00") == [
+        ("2024-05-02T00:00:00", "2024-05-03T00:00:00")
+    ]
+
+
+def test_month_ranges_empty():
+    assert month_ranges("2024-05-02T00:00:00", "2024-05-02T00:00:00") == []
+
+
+def test_to_utc_observes_daylight_saving_time():
+    dates = pd.Series(["2024-07-01", "2024-01-01", "2024-07-01"])
+    times = pd.Series(["10:00", "10:00", "10:00"])
+    zones = pd.Series(["CET", "CET", "UTC"])
+    assert to_utc(dates, times, zones).tolist() == [
+        pd.Timestamp("2024-07-01 08:00"),
+        pd.Timestamp("2024-01-01 09:00"),
+        pd.Timestamp("2024-07-01 10:00"),
+    ]
+
+
+def test_to_utc_matches_strptime():
+    timestamps = pd.date_range("2024-03-30", "2024-04-02", freq="15min")
+    # the hour which does not exist in CET
+    timestamps = timestamps[~((timestamps.day == 31) & (timestamps.hour == 2))]
+    dates = pd.Series(timestamps.strftime("%d.%m.%Y"))
+    times = pd.Series(timestamps.strftime("%H:%M"))
+    zones = pd.Series(["CET" if i % 2 else "UTC" for i in range(len(timestamps))])
+    expected = to_utc_strptime(dates, times, zones, "%d.%m.%Y")
+    assert to_utc(dates, times, zones, "%d.%m.%Y").tolist() == expected.tolist()
+
+
+def test_to_utc_without_zones_and_missing_zone():
+    dates = pd.Series(["2024-07-01", "2024-07-01"])
+    times = pd.Series(["10:00", "11:00"])
+    assert to_utc(dates, times).tolist() == [
+        pd.Timestamp("2024-07-01 10:00"),
+        pd.Timestamp("2024-07-01 11:00"),
+    ]
+    result = to_utc(dates, times, pd.Series(["UTC", None]))
+    assert result.isna().tolist() == [False, True]
@@ -0,0 +1,39 @@
+# SPDX-FileCopyrightText: Florian Maurer
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.rate_limiter import RateLimiter
+
+
+def test_first_call_does_not_wait():
+    limiter = RateLimiter(1)
+    start = time.monotonic()
+    limiter.wait()
+    assert time.monotonic() - start < 0.1
+
+
+def test_calls_are_spaced():
+    limiter = RateLimiter(20)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.wait()
+    # the first call is immediate, the next four wait 0.05s each
+    assert time.monotonic() - start >= 0.19
+
+
+def test_limit_is_shared_by_threads():
+    limiter = RateLimiter(20)
+    calls = []
+
+    def call():
+        limiter.wait()
+        calls.append(time.monotonic())
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for _ in range(8):
+            executor.submit(call)
+    calls.sort()
+    assert calls[-1] - calls[0] >= 0.34
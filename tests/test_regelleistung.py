@@ -0,0 +1,63 @@
+# SPDX-FileCopyrightText: Florian Maurer
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import pandas as pd
+
+from regelleistung import (
+    TABLE_NAME_FCR_RESULTS,
+    parse_products,
+    reshape_area_columns,
+    unknown_products,
+)
+
+
+def test_parse_products():
+    hours = parse_products(pd.Series(["POS_00_04", "NEGATIVE_20_24"]))
+    assert hours["hours_from"].tolist() == [0, 20]
+    assert hours["hours_to"].tolist() == [4, 24]
+
+
+def test_parse_products_unknown_is_na():
+    hours = parse_products(pd.Series(["POS_00_04", "ODD", None]))
+    assert hours["hours_from"].isna().tolist() == [False, True, True]
+
+
+def test_unknown_products():
+    df = pd.DataFrame({"product": ["POS_00_04", "ODD", "ODD"]})
+    assert unknown_products(df, TABLE_NAME_FCR_RESULTS) == ["ODD"]
+    assert unknown_products(df.iloc[:1], TABLE_NAME_FCR_RESULTS) == []
+
+
+def test_reshape_area_columns():
+    df = pd.DataFrame(
+        {
+            "date_from": ["d1", "d2"],
+            "germany_demand_mw": [1.0, 2.0],
+            "germany_deficit_surplus_mw": [3.0, None],
+            "austria_demand_mw": [None, None],
+            "austria_deficit_surplus_mw": [None, None],
+        }
+    )
+    result = reshape_area_columns(
+        df,
+        {"_demand_mw": "demand_mw", "_deficit_surplus_mw": "deficit_surplus_mw"},
+    )
+    # areas without any value are dropped
+    assert result["area"].tolist() == ["germany", "germany"]
+    assert result["date_from"].tolist() == ["d1", "d2"]
+    assert result["demand_mw"].tolist() == [1.0, 2.0]
+    assert result["deficit_surplus_mw"].isna().tolist() == [False, True]
+
+
+def test_reshape_area_columns_area_of():
+    df = pd.DataFrame({"id": [1], "germany_country_demand_mw": [5.0]})
+    result = reshape_area_columns(
+        df, {"_demand_mw": "demand_mw"}, area_of=lambda prefix: prefix.split("_")[0]
+    )
+    assert result[["id", "area", "demand_mw"]].values.tolist() == [[1, "germany", 5.0]]
+
+
+def test_reshape_area_columns_without_area_columns():
+    df = pd.DataFrame({"id": [1]})
+    assert reshape_area_columns(df, {"_demand_mw": "demand_mw"}) is df